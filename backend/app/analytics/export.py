@@ -0,0 +1,276 @@
+"""レース履歴のParquetエクスポート"""
+import os
+import glob
+import json
+import shutil
+import argparse
+import threading
+from datetime import date
+from typing import Dict, List, Set
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Integer, Float, String, Text, Date, DateTime, Boolean, func, select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import db_models
+
+
+EXPORT_DIR = "data/parquet"
+MANIFEST_NAME = "_manifest.json"
+
+_ARROW_TYPES = [
+    (Boolean, pa.bool_()),
+    (Integer, pa.int64()),
+    (Float, pa.float64()),
+    (DateTime, pa.timestamp("us")),
+    (Date, pa.date32()),
+    (String, pa.string()),
+    (Text, pa.string()),
+]
+
+# 出走表・結果にはレース属性を付けて単独で集計できるようにする
+RACE_CONTEXT_COLUMNS = ["race_date", "venue_code", "venue_name", "race_no", "race_grade"]
+
+TABLES = {
+    "races": db_models.Race,
+    "entries": db_models.RaceEntry,
+    "results": db_models.RaceResult,
+}
+
+# 同じプロセス内のエクスポートを1つずつ実行する（同じパーティション・マニフェストを書き換えるため）
+_export_lock = threading.Lock()
+
+
+def _arrow_type(column) -> pa.DataType:
+    for sa_type, arrow_type in _ARROW_TYPES:
+        if isinstance(column.type, sa_type):
+            return arrow_type
+    return pa.string()
+
+
+def _table_columns(model) -> List:
+    """エクスポートするカラム（出走表・結果はレース属性を先頭に付与）"""
+    columns = list(model.__table__.columns)
+    if model is not db_models.Race:
+        columns = [db_models.Race.__table__.c[name] for name in RACE_CONTEXT_COLUMNS] + columns
+    return columns
+
+
+def table_schema(name: str) -> pa.Schema:
+    """テーブルごとの固定スキーマ（パーティション列を除く）"""
+    return pa.schema([pa.field(c.name, _arrow_type(c)) for c in _table_columns(TABLES[name])])
+
+
+def _column_checksum(model):
+    """
+    テーブルの全カラムの加重和（更新時刻を持たない出走表・結果の訂正を検出するため）
+
+    数値はそのまま、日付はユリウス日、文字列は長さと先頭の文字コードを、列の番号で重み付けして合計する
+    """
+    values = []
+    for column in model.__table__.columns:
+        if isinstance(column.type, (Date, DateTime)):
+            value = func.julianday(column)
+        elif isinstance(column.type, (String, Text)):
+            value = func.length(column) + func.unicode(column)
+        else:
+            value = column
+        values.append(func.coalesce(value, 0))
+    return func.total(sum((i + 1) * value for i, value in enumerate(values)))
+
+
+def _partition_dir(root: str, table: str, year: int, month: int, venue: str) -> str:
+    """パーティションのディレクトリ（hive形式: year=2024/month=01/venue=12）"""
+    return os.path.join(root, table, f"year={year}", f"month={month:02d}", f"venue={venue}")
+
+
+class ParquetExporter:
+    """
+    レース・出走表・結果を年月×会場でパーティション分割したParquetに書き出す
+
+    パーティション単位で yield_per によりDBから行をストリーミングし、
+    chunk_size 行ごとにRecordBatchとして書き込むためメモリ使用量は一定。
+    パーティションごとのウォーターマークを _manifest.json に記録し、
+    差分エクスポートでは変化のあったパーティションだけを書き直す。
+    """
+
+    def __init__(self, export_dir: str = EXPORT_DIR, chunk_size: int = 20_000):
+        self.export_dir = export_dir
+        self.chunk_size = chunk_size
+        self.manifest_path = os.path.join(export_dir, MANIFEST_NAME)
+
+    def read_manifest(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"partitions": {}}
+
+    def _write_manifest(self, manifest: Dict):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def stored_partitions(self) -> Set[str]:
+        """ディスク上にあるパーティションのキー（年月/会場、マニフェストにない古いものも含む）"""
+        keys = set()
+        for table in TABLES:
+            pattern = os.path.join(self.export_dir, table, "year=*", "month=*", "venue=*")
+            for path in glob.glob(pattern):
+                month_path, venue_dir = os.path.split(path)
+                year_path, month_dir = os.path.split(month_path)
+                year_dir = os.path.basename(year_path)
+                try:
+                    year, month = int(year_dir[len("year="):]), int(month_dir[len("month="):])
+                except ValueError:
+                    continue
+                keys.add(f"{year:04d}-{month:02d}/{venue_dir[len('venue='):]}")
+        return keys
+
+    def partition_watermarks(self, db: Session) -> Dict[str, List]:
+        """
+        (年月, 会場) ごとのウォーターマーク
+
+        [レース件数, レースの最終更新, 出走表の件数, 最大ID, 結果の件数, 最大ID,
+         出走表のチェックサム, 結果のチェックサム]
+        """
+        month = func.strftime("%Y-%m", db_models.Race.race_date)
+        venue = db_models.Race.venue_code
+        marks = {}
+
+        races = db.query(
+            month, venue, func.count(db_models.Race.id), func.max(db_models.Race.updated_at)
+        ).group_by(month, venue).all()
+        for m, v, count, updated in races:
+            if m and v:
+                marks[f"{m}/{v}"] = [count, str(updated), 0, None, 0, None, 0.0, 0.0]
+
+        for offset, checksum_offset, model in ((2, 6, db_models.RaceEntry), (4, 7, db_models.RaceResult)):
+            rows = db.query(
+                month, venue, func.count(model.id), func.max(model.id), _column_checksum(model)
+            ).join(model, model.race_id == db_models.Race.id).group_by(month, venue).all()
+            for m, v, count, max_id, checksum in rows:
+                key = f"{m}/{v}"
+                if key in marks:
+                    marks[key][offset:offset + 2] = [count, max_id]
+                    marks[key][checksum_offset] = round(checksum, 6)
+
+        return marks
+
+    def _export_partition(self, db: Session, table: str, year: int, month: int, venue: str) -> int:
+        """1パーティション分をストリーミングで書き出し（一時ファイル経由で置き換え）"""
+        model = TABLES[table]
+        columns = _table_columns(model)
+        schema = table_schema(table)
+
+        start = date(year, month, 1)
+        end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        stmt = select(*columns)
+        if model is not db_models.Race:
+            stmt = stmt.join(db_models.Race, db_models.Race.id == model.race_id)
+        stmt = stmt.where(
+            db_models.Race.race_date >= start,
+            db_models.Race.race_date < end,
+            db_models.Race.venue_code == venue,
+        ).order_by(
+            db_models.Race.race_date, db_models.Race.race_no, model.id
+        ).execution_options(yield_per=self.chunk_size)
+
+        out_dir = _partition_dir(self.export_dir, table, year, month, venue)
+        os.makedirs(out_dir, exist_ok=True)
+        final_path = os.path.join(out_dir, "part-0.parquet")
+        tmp_path = f"{final_path}.tmp-{os.getpid()}"
+
+        rows = 0
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+            for chunk in db.execute(stmt).partitions():
+                arrays = [
+                    pa.array([row[i] for row in chunk], type=field.type)
+                    for i, field in enumerate(schema)
+                ]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows += len(chunk)
+
+        if rows == 0:
+            os.remove(tmp_path)
+            if os.path.exists(final_path):
+                os.remove(final_path)
+        else:
+            os.replace(tmp_path, final_path)
+        return rows
+
+    def export(self, db: Session, incremental: bool = True, verbose: bool = False) -> Dict:
+        """
+        全履歴をエクスポート（同時に呼ばれた場合は前のエクスポートの完了を待つ）
+
+        Args:
+            incremental: True の場合はウォーターマークが変わったパーティションのみ書き出す
+
+        Returns:
+            exported: 書き出したパーティション数, skipped: 変化がなく省略した数,
+            removed: 削除したパーティション数, rows: テーブル別行数
+        """
+        with _export_lock:
+            return self._export(db, incremental, verbose)
+
+    def _export(self, db: Session, incremental: bool, verbose: bool) -> Dict:
+        os.makedirs(self.export_dir, exist_ok=True)
+        manifest = self.read_manifest() if incremental else {"partitions": {}}
+        partitions = manifest["partitions"]
+        marks = self.partition_watermarks(db)
+
+        targets = [key for key in sorted(marks) if partitions.get(key) != marks[key]]
+        # 全件書き直しではマニフェストを使わないので、DBからなくなったパーティションはディスクから探す
+        removed = (set(partitions) | self.stored_partitions()) - set(marks)
+        rows = {table: 0 for table in TABLES}
+
+        for key in sorted(removed):
+            ym, venue = key.split("/")
+            year, month = map(int, ym.split("-"))
+            for table in TABLES:
+                shutil.rmtree(_partition_dir(self.export_dir, table, year, month, venue), ignore_errors=True)
+            partitions.pop(key, None)
+
+        for key in targets:
+            ym, venue = key.split("/")
+            year, month = map(int, ym.split("-"))
+            for table in TABLES:
+                rows[table] += self._export_partition(db, table, year, month, venue)
+            partitions[key] = marks[key]
+            if verbose:
+                print(f"  exported {key}")
+
+        manifest["exported_at"] = str(date.today())
+        manifest["schema_version"] = 1
+        self._write_manifest(manifest)
+
+        return {"exported": len(targets), "skipped": len(marks) - len(targets), "removed": len(removed), "rows": rows}
+
+
+def dataset_path(table: str, export_dir: str = EXPORT_DIR) -> str:
+    """テーブルのParquetファイル群を指すglobパス"""
+    return os.path.join(export_dir, table, "**", "*.parquet")
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Export race history as partitioned Parquet")
+    parser.add_argument("--output", default=EXPORT_DIR)
+    parser.add_argument("--full", action="store_true", help="rewrite every partition")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = ParquetExporter(args.output).export(db, incremental=not args.full, verbose=True)
+    finally:
+        db.close()
+
+    print(f"Exported {result['exported']} partitions (skipped {result['skipped']} unchanged)")
+    for table, count in result["rows"].items():
+        print(f"  {table}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
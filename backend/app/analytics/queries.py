@@ -0,0 +1,230 @@
+"""エクスポート済みParquetに対する分析クエリ（DuckDB）"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import duckdb
+
+from app.analytics.export import EXPORT_DIR, MANIFEST_NAME, TABLES, dataset_path
+
+
+# 共通の絞り込み条件（パラメータが未指定なら条件なし）
+_RACE_FILTER = """
+    ($venue_code IS NULL OR ra.venue_code = $venue_code)
+    AND ($start_date IS NULL OR ra.race_date >= $start_date)
+    AND ($end_date IS NULL OR ra.race_date <= $end_date)
+"""
+
+_COMMON_PARAMS = {
+    "venue_code": (str, None),
+    "start_date": (date, None),
+    "end_date": (date, None),
+}
+
+# 許可されたクエリ一覧（名前 → 説明・SQL・パラメータ定義 {名前: (型, 既定値)}）
+QUERIES = {
+    "course_win_rate": {
+        "description": "進入コース別の1着率（風速・波高で絞り込み可）",
+        "sql": f"""
+            SELECT c.course,
+                   COUNT(*) AS races,
+                   AVG(CASE WHEN res.place_1 = COALESCE(
+                       [res.course_1, res.course_2, res.course_3,
+                        res.course_4, res.course_5, res.course_6][c.course], c.course
+                   ) THEN 1 ELSE 0 END) AS win_rate
+            FROM results res
+            JOIN races ra ON ra.id = res.race_id
+            CROSS JOIN (SELECT UNNEST([1, 2, 3, 4, 5, 6]) AS course) c
+            WHERE {_RACE_FILTER}
+              AND ($min_wind_speed IS NULL OR ra.wind_speed >= $min_wind_speed)
+              AND ($min_wave_height IS NULL OR ra.wave_height >= $min_wave_height)
+            GROUP BY c.course
+            ORDER BY c.course
+        """,
+        "params": {**_COMMON_PARAMS, "min_wind_speed": (float, None), "min_wave_height": (float, None)},
+    },
+    "payout_by_grade": {
+        "description": "グレード別の3連単払戻金の分布",
+        "sql": f"""
+            SELECT ra.race_grade,
+                   COUNT(res.trifecta_payout) AS races,
+                   AVG(res.trifecta_payout) AS mean_payout,
+                   QUANTILE_CONT(res.trifecta_payout, 0.5) AS median_payout,
+                   QUANTILE_CONT(res.trifecta_payout, 0.9) AS p90_payout,
+                   MAX(res.trifecta_payout) AS max_payout
+            FROM results res
+            JOIN races ra ON ra.id = res.race_id
+            WHERE {_RACE_FILTER} AND res.trifecta_payout > 0
+            GROUP BY ra.race_grade
+            ORDER BY races DESC
+        """,
+        "params": _COMMON_PARAMS,
+    },
+    "venue_summary": {
+        "description": "会場別の1号艇1着率・逃げ率・平均払戻",
+        "sql": f"""
+            SELECT ra.venue_code,
+                   ANY_VALUE(ra.venue_name) AS venue_name,
+                   COUNT(*) AS races,
+                   AVG(CASE WHEN res.place_1 = 1 THEN 1 ELSE 0 END) AS boat1_win_rate,
+                   AVG(CASE WHEN res.winning_technique = '逃げ' THEN 1 ELSE 0 END) AS nige_rate,
+                   AVG(NULLIF(res.trifecta_payout, 0)) AS mean_trifecta_payout
+            FROM results res
+            JOIN races ra ON ra.id = res.race_id
+            WHERE {_RACE_FILTER}
+            GROUP BY ra.venue_code
+            ORDER BY ra.venue_code
+        """,
+        "params": _COMMON_PARAMS,
+    },
+    "racer_boat_stats": {
+        "description": "選手の艇番別成績（出走数・1着率・2連対率・3連対率）",
+        "sql": f"""
+            SELECT e.boat_no,
+                   COUNT(*) AS starts,
+                   AVG(CASE WHEN res.place_1 = e.boat_no THEN 1 ELSE 0 END) AS win_rate,
+                   AVG(CASE WHEN e.boat_no IN (res.place_1, res.place_2) THEN 1 ELSE 0 END) AS top2_rate,
+                   AVG(CASE WHEN e.boat_no IN (res.place_1, res.place_2, res.place_3) THEN 1 ELSE 0 END) AS top3_rate
+            FROM entries e
+            JOIN results res ON res.race_id = e.race_id
+            JOIN races ra ON ra.id = e.race_id
+            WHERE {_RACE_FILTER} AND e.racer_registration_no = $registration_no
+            GROUP BY e.boat_no
+            ORDER BY e.boat_no
+        """,
+        "params": {**_COMMON_PARAMS, "registration_no": (str, ...)},
+    },
+    "motor_rate_effect": {
+        "description": "モーター2連率帯別の2連対率",
+        "sql": f"""
+            SELECT FLOOR(e.motor_rate_2 / $bucket) * $bucket AS motor_rate_bucket,
+                   COUNT(*) AS starts,
+                   AVG(CASE WHEN e.boat_no IN (res.place_1, res.place_2) THEN 1 ELSE 0 END) AS top2_rate
+            FROM entries e
+            JOIN results res ON res.race_id = e.race_id
+            JOIN races ra ON ra.id = e.race_id
+            WHERE {_RACE_FILTER} AND e.motor_rate_2 > 0
+            GROUP BY motor_rate_bucket
+            ORDER BY motor_rate_bucket
+        """,
+        "params": {**_COMMON_PARAMS, "bucket": (float, 5.0)},
+    },
+}
+
+
+class QueryError(ValueError):
+    """クエリ名やパラメータが不正"""
+
+
+class AnalyticsEngine:
+    """
+    エクスポート済みParquetをDuckDBで集計する
+
+    クエリは QUERIES に登録されたものだけを実行する。結果は
+    (クエリ名, パラメータ, エクスポートのマニフェスト更新時刻) をキーにLRUキャッシュし、
+    再エクスポートされると自動的に無効になる。
+    """
+
+    def __init__(self, export_dir: str = EXPORT_DIR, cache_size: int = 256):
+        self.export_dir = export_dir
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_version = None
+
+    def data_version(self) -> Optional[float]:
+        """エクスポートのバージョン（マニフェストの更新時刻）"""
+        path = os.path.join(self.export_dir, MANIFEST_NAME)
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def _connection(self, version: float):
+        """Parquetをビューとして登録したDuckDB接続（再エクスポート時は作り直す）"""
+        if self._conn is None or self._conn_version != version:
+            conn = duckdb.connect(database=":memory:")
+            for table in TABLES:
+                path = dataset_path(table, self.export_dir).replace("'", "''")
+                conn.execute(
+                    f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}', "
+                    "hive_partitioning = true, union_by_name = true)"
+                )
+            self._conn, self._conn_version = conn, version
+        return self._conn
+
+    def list_queries(self) -> List[Dict]:
+        """登録済みクエリとパラメータ定義の一覧"""
+        return [
+            {
+                "name": name,
+                "description": query["description"],
+                "params": {
+                    p: {"type": t.__name__, "required": default is ..., "default": None if default is ... else default}
+                    for p, (t, default) in query["params"].items()
+                },
+            }
+            for name, query in QUERIES.items()
+        ]
+
+    def _bind_params(self, name: str, raw: Dict[str, Any]) -> Dict[str, Any]:
+        """パラメータを定義に従って検証・型変換"""
+        spec = QUERIES[name]["params"]
+        unknown = set(raw) - set(spec)
+        if unknown:
+            raise QueryError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+
+        params = {}
+        for key, (typ, default) in spec.items():
+            value = raw.get(key)
+            if value is None or value == "":
+                if default is ...:
+                    raise QueryError(f"Missing required parameter: {key}")
+                params[key] = default
+                continue
+            try:
+                params[key] = date.fromisoformat(str(value)) if typ is date else typ(value)
+            except ValueError:
+                raise QueryError(f"Invalid value for {key}: {value}")
+        return params
+
+    def run(self, name: str, raw_params: Dict[str, Any]) -> Dict:
+        """登録済みクエリを実行"""
+        if name not in QUERIES:
+            raise QueryError(f"Unknown query: {name}")
+        params = self._bind_params(name, raw_params)
+
+        version = self.data_version()
+        if version is None:
+            raise FileNotFoundError("No Parquet export found. Run the export first.")
+
+        key = (name, tuple(sorted(params.items())), version)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return {**self._cache[key], "cached": True}
+            # カーソルは接続を複製したもので、スレッドごとに独立して使える
+            cursor = self._connection(version).cursor()
+
+        started = time.perf_counter()
+        try:
+            result = cursor.execute(QUERIES[name]["sql"], params)
+            columns = [d[0] for d in result.description]
+            rows = [dict(zip(columns, row)) for row in result.fetchall()]
+        finally:
+            cursor.close()
+
+        response = {
+            "name": name,
+            "params": params,
+            "columns": columns,
+            "rows": rows,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        with self._lock:
+            self._cache[key] = response
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return {**response, "cached": False}
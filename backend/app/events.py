@@ -0,0 +1,123 @@
+"""データ保存時の後続処理"""
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.prediction.cache import prediction_cache
+from app.prediction.course_entry import course_entry_model
+from app.prediction.precompute import prediction_precomputer
+from app.prediction.start_timing import start_timing_model
+from ml import feature_store
+from ml.matchup import matchup_matrix
+from ml.similar_races import similar_race_index
+
+
+# 結果の追加分を読み込んで更新するモデル（1回の呼び出しで前回以降の全結果を反映する）
+RESULT_MODELS: Dict[str, Callable[[Session], object]] = {
+    "start timing": start_timing_model.refresh,
+    "course entry": course_entry_model.refresh,
+    "matchups": matchup_matrix.refresh,
+    "similar races": similar_race_index.refresh,
+}
+
+
+class ResultRefreshWorker:
+    """
+    レース結果の保存後に、結果から集計している特徴量・モデルをバックグラウンドで更新する
+
+    保存処理（スクレイパー・POST /api/results/）はレースIDを積むだけで待たされず、
+    対戦成績の統合や類似レース索引の保存のような重い処理もワーカーで行う。
+    更新はそれぞれ例外を捕まえて記録するので、1つが失敗しても他の更新や保存済みの結果には
+    影響しない。start していない間（スクレイパーを単体で動かす場合など）は呼び出し元で同期的に更新する
+    """
+
+    def __init__(self):
+        self._pending: Set[int] = set()
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_error = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="result-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """積まれている分を処理し終えてから停止"""
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=60)
+            self._thread = None
+
+    def submit(self, db: Session, race_id: int):
+        if not self.running:
+            self.process(db, [race_id])
+            return
+        with self._condition:
+            self._pending.add(race_id)
+            self._condition.notify()
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stop.is_set():
+                    self._condition.wait()
+                batch = sorted(self._pending)
+                self._pending.clear()
+            if not batch:
+                return
+            db = SessionLocal()
+            try:
+                self.process(db, batch)
+            finally:
+                db.close()
+
+    def _safely(self, name: str, func: Callable, db: Session, *args):
+        try:
+            func(db, *args)
+        except Exception as e:
+            db.rollback()
+            self.last_error = f"{name}: {e}"
+            print(f"Result refresh failed ({name}): {e}")
+
+    def process(self, db: Session, race_ids: List[int]):
+        """
+        レースの特徴量を更新し、各モデルに前回以降の結果を反映
+
+        更新で予想キャッシュのキー（進入予測・特徴量ストア・対戦成績のバージョン）が変わるので、
+        結果の出ていないレースの予想を計算し直すよう事前計算キューに積む
+        """
+        for race_id in race_ids:
+            self._safely(f"feature store, race {race_id}", feature_store.update_race, db, race_id)
+        for name, refresh in RESULT_MODELS.items():
+            self._safely(name, refresh, db)
+        self._safely("prediction precompute", prediction_precomputer.enqueue_upcoming, db)
+
+
+result_refresh_worker = ResultRefreshWorker()
+
+
+def result_saved(db: Session, race_id: int):
+    """レース結果の保存後に、結果から集計している特徴量・モデルを更新"""
+    result_refresh_worker.submit(db, race_id)
+
+
+def race_saved(db: Session, race_id: int):
+    """出走表・レース条件の保存後に、そのレースの計算済み予想を捨てて計算し直す"""
+    prediction_cache.invalidate(db, race_id)
+    prediction_precomputer.enqueue(race_id)
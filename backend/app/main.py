@@ -1,11 +1,20 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.database import engine, Base
-from app.routers import races, racers, predictions, results, scraper, ai_analysis, magi
+from app import events
+from app.database import engine, Base, SessionLocal
+from app.models import db_models
+from app.prediction.course_entry import course_entry_model
+from app.prediction.precompute import prediction_precomputer
+from ml.matchup import matchup_matrix
+from ml.similar_races import similar_race_index
+from app.routers import races, racers, predictions, results, scraper, ai_analysis, magi, analytics, models, motors
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
+# 既存のテーブルに後から追加したインデックスを作成
+for index in db_models.RaceEntry.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
 
 app = FastAPI(
     title="ボートレース予想API",
@@ -30,6 +39,68 @@ app.include_router(results.router, prefix="/api/results", tags=["results"])
 app.include_router(scraper.router, prefix="/api/scraper", tags=["scraper"])
 app.include_router(ai_analysis.router, prefix="/api/ai", tags=["ai"])
 app.include_router(magi.router, prefix="/api/magi", tags=["magi"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
+app.include_router(models.router, prefix="/api/models", tags=["models"])
+app.include_router(motors.router, prefix="/api/motors", tags=["motors"])
+
+
+@app.on_event("startup")
+def start_model_watcher():
+    # 新しいモデルが登録・昇格されたら再起動せずに切り替える
+    predictions.model_watcher.start()
+    if predictions.ml_process_engine is not None:
+        predictions.ml_process_engine.start()
+        predictions.ml_predictor.executor = predictions.ml_process_engine
+
+
+@app.on_event("startup")
+def load_result_models():
+    # 統計・ML予想はDBセッションを持たないので、進入予測は起動時に学習しておく
+    db = SessionLocal()
+    try:
+        course_entry_model.fit(db)
+        # 対戦成績の疎行列・類似レースの索引を開き、保存後に増えた結果を反映
+        matchup_matrix.ensure_loaded(db)
+        similar_race_index.ensure_loaded(db)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def start_result_refresh():
+    # 結果の保存後の特徴量・モデルの更新を保存処理から切り離す
+    events.result_refresh_worker.start()
+
+
+@app.on_event("shutdown")
+def stop_result_refresh():
+    # 積まれている更新を終えてから対戦成績を保存する
+    events.result_refresh_worker.stop()
+
+
+@app.on_event("startup")
+def start_prediction_precompute():
+    # スクレイパーが保存した出走表の統計/ML予想を閲覧前に計算しておく
+    prediction_precomputer.start(predictions.statistical_predictor, predictions.ml_predictor)
+
+
+@app.on_event("shutdown")
+def stop_prediction_precompute():
+    prediction_precomputer.stop()
+
+
+@app.on_event("shutdown")
+def save_matchup_matrix():
+    # 起動中に加えた差分を本体に統合して保存
+    matchup_matrix.compact()
+
+
+@app.on_event("shutdown")
+def stop_model_watcher():
+    predictions.model_watcher.stop()
+    if predictions.ml_process_engine is not None:
+        predictions.ml_predictor.executor = None
+        predictions.ml_process_engine.stop()
 
 
 @app.get("/")
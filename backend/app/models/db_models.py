@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, ForeignKey, Text, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -65,6 +65,7 @@ class Race(Base):
     entries = relationship("RaceEntry", back_populates="race", cascade="all, delete-orphan")
     result = relationship("RaceResult", back_populates="race", uselist=False, cascade="all, delete-orphan")
     predictions = relationship("Prediction", back_populates="race", cascade="all, delete-orphan")
+    cached_predictions = relationship("CachedPrediction", cascade="all, delete-orphan")
 
 
 class RaceEntry(Base):
@@ -76,7 +77,7 @@ class RaceEntry(Base):
     racer_id = Column(Integer, ForeignKey("racers.id"))
     
     boat_no = Column(Integer)  # 艇番 (1-6)
-    racer_registration_no = Column(String(10))  # 選手登録番号
+    racer_registration_no = Column(String(10), index=True)  # 選手登録番号
     racer_name = Column(String(50))  # 選手名
     racer_rank = Column(String(5))  # 級別
     
@@ -209,3 +210,97 @@ class Prediction(Base):
     
     # リレーション
     race = relationship("Race", back_populates="predictions")
+
+
+class CachedPrediction(Base):
+    """統計/ML予想の計算結果（出走表・重み・エンジンのバージョンのハッシュで引く）"""
+    __tablename__ = "cached_predictions"
+    __table_args__ = (
+        Index("ix_cached_predictions_key", "cache_key", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    race_id = Column(Integer, ForeignKey("races.id"), index=True)
+    engine = Column(String(20))  # statistical, ml
+    cache_key = Column(String(40))  # app.prediction.cache.prediction_key
+    payload = Column(Text)  # 予想レスポンスのJSON
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class RacerFeature(Base):
+    """選手の直近成績（特徴量ストア、as_of_date 当日までのレースで集計）"""
+    __tablename__ = "racer_features"
+    __table_args__ = (
+        Index("ix_racer_features_lookup", "registration_no", "as_of_date", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    registration_no = Column(String(10))  # 選手登録番号
+    as_of_date = Column(Date)  # 集計時点（この日のレースまでを含む）
+    
+    # 直近の出走（件数は ml.feature_store.FORM_WINDOW まで）
+    races = Column(Integer)  # 集計したレース数
+    avg_position = Column(Float)  # 平均着順
+    win_rate = Column(Float)  # 1着率
+    top2_rate = Column(Float)  # 2連対率
+    top3_rate = Column(Float)  # 3連対率
+    
+    # スタート
+    st_mean = Column(Float)  # 平均ST
+    st_std = Column(Float)  # STのばらつき
+    flying_count = Column(Integer)  # フライング回数
+    
+    # 進入コース別2連対率（直近 COURSE_WINDOW 走）
+    course_1_top2 = Column(Float)
+    course_2_top2 = Column(Float)
+    course_3_top2 = Column(Float)
+    course_4_top2 = Column(Float)
+    course_5_top2 = Column(Float)
+    course_6_top2 = Column(Float)
+    
+    # 直近に使ったモーターでの成績
+    motor_races = Column(Integer)  # そのモーターでのレース数
+    motor_avg_position = Column(Float)  # そのモーターでの平均着順
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class FeatureStoreGeneration(Base):
+    """特徴量ストアの世代（書き換えるたびに増やし、予想キャッシュのキーに含める）"""
+    __tablename__ = "feature_store_generations"
+    
+    name = Column(String(30), primary_key=True)  # racer_features, equipment_features
+    generation = Column(Integer, default=0)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class EquipmentFeature(Base):
+    """モーター・ボートの成績履歴（会場×番号ごと、as_of_date 当日までのレースで集計）"""
+    __tablename__ = "equipment_features"
+    __table_args__ = (
+        Index("ix_equipment_features_lookup", "kind", "venue_code", "number", "as_of_date", unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(10))  # motor, boat
+    venue_code = Column(String(5))  # 会場コード
+    number = Column(String(10))  # モーター番号・ボート番号
+    as_of_date = Column(Date)  # 集計時点（この日のレースまでを含む）
+    
+    # 交換（公式2連率のリセット）以降の成績
+    period_start = Column(Date)  # 集計期間の開始日（交換を検出した日、なければ初出走日）
+    starts = Column(Integer)  # 出走数
+    avg_position = Column(Float)  # 平均着順
+    top2_rate = Column(Float)  # 2連対率
+    top3_rate = Column(Float)  # 3連対率
+    official_rate = Column(Float)  # 出走表の公式2連率（最新）
+    
+    # 直近の出走（件数は ml.feature_store.FORM_WINDOW まで）
+    recent_races = Column(Integer)
+    recent_avg_position = Column(Float)
+    recent_top2_rate = Column(Float)
+    recent_positions = Column(String(20))  # 着順（古い順、不明は "-"）
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
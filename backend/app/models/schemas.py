@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, List, Dict, Literal
 from datetime import date, datetime
 
 
@@ -47,6 +47,41 @@ class Racer(RacerBase):
         from_attributes = True
 
 
+class StartTimingStats(BaseModel):
+    course: Optional[int] = None  # 進入コース（None は全コース）
+    mean: float
+    std: float
+    flying_rate: float  # ST < 0 の割合
+    late_rate: float  # 出遅れ（ST >= 0.25）の割合
+    count: int  # 集計した出走数
+
+
+class RacerStartTiming(BaseModel):
+    registration_no: str
+    distributions: List[StartTimingStats]
+
+
+class Matchup(BaseModel):
+    registration_no: str
+    opponent_no: str
+    meetings: int  # 同走数
+    ahead: int  # registration_no が先着した回数
+    behind: int  # opponent_no が先着した回数
+    ahead_rate: float  # 同走数に応じて0.5に寄せた先着率
+
+
+class BoatMatchups(BaseModel):
+    boat_no: int
+    registration_no: Optional[str] = None
+    field_score: float  # 他の5艇に対する先着率の平均
+    opponents: List[Matchup]
+
+
+class RaceMatchups(BaseModel):
+    race_id: int
+    boats: List[BoatMatchups]
+
+
 # ========== Race Entry Schemas ==========
 
 class RaceEntryBase(BaseModel):
@@ -178,6 +213,17 @@ class RaceResult(RaceResultBase):
         from_attributes = True
 
 
+class SimilarRace(BaseModel):
+    race: Race
+    distance: float  # 標準化した特徴量空間での距離（小さいほど似ている）
+    result: Optional[RaceResult] = None
+
+
+class SimilarRaces(BaseModel):
+    race_id: int
+    matches: List[SimilarRace]  # 似ている順
+
+
 # ========== Prediction Schemas ==========
 
 class PredictionWeights(BaseModel):
@@ -258,8 +304,148 @@ class BoatProbability(BaseModel):
     expected_rank: float
 
 
+class BoatExplanation(BaseModel):
+    boat_no: int
+    base_value: float  # 全行の期待出力（binary は1着の対数オッズ、ranking はスコア）
+    contributions: Dict[str, float]  # 特徴量 → 出力への寄与（合計 + base_value がモデルの出力）
+
+
 class MLPrediction(BaseModel):
     race_id: int
     probabilities: List[BoatProbability]
     predicted_rank: str
     model_confidence: float
+    explanations: Optional[List[BoatExplanation]] = None  # explain=true の場合のみ
+
+
+# ========== Simulation Prediction Response ==========
+
+class TicketProbability(BaseModel):
+    numbers: str  # 買い目 (例: "1-2-3")
+    probability: float
+
+
+class SimulationPrediction(BaseModel):
+    race_id: int
+    probabilities: List[BoatProbability]
+    predicted_rank: str
+    trifecta_top: List[TicketProbability]  # 3連単の上位
+    n_simulations: int
+
+
+# ========== Ticket Optimization Schemas ==========
+
+class TicketOptimizationRequest(BaseModel):
+    """買い目最適化リクエスト（1レース）"""
+    bet_type: str = "3連単"
+    odds: Dict[str, float]  # 買い目 → オッズ (例: {"1-2-3": 8.5})
+    budget: int = 10000  # 予算（円）
+    kelly_fraction: float = 0.25  # フラクショナル・ケリー係数
+    min_expected_value: float = 0.0  # 採用する最低期待値
+    max_tickets: Optional[int] = None  # 最大点数
+    engine: Literal["statistical", "ml", "simulation"] = "ml"
+
+
+class DayTicketOptimizationRequest(BaseModel):
+    """買い目最適化リクエスト（複数レース）"""
+    bet_type: str = "3連単"
+    odds: Dict[int, Dict[str, float]]  # レースID → {買い目: オッズ}
+    budget: int = 50000  # 全レース合計の予算（円）
+    kelly_fraction: float = 0.25
+    min_expected_value: float = 0.0
+    max_tickets: Optional[int] = None
+    engine: Literal["statistical", "ml", "simulation"] = "ml"
+
+
+class Ticket(BaseModel):
+    bet_type: str
+    numbers: str  # 買い目 (例: "1-2-3")
+    probability: float  # 的中確率
+    odds: float
+    expected_value: float  # 1円あたりの期待収益
+    kelly_fraction: float  # 資金に対する投資比率
+    amount: int  # 購入金額
+
+
+class TicketRecommendation(BaseModel):
+    race_id: int
+    bet_type: str
+    tickets: List[Ticket]
+    total_amount: int
+    expected_return: float
+
+
+class PortfolioRequest(BaseModel):
+    """1日の予算配分リクエスト"""
+    bet_type: str = "3連単"
+    odds: Dict[int, Dict[str, float]]  # レースID → {買い目: オッズ}
+    budget: int = Field(50000, gt=0)  # 1日の予算（円）
+    per_race_limit: float = Field(0.1, gt=0, lt=1)  # 1レースあたりの上限（予算比）
+    total_limit: float = Field(1.0, gt=0, le=1)  # 全体の上限（予算比）
+    engine: Literal["statistical", "ml", "simulation"] = "ml"
+    save: bool = True  # 予想として保存するか
+
+    @model_validator(mode="after")
+    def check_limits(self):
+        if self.per_race_limit > self.total_limit:
+            raise ValueError("per_race_limit must not exceed total_limit")
+        return self
+
+
+class PortfolioAllocation(BaseModel):
+    recommendations: List[TicketRecommendation]
+    total_amount: int
+    expected_log_growth: float
+    iterations: int
+    saved_predictions: int = 0
+
+
+# ========== Model Registry Schemas ==========
+
+class ModelVersion(BaseModel):
+    version: str
+    created_at: Optional[str] = None
+    model_type: str = "binary"
+    feature_version: Optional[int] = None
+    trained_through: Optional[str] = None  # 学習に使った最終開催日
+    incremental_updates: int = 0
+    metrics: Dict[str, float] = {}
+    note: Optional[str] = None
+    active: bool = False
+    pinned: bool = False
+    serving: bool = False  # 現在APIで使用中
+
+
+class ModelRegistryStatus(BaseModel):
+    active: Optional[str] = None
+    pinned: Optional[str] = None
+    serving: Optional[str] = None
+    watcher_error: Optional[str] = None
+    versions: List[ModelVersion]
+
+
+# ========== Motor / Boat History Schemas ==========
+
+class EquipmentStat(BaseModel):
+    as_of_date: date  # この日のレースまでの集計
+    period_start: Optional[date] = None  # 交換を検出した日（なければ初出走日）
+    starts: int  # 交換以降の出走数
+    avg_position: Optional[float] = None
+    top2_rate: float
+    top3_rate: float
+    official_rate: Optional[float] = None  # 出走表の公式2連率
+    recent_races: int
+    recent_avg_position: Optional[float] = None
+    recent_top2_rate: float
+    recent_positions: str  # 直近の着順（古い順）
+    
+    class Config:
+        from_attributes = True
+
+
+class EquipmentHistory(BaseModel):
+    kind: str  # motor, boat
+    venue_code: str
+    number: str
+    latest: EquipmentStat
+    history: List[EquipmentStat]  # 新しい順
@@ -0,0 +1,89 @@
+"""同時に届いた推論リクエストをまとめて処理するキュー"""
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+
+class InferenceBatcher:
+    """
+    複数スレッドから届いたレースの推論を数ミリ秒だけ待ち合わせ、1回のバッチ推論にまとめる
+
+    最初のリクエストが届いてから max_wait_ms 経過するか max_batch_size レースに達した時点で
+    predict_batch をまとめて1回呼び、結果を各リクエストへ返す。推論は専用のワーカースレッドで
+    行うので、モデル呼び出しの回数はリクエスト数ではなく負荷に応じたバッチ数になる。
+    単発のリクエストしか来ていない間（直前のバッチが1件で、キューにも1件だけ）は待たずに処理する。
+    """
+
+    def __init__(
+        self,
+        predict_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 2.0,
+    ):
+        """
+        Args:
+            predict_batch: 入力のリストを受け取り、同じ順序で結果のリストを返す関数
+            max_batch_size: 1回にまとめる最大件数
+            max_wait_ms: 最初のリクエストから待ち合わせる最大時間（ミリ秒）
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._last_batch_size = 0
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """推論をキューに入れ、結果を受け取る Future を返す"""
+        future: Future = Future()
+        with self._condition:
+            self._ensure_worker()
+            self._queue.append((item, future))
+            self._condition.notify()
+        return future
+
+    def predict(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """推論をキューに入れて結果を待つ"""
+        return self.submit(item).result(timeout)
+
+    def _next_batch(self) -> List:
+        """最初の1件を待ち、締め切りまでに届いたものを最大件数まで取り出す"""
+        with self._condition:
+            while not self._queue:
+                self._condition.wait()
+            concurrent = self._last_batch_size > 1 or len(self._queue) > 1
+            deadline = time.monotonic() + (self.max_wait if concurrent else 0.0)
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.max_batch_size))]
+            self._last_batch_size = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # 待っている間に取り消されたリクエストは除く
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.predict_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
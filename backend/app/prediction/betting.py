@@ -0,0 +1,239 @@
+"""期待値・ケリー基準による買い目最適化"""
+from itertools import permutations, combinations
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.models.schemas import Ticket, TicketRecommendation
+
+
+BOAT_COUNT = 6
+BET_UNIT = 100  # 最低購入単位（円）
+
+# 賭け式ごとの買い目（艇番のタプル）
+TICKET_COMBINATIONS = {
+    "単勝": [(b,) for b in range(1, BOAT_COUNT + 1)],
+    "2連単": list(permutations(range(1, BOAT_COUNT + 1), 2)),
+    "2連複": list(combinations(range(1, BOAT_COUNT + 1), 2)),
+    "3連単": list(permutations(range(1, BOAT_COUNT + 1), 3)),
+    "3連複": list(combinations(range(1, BOAT_COUNT + 1), 3)),
+}
+
+# 順序なしの賭け式（表記は "1=2"）
+UNORDERED_BET_TYPES = {"2連複", "3連複"}
+
+
+def ticket_label(bet_type: str, boats: tuple) -> str:
+    """買い目の表記を生成（例: 3連単 "1-2-3", 3連複 "1=2=3"）"""
+    sep = "=" if bet_type in UNORDERED_BET_TYPES else "-"
+    return sep.join(str(b) for b in boats)
+
+
+TICKET_LABELS = {
+    bet_type: [ticket_label(bet_type, boats) for boats in combos]
+    for bet_type, combos in TICKET_COMBINATIONS.items()
+}
+
+
+def _build_aggregation(ordered: List[tuple], unordered: List[tuple]) -> np.ndarray:
+    """順序ありの買い目を順序なしの買い目へ集約する行列"""
+    index = {frozenset(c): i for i, c in enumerate(unordered)}
+    matrix = np.zeros((len(ordered), len(unordered)))
+    for i, combo in enumerate(ordered):
+        matrix[i, index[frozenset(combo)]] = 1.0
+    return matrix
+
+
+_EXACTA = np.array(TICKET_COMBINATIONS["2連単"]) - 1
+_TRIFECTA = np.array(TICKET_COMBINATIONS["3連単"]) - 1
+_QUINELLA_MATRIX = _build_aggregation(TICKET_COMBINATIONS["2連単"], TICKET_COMBINATIONS["2連複"])
+_TRIO_MATRIX = _build_aggregation(TICKET_COMBINATIONS["3連単"], TICKET_COMBINATIONS["3連複"])
+
+
+def normalize_win_probabilities(win_probs: np.ndarray) -> np.ndarray:
+    """1着確率をレースごとに合計1へ正規化 (races, 6)"""
+    probs = np.clip(np.nan_to_num(np.asarray(win_probs, dtype=float)), 0.0, None)
+    totals = probs.sum(axis=1, keepdims=True)
+    uniform = np.full_like(probs, 1.0 / probs.shape[1])
+    return np.where(totals > 0, probs / np.where(totals > 0, totals, 1.0), uniform)
+
+
+def ticket_probabilities(win_probs: np.ndarray, bet_type: str) -> np.ndarray:
+    """
+    1着確率から各買い目の的中確率を計算（Harvilleモデル）
+
+    Args:
+        win_probs: 各艇の1着確率 (races, 6)
+        bet_type: 賭け式
+
+    Returns:
+        買い目ごとの的中確率 (races, 買い目数)。列順は TICKET_COMBINATIONS と同じ
+    """
+    if bet_type not in TICKET_COMBINATIONS:
+        raise ValueError(f"Unsupported bet type: {bet_type}")
+
+    p = normalize_win_probabilities(win_probs)
+    eps = 1e-12
+
+    if bet_type == "単勝":
+        return p
+
+    if bet_type in ("2連単", "2連複"):
+        first, second = _EXACTA[:, 0], _EXACTA[:, 1]
+        exacta = p[:, first] * p[:, second] / np.maximum(1.0 - p[:, first], eps)
+        return exacta if bet_type == "2連単" else exacta @ _QUINELLA_MATRIX
+
+    first, second, third = _TRIFECTA[:, 0], _TRIFECTA[:, 1], _TRIFECTA[:, 2]
+    trifecta = (
+        p[:, first]
+        * p[:, second] / np.maximum(1.0 - p[:, first], eps)
+        * p[:, third] / np.maximum(1.0 - p[:, first] - p[:, second], eps)
+    )
+    return trifecta if bet_type == "3連単" else trifecta @ _TRIO_MATRIX
+
+
+# 3連単の買い目 → (艇, 着順) への集約 (120, 6, 3)
+_PLACE_MATRIX = np.zeros((len(_TRIFECTA), BOAT_COUNT, 3))
+for _place in range(3):
+    _PLACE_MATRIX[np.arange(len(_TRIFECTA)), _TRIFECTA[:, _place], _place] = 1.0
+
+
+def position_probabilities(win_probs: np.ndarray) -> np.ndarray:
+    """
+    1着確率から各艇の1〜3着確率を計算（Harvilleモデル）
+
+    Args:
+        win_probs: 各艇の1着確率 (races, 6)
+
+    Returns:
+        各艇の着順確率 (races, 6艇, 3着)。各着順の合計はレースごとに1
+    """
+    return np.einsum("rt,tbp->rbp", ticket_probabilities(win_probs, "3連単"), _PLACE_MATRIX)
+
+
+def odds_to_array(bet_type: str, odds: Dict[str, float]) -> np.ndarray:
+    """買い目→オッズの辞書を買い目順の配列に変換（オッズ未提供はNaN）"""
+    labels = TICKET_LABELS[bet_type]
+    return np.array([odds.get(label, np.nan) for label in labels], dtype=float)
+
+
+class TicketOptimizer:
+    """期待値とフラクショナル・ケリーによる買い目選択"""
+
+    def __init__(
+        self,
+        kelly_fraction: float = 0.25,
+        min_expected_value: float = 0.0,
+        max_tickets_per_race: Optional[int] = None,
+    ):
+        self.kelly_fraction = kelly_fraction
+        self.min_expected_value = min_expected_value
+        self.max_tickets_per_race = max_tickets_per_race
+
+    def evaluate(self, probs: np.ndarray, odds: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        全買い目の期待値とケリー比率を計算
+
+        Args:
+            probs: 的中確率 (races, 買い目数)
+            odds: オッズ（払戻倍率）(races, 買い目数)。未提供はNaN
+
+        Returns:
+            expected_value: 1円あたりの期待収益 (p * odds - 1)
+            kelly: 資金に対する投資比率（フラクショナル適用後、対象外は0）
+        """
+        valid = np.isfinite(odds) & (odds > 1.0)
+        safe_odds = np.where(valid, odds, 1.0)
+
+        expected_value = np.where(valid, probs * safe_odds - 1.0, -np.inf)
+        full_kelly = np.where(valid, expected_value / np.maximum(safe_odds - 1.0, 1e-12), 0.0)
+        kelly = np.clip(full_kelly * self.kelly_fraction, 0.0, 1.0)
+
+        selected = (expected_value >= self.min_expected_value) & (kelly > 0)
+        if self.max_tickets_per_race is not None:
+            # 期待値の高い順に上位のみ残す
+            order = np.argsort(-np.where(selected, expected_value, -np.inf), axis=1)
+            ranks = np.empty_like(order)
+            np.put_along_axis(ranks, order, np.arange(order.shape[1])[None, :], axis=1)
+            selected &= ranks < self.max_tickets_per_race
+
+        return {
+            "expected_value": expected_value,
+            "kelly": np.where(selected, kelly, 0.0),
+        }
+
+    def allocate(self, kelly: np.ndarray, budget: int) -> np.ndarray:
+        """ケリー比率を予算内の購入金額（100円単位）に変換"""
+        stakes = kelly * budget
+        total = stakes.sum()
+        if total > budget:
+            stakes *= budget / total
+        return (np.floor(stakes / BET_UNIT) * BET_UNIT).astype(int)
+
+    def optimize(
+        self,
+        race_ids: List[int],
+        win_probs: np.ndarray,
+        odds_by_race: List[Dict[str, float]],
+        bet_type: str,
+        budget: int,
+    ) -> List[TicketRecommendation]:
+        """
+        複数レースの買い目をまとめて最適化
+
+        Args:
+            race_ids: レースID (races,)
+            win_probs: 各艇の1着確率 (races, 6)
+            odds_by_race: レースごとの {買い目: オッズ}
+            bet_type: 賭け式
+            budget: 全レース合計の予算（円）
+        """
+        probs = ticket_probabilities(win_probs, bet_type)
+        odds = np.vstack([odds_to_array(bet_type, o) for o in odds_by_race])
+
+        evaluated = self.evaluate(probs, odds)
+        amounts = self.allocate(evaluated["kelly"], budget)
+
+        return build_recommendations(
+            race_ids, bet_type, probs, odds, evaluated["kelly"], amounts
+        )
+
+
+def build_recommendations(
+    race_ids: List[int],
+    bet_type: str,
+    probs: np.ndarray,
+    odds: np.ndarray,
+    fractions: np.ndarray,
+    amounts: np.ndarray,
+) -> List[TicketRecommendation]:
+    """購入金額の配列をレースごとの買い目リストに変換"""
+    labels = TICKET_LABELS[bet_type]
+    expected_value = np.where(np.isfinite(odds), probs * np.nan_to_num(odds) - 1.0, -np.inf)
+
+    recommendations = []
+    for r, race_id in enumerate(race_ids):
+        picks = np.flatnonzero(amounts[r] > 0)
+        picks = picks[np.argsort(-expected_value[r, picks])]
+        tickets = [
+            Ticket(
+                bet_type=bet_type,
+                numbers=labels[t],
+                probability=round(float(probs[r, t]), 6),
+                odds=float(odds[r, t]),
+                expected_value=round(float(expected_value[r, t]), 4),
+                kelly_fraction=round(float(fractions[r, t]), 6),
+                amount=int(amounts[r, t]),
+            )
+            for t in picks
+        ]
+        expected_return = float(np.sum(amounts[r, picks] * probs[r, picks] * odds[r, picks]))
+        recommendations.append(TicketRecommendation(
+            race_id=race_id,
+            bet_type=bet_type,
+            tickets=tickets,
+            total_amount=int(amounts[r].sum()),
+            expected_return=round(expected_return, 1),
+        ))
+
+    return recommendations
@@ -0,0 +1,158 @@
+"""統計/ML予想の計算結果のキャッシュ"""
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Type
+
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import db_models
+from app.models.schemas import RaceBase, RaceEntryBase
+
+
+# メモリに置く予想の件数
+PREDICTION_CACHE_SIZE = 4096
+
+# 計算した予想を cached_predictions テーブルにも保存する（再起動後も再計算しない）
+PERSIST_PREDICTIONS = True
+
+
+def prediction_key(engine: str, race, entries: List, params: Optional[Dict], version: str) -> str:
+    """
+    予想のキャッシュキー
+
+    レースの条件・出走表の全項目・重みなどのパラメータ・エンジンのバージョンのハッシュなので、
+    出走表や直前情報が更新されるかモデルが切り替わると別のキーになる
+    """
+    payload = {
+        "engine": engine,
+        "version": version,
+        "params": params,
+        "race": {name: getattr(race, name, None) for name in RaceBase.model_fields},
+        "entries": [
+            {name: getattr(entry, name, None) for name in RaceEntryBase.model_fields}
+            for entry in sorted(entries, key=lambda e: e.boat_no)
+        ],
+    }
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class PredictionCache:
+    """
+    キャッシュキー → 予想レスポンスの LRU キャッシュ
+
+    メモリになければ cached_predictions テーブルを引き、どちらにもなければ呼び出し側が計算して put する。
+    スクレイパーがレースを更新したときは invalidate でそのレースの予想をまとめて捨てる
+    """
+
+    def __init__(self, max_size: int = PREDICTION_CACHE_SIZE, persist: bool = PERSIST_PREDICTIONS):
+        self.max_size = max_size
+        self.persist = persist
+        self._items: "OrderedDict[str, BaseModel]" = OrderedDict()
+        self._race_of: Dict[str, int] = {}
+        self._keys_by_race: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, race_id: int, key: str, result: BaseModel):
+        with self._lock:
+            self._items[key] = result
+            self._items.move_to_end(key)
+            self._race_of[key] = race_id
+            self._keys_by_race.setdefault(race_id, set()).add(key)
+            while len(self._items) > self.max_size:
+                old_key, _ = self._items.popitem(last=False)
+                self._forget(old_key)
+
+    def _forget(self, key: str):
+        race_id = self._race_of.pop(key, None)
+        keys = self._keys_by_race.get(race_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_race[race_id]
+
+    def get(self, db: Session, key: str, schema: Type[BaseModel]) -> Optional[BaseModel]:
+        """キャッシュ済みの予想（なければ None）"""
+        with self._lock:
+            result = self._items.get(key)
+            if result is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return result
+
+        if self.persist:
+            row = db.query(db_models.CachedPrediction).filter(
+                db_models.CachedPrediction.cache_key == key
+            ).first()
+            if row is not None:
+                result = schema.model_validate_json(row.payload)
+                self._remember(row.race_id, key, result)
+                with self._lock:
+                    self.hits += 1
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, db: Session, engine: str, race_id: int, key: str, result: BaseModel, persist: bool = True):
+        """
+        計算した予想を登録
+
+        persist=False の予想はメモリの LRU だけに置く（利用者ごとに異なる重みの予想などを
+        cached_predictions に溜め続けないため）。保存する予想は同じレース・エンジンの古いキーの
+        予想（結果の追加やモデルの切り替えで使われなくなったもの）と置き換える
+        """
+        self._remember(race_id, key, result)
+        if not (self.persist and persist):
+            return
+        exists = db.query(db_models.CachedPrediction.id).filter(
+            db_models.CachedPrediction.cache_key == key
+        ).first()
+        if exists is not None:
+            return
+        db.query(db_models.CachedPrediction).filter(
+            db_models.CachedPrediction.race_id == race_id,
+            db_models.CachedPrediction.engine == engine,
+        ).delete(synchronize_session=False)
+        db.add(db_models.CachedPrediction(
+            race_id=race_id, engine=engine, cache_key=key, payload=result.model_dump_json()
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            # 同じ予想を別のリクエストが先に保存した
+            db.rollback()
+
+    def invalidate(self, db: Session, race_id: int) -> int:
+        """レースの予想をメモリと cached_predictions から削除し、削除したメモリ上の件数を返す"""
+        with self._lock:
+            keys = self._keys_by_race.pop(race_id, set())
+            for key in keys:
+                self._items.pop(key, None)
+                self._race_of.pop(key, None)
+        if self.persist:
+            db.query(db_models.CachedPrediction).filter(
+                db_models.CachedPrediction.race_id == race_id
+            ).delete(synchronize_session=False)
+            db.commit()
+        return len(keys)
+
+    def clear(self):
+        """メモリ上の予想をすべて捨てる（テーブルはそのまま）"""
+        with self._lock:
+            self._items.clear()
+            self._race_of.clear()
+            self._keys_by_race.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+prediction_cache = PredictionCache()
@@ -0,0 +1,246 @@
+"""進入コースの予測（前付けの考慮）"""
+import itertools
+import threading
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.prediction.betting import BOAT_COUNT
+from app.prediction.start_timing import load_result_starts
+
+
+COURSE_PRIOR_WEIGHT = 10  # 選手の艇番別の進入傾向を全体の傾向に寄せる際の事前サンプル数
+COURSE_PRIOR_FLOOR = 0.01  # 全体の傾向の各セルに足す回数（履歴のない進入も確率0にしない）
+SINKHORN_ITERATIONS = 30
+SINKHORN_TOLERANCE = 1e-6
+
+# 6艇の進入コースの並び（720通り）。PERMUTATIONS[p, b] は艇 b の進入コース - 1
+PERMUTATIONS = np.array(list(itertools.permutations(range(BOAT_COUNT))))
+
+
+def _sinkhorn(tendency: np.ndarray) -> np.ndarray:
+    """各コースに1艇ずつ入る制約のもとで列・行を交互に正規化（行の和は最初から1）"""
+    probs = tendency.copy()
+    for _ in range(SINKHORN_ITERATIONS):
+        course_totals = probs.sum(axis=1, keepdims=True)
+        if np.abs(course_totals - 1).max() < SINKHORN_TOLERANCE:
+            break
+        probs /= course_totals
+        probs /= probs.sum(axis=2, keepdims=True)
+    return probs
+
+
+class CourseEntryModel:
+    """
+    出走表から各艇の進入コースの分布を予測する
+
+    選手ごとに「艇番 → 進入コース」の回数を数え、全選手の傾向を事前分布として
+    縮小推定した確率を各艇の進入の傾向とする。レース内では各コースに1艇ずつしか
+    入れないので、6艇分の傾向を Sinkhorn 反復で行・列の和がともに1になるよう
+    正規化して進入確率とし、720通りの並びから最も尤もらしい進入を選ぶ。
+    学習・更新は StartTimingModel と同じく結果IDのウォーターマーク以降を加算する。
+    """
+
+    def __init__(self, prior_weight: float = COURSE_PRIOR_WEIGHT):
+        self.prior_weight = prior_weight
+        self._index: Dict[str, int] = {}
+        self._counts = np.zeros((0, BOAT_COUNT, BOAT_COUNT))
+        self._overall = np.zeros((BOAT_COUNT, BOAT_COUNT))
+        self.max_result_id = 0
+        self.fitted = False
+        self._lock = threading.Lock()
+
+    def _accumulate(self, registration_no: np.ndarray, boat_no: np.ndarray, course: np.ndarray):
+        known = course > 0
+        registration_no, boat_no, course = registration_no[known], boat_no[known], course[known]
+        if len(course) == 0:
+            return
+
+        for reg in dict.fromkeys(registration_no):
+            if reg not in self._index:
+                self._index[reg] = len(self._index)
+        if len(self._index) > len(self._counts):
+            grown = np.zeros((len(self._index), BOAT_COUNT, BOAT_COUNT))
+            grown[:len(self._counts)] = self._counts
+            self._counts = grown
+
+        rows = np.array([self._index[reg] for reg in registration_no])
+        np.add.at(self._counts, (rows, boat_no - 1, course - 1), 1)
+        np.add.at(self._overall, (boat_no - 1, course - 1), 1)
+
+    def fit(self, db: Session, before: Optional[date] = None, full_races_only: bool = False) -> int:
+        """
+        全結果（before 指定時はその日より前のレースの結果）から集計し直す（集計した出走数を返す）
+
+        full_races_only=True なら学習データと同じく6艇が揃ったレースの結果だけを集計する
+        """
+        starts = load_result_starts(db, before=before, full_races_only=full_races_only)
+        with self._lock:
+            self._index = {}
+            self._counts = np.zeros((0, BOAT_COUNT, BOAT_COUNT))
+            self._overall = np.zeros((BOAT_COUNT, BOAT_COUNT))
+            self._accumulate(starts["registration_no"], starts["boat_no"], starts["course"])
+            self.max_result_id = starts["max_result_id"]
+            self.fitted = True
+        return int((starts["course"] > 0).sum())
+
+    def refresh(self, db: Session) -> int:
+        """前回以降に追加された結果だけを加算（未学習なら fit）"""
+        if not self.fitted:
+            return self.fit(db)
+        # 同時に呼ばれても同じ出走を二重に加算しないよう、読み込みから加算までをロックする
+        with self._lock:
+            starts = load_result_starts(db, self.max_result_id)
+            self._accumulate(starts["registration_no"], starts["boat_no"], starts["course"])
+            self.max_result_id = starts["max_result_id"]
+        return int((starts["course"] > 0).sum())
+
+    def ensure_fitted(self, db: Session):
+        if not self.fitted:
+            self.fit(db)
+
+    @property
+    def state_token(self) -> str:
+        """
+        予想キャッシュのキーに含める学習状態（未学習なら "boat"、学習済みなら加算済みの最大結果ID）
+
+        結果IDは単調に増えるので、結果を加算するたびに別のキーになる（同じ日のうちの加算も反映する）
+        """
+        if not self.fitted:
+            return "boat"
+        return f"course-{self.max_result_id}"
+    
+    def add(self, registration_no: np.ndarray, boat_no: np.ndarray, course: np.ndarray):
+        """DBを介さずに出走（進入コース 1-6、不明は0）を加算する（学習データの作成用）"""
+        with self._lock:
+            self._accumulate(np.asarray(registration_no, dtype=object), np.asarray(boat_no, dtype=int),
+                             np.asarray(course, dtype=int))
+            self.fitted = True
+
+    def tendencies(self, registration_nos: np.ndarray) -> np.ndarray:
+        """
+        各艇の選手の進入傾向 P(コース | 艇番)
+
+        Args:
+            registration_nos: 艇番順の選手登録番号 (races, 6)。空き枠は None
+
+        Returns:
+            (races, 6艇, 6コース)
+        """
+        races = registration_nos.shape[0]
+        with self._lock:
+            # 履歴がなくても艇番どおりを基本とし、どの進入も対数を取れるよう下限を足す
+            overall = self._overall + np.eye(BOAT_COUNT) + COURSE_PRIOR_FLOOR
+            prior = overall / overall.sum(axis=1, keepdims=True)
+            rows = np.array([self._index.get(reg, -1) for reg in registration_nos.ravel()], dtype=int)
+            counts = np.zeros((len(rows), BOAT_COUNT))
+            known = rows >= 0
+            boat_idx = np.tile(np.arange(BOAT_COUNT), races)
+            counts[known] = self._counts[rows[known], boat_idx[known]]
+
+        counts = counts.reshape(races, BOAT_COUNT, BOAT_COUNT)
+        totals = counts.sum(axis=2, keepdims=True)
+        return (counts + self.prior_weight * prior) / (totals + self.prior_weight)
+
+    def predict(self, registration_nos: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        複数レースの進入を一括予測
+
+        Args:
+            registration_nos: 艇番順の選手登録番号 (races, 6)。空き枠は None
+
+        Returns:
+            probs: 各艇の進入コース確率 (races, 6艇, 6コース)。各行・各列の和がほぼ1
+            courses: 最も尤もらしい進入コース 1-6 (races, 6)
+        """
+        tendency = self.tendencies(registration_nos)
+        probs = _sinkhorn(tendency)
+
+        # 全720通りの並びの対数尤度を一括計算
+        log_tendency = np.log(tendency)
+        scores = log_tendency[:, np.arange(BOAT_COUNT), PERMUTATIONS].sum(axis=2)
+        courses = PERMUTATIONS[scores.argmax(axis=1)] + 1
+
+        return {"probs": probs, "courses": courses}
+
+    def course_probabilities(self, registration_nos: np.ndarray) -> np.ndarray:
+        """predict の probs だけを計算（最も尤もらしい進入の探索を省く）"""
+        return _sinkhorn(self.tendencies(registration_nos))
+    
+    def predict_entries(self, entries_by_race: List[List]) -> Dict[str, np.ndarray]:
+        """出走表のリストから進入を一括予測（未学習なら艇番どおり）"""
+        races = len(entries_by_race)
+        if not self.fitted:
+            return {
+                "probs": np.tile(np.eye(BOAT_COUNT), (races, 1, 1)),
+                "courses": np.tile(np.arange(1, BOAT_COUNT + 1), (races, 1)),
+            }
+        registration_nos = np.full((races, BOAT_COUNT), None, dtype=object)
+        for r, entries in enumerate(entries_by_race):
+            for entry in entries:
+                if 1 <= entry.boat_no <= BOAT_COUNT:
+                    registration_nos[r, entry.boat_no - 1] = entry.racer_registration_no
+        return self.predict(registration_nos)
+
+
+def entry_course_probs(prediction: Dict[str, np.ndarray], entries_by_race: List[List]) -> np.ndarray:
+    """predict_entries の結果を出走表の行順の進入コース確率 (n_rows, 6) に並べ替える"""
+    return np.array([
+        prediction["probs"][r, entry.boat_no - 1]
+        for r, entries in enumerate(entries_by_race) for entry in entries
+    ]).reshape(-1, BOAT_COUNT)
+
+
+def point_in_time_course_probs(db: Session, race_id: np.ndarray, race_date: np.ndarray,
+                               registration_no: np.ndarray, boat_no: np.ndarray, course: np.ndarray,
+                               since: Optional[date] = None) -> np.ndarray:
+    """
+    学習データの各行に、そのレースの前日までの結果だけで学習した進入予測の分布を付ける
+
+    推論時と同じ CourseEntryModel を開催日順に1日ずつ加算しながら予測するので、
+    レース後にしか分からない実際の進入コースは特徴量に入らない。
+    since より前の結果は1回だけ集計し、以降は行の開催日順に1回の走査で加算する。
+    どちらも学習データと同じ6艇揃いのレースの、選手登録番号がある出走だけを数えるので、
+    期間を分けて作っても全期間を1回で作った場合と同じ分布になる。
+
+    Args:
+        race_id, race_date（序数）, registration_no, boat_no: 各行の識別情報 (n_rows,)
+        course: 各行の実際の進入コース (n_rows,)。不明は0。その日の予測の後に加算する
+        since: 行がこの日以降のレースだけの場合に指定（より前の結果は先にDBから集計する）
+
+    Returns:
+        各行の進入コース1〜6の確率 (n_rows, 6)
+    """
+    model = CourseEntryModel()
+    if since is not None:
+        model.fit(db, before=since, full_races_only=True)
+    model.fitted = True
+
+    races, race_idx = np.unique(race_id, return_inverse=True)
+    boat_idx = np.clip(np.asarray(boat_no, dtype=int), 1, BOAT_COUNT) - 1
+    registration_nos = np.full((len(races), BOAT_COUNT), None, dtype=object)
+    registration_nos[race_idx, boat_idx] = registration_no
+    dates = np.zeros(len(races), dtype=np.int64)
+    dates[race_idx] = race_date
+
+    # load_result_starts と同じく、選手登録番号のない出走・範囲外の艇番は数えない
+    countable = np.array([reg is not None for reg in registration_no], dtype=bool)
+    countable &= (np.asarray(boat_no) >= 1) & (np.asarray(boat_no) <= BOAT_COUNT)
+    counted_course = np.where(countable, course, 0)
+
+    race_probs = np.zeros((len(races), BOAT_COUNT, BOAT_COUNT))
+    race_order = np.argsort(dates, kind="stable")
+    row_order = np.argsort(race_date, kind="stable")
+    sorted_dates, sorted_row_dates = dates[race_order], np.asarray(race_date)[row_order]
+    for day in np.unique(sorted_dates):
+        day_races = race_order[np.searchsorted(sorted_dates, day):np.searchsorted(sorted_dates, day, "right")]
+        race_probs[day_races] = model.course_probabilities(registration_nos[day_races])
+        day_rows = row_order[np.searchsorted(sorted_row_dates, day):np.searchsorted(sorted_row_dates, day, "right")]
+        model.add(registration_no[day_rows], boat_no[day_rows], counted_course[day_rows])
+
+    return race_probs[race_idx, boat_idx]
+
+
+course_entry_model = CourseEntryModel()
@@ -0,0 +1,85 @@
+"""予想の特徴量寄与（TreeSHAP）とそのキャッシュ"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+
+# キャッシュするレース数（1日の全会場分の数日分）
+EXPLANATION_CACHE_SIZE = 4096
+
+
+def race_key(features: np.ndarray, boat_index: np.ndarray) -> str:
+    """
+    1レース分の特徴量行から寄与のキャッシュキーを作る
+
+    出走表・進入予測・直前情報のどれが変わっても特徴量が変わるので、
+    特徴量そのもののハッシュをキーにすればレースの更新で自然に無効化される
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(features, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(boat_index, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def contribution_model(bundle: Dict):
+    """
+    寄与を計算する LightGBM モデル
+
+    binary は1着モデル（出力は1着の対数オッズ）、ranking はランキングモデル（出力はスコア）
+    """
+    estimator = bundle["model"] if bundle.get("model_type") == "ranking" else bundle["model_1st"]
+    return getattr(estimator, "booster_", estimator)
+
+
+def feature_contributions(bundle: Dict, features: np.ndarray) -> np.ndarray:
+    """
+    LightGBM の TreeSHAP で各行の特徴量寄与を計算
+
+    Returns:
+        (n_rows, n_features + 1)。最後の列は基準値（全行の期待出力）で、
+        各行の合計はモデルの生の出力に一致する
+    """
+    if len(features) == 0:
+        return np.empty((0, features.shape[1] + 1))
+    return np.asarray(contribution_model(bundle).predict(features, pred_contrib=True))
+
+
+class ExplanationCache:
+    """
+    (モデルバージョン, レースの特徴量ハッシュ) → 寄与の LRU キャッシュ
+
+    複数スレッドから参照されるのでロックで保護する
+    """
+
+    def __init__(self, max_size: int = EXPLANATION_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
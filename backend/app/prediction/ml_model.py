@@ -1,29 +1,173 @@
 """機械学習ベース予想エンジン"""
 import os
+import time
+import threading
 import numpy as np
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 import joblib
 
-from app.models.schemas import MLPrediction, BoatProbability
+from app.models.schemas import MLPrediction, BoatProbability, BoatExplanation
+from app.prediction.betting import BOAT_COUNT, position_probabilities
+from app.prediction.course_entry import CourseEntryModel, course_entry_model, entry_course_probs
+from app.prediction.explain import ExplanationCache, feature_contributions, race_key
+from app.prediction.tree_ensemble import CompiledTreeEnsemble
+from ml.feature_store import feature_context_version, load_feature_context
+from ml.features import FEATURE_VERSION, FEATURE_NAMES, entries_to_columns, build_feature_matrix
+from ml.registry import ModelRegistry
+
+
+# 保存済みモデルの形式（binary: 1〜3着の2値分類3本 / ranking: レース単位のランキング1本）
+MODEL_TYPES = ("binary", "ranking")
+
+
+def race_softmax(scores: np.ndarray, race_index: np.ndarray, boat_index: np.ndarray,
+                 temperature: float = 1.0) -> np.ndarray:
+    """
+    ランキングスコアをレースごとのソフトマックスで1着確率 (races, 6) に変換
+
+    Args:
+        scores: 各行のスコア (n_rows,)
+        race_index: 各行のレース番号 0..races-1 (n_rows,)
+        boat_index: 各行の艇インデックス 0..5 (n_rows,)
+        temperature: スコアの温度（学習時に1着の対数損失が最小になるよう決める）
+    """
+    logits = np.full((race_index.max() + 1, BOAT_COUNT), -np.inf)
+    logits[race_index, boat_index] = scores / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
 
 
 class MLPredictor:
     """機械学習による予想"""
     
+    # レジストリ導入前の保存先（レジストリが空の場合のみ使用）
     MODEL_PATH = "ml/models/boatrace_model.joblib"
     
-    def __init__(self):
-        self.model = None
-        self._load_model()
+    # 配列化した木で推論する最大行数（これより大きいバッチは LightGBM の方が速い。
+    # python -m benchmarks.tree_ensemble で計測）
+    COMPILED_MAX_ROWS = 1000
+    
+    def __init__(self, bundle: Optional[dict] = None, registry: Optional[ModelRegistry] = None,
+                 course_model: Optional[CourseEntryModel] = None,
+                 context_loader: Optional[Callable[[List[List]], Dict[str, np.ndarray]]] = load_feature_context,
+                 context_version: Optional[Callable[[], str]] = feature_context_version):
+        """
+        bundle を渡した場合はそのモデルを使い、渡さない場合はレジストリの
+        現行バージョン（なければ MODEL_PATH）を読み込む。
+        course_model が学習済みなら予測した進入コースの分布から特徴量を作る。
+        context_loader は出走表以外の特徴量の元データ（選手の直近成績など）を返す関数で、
+        None にすると DB を引かずにそれらの特徴量を欠損とする（DB にない合成レースのベンチマーク用）。
+        context_version はその元データの世代を返す関数で、予想キャッシュのキーに含める
+        """
+        self.registry = registry or ModelRegistry()
+        self.course_model = course_model or course_entry_model
+        self.context_loader = context_loader
+        self.context_version = context_version
+        # 推論に使う (モデル, バージョン)。組で差し替え、組で読み出す
+        self._serving: Tuple[Optional[Dict], Optional[str]] = (None, None)
+        # 設定すると推論をワーカープロセスで実行する（ProcessInferenceEngine）
+        self.executor = None
+        self.explanation_cache = ExplanationCache()
+        if bundle is not None:
+            self._serving = (self._prepare(bundle) if self._is_compatible(bundle) else None, None)
+        else:
+            self._load_model()
     
     def _load_model(self):
         """学習済みモデルを読み込み"""
+        version = self.registry.current_version()
+        if version is not None:
+            bundle = self.load_version(version)
+            if bundle is not None:
+                self.swap(bundle, version)
+                return
         if os.path.exists(self.MODEL_PATH):
             try:
-                self.model = joblib.load(self.MODEL_PATH)
+                bundle = joblib.load(self.MODEL_PATH)
             except Exception as e:
                 print(f"Model loading failed: {e}")
-                self.model = None
+                self._serving = (None, None)
+                return
+            self._serving = (self._prepare(bundle) if self._is_compatible(bundle) else None, None)
+    
+    def load_version(self, version: str) -> Optional[Dict]:
+        """レジストリからバージョンを読み込み、互換性の確認とウォームアップまで済ませる"""
+        try:
+            bundle = self.registry.load(version)
+        except Exception as e:
+            print(f"Model loading failed ({version}): {e}")
+            return None
+        if not self._is_compatible(bundle):
+            return None
+        bundle = self._prepare(bundle)
+        # 初回推論の遅延を切り替え前に済ませる
+        features = np.zeros((BOAT_COUNT, len(FEATURE_NAMES)))
+        features[:, 0] = np.arange(1, BOAT_COUNT + 1)
+        self._predict_place_probabilities(
+            features, np.zeros(BOAT_COUNT, dtype=int), np.arange(BOAT_COUNT), model=bundle
+        )
+        return bundle
+    
+    def _prepare(self, bundle: Dict) -> Dict:
+        """推論用に木を配列へ変換したものを添える（変換できない場合は LightGBM で推論）"""
+        keys = ("model",) if bundle.get("model_type") == "ranking" else ("model_1st", "model_2nd", "model_3rd")
+        try:
+            compiled = {key: CompiledTreeEnsemble.from_lightgbm(bundle[key]) for key in keys}
+        except Exception as e:
+            print(f"Tree compilation skipped: {e}")
+            return bundle
+        return {**bundle, "compiled": compiled}
+    
+    def swap(self, bundle: Dict, version: Optional[str] = None):
+        """
+        推論に使うモデルを差し替える
+        
+        参照の代入1回で切り替わり、推論中のリクエストは開始時に取得したモデルで最後まで処理される
+        """
+        self._serving = (bundle, version)
+    
+    def serving(self) -> Tuple[Optional[Dict], Optional[str]]:
+        """推論に使う (モデル, バージョン)。1回の参照で取るので、差し替えの途中でも組が食い違わない"""
+        return self._serving
+    
+    @property
+    def model(self) -> Optional[Dict]:
+        return self._serving[0]
+    
+    @property
+    def model_version(self) -> Optional[str]:
+        return self._serving[1]
+    
+    @property
+    def engine_version(self) -> str:
+        """
+        予想・寄与のキャッシュキーに含めるバージョン
+
+        モデル・進入予測の学習状態・特徴量ストアと対戦成績の世代のどれかが変わると変わる
+        """
+        model, version = self.serving()
+        if model is None:
+            return "simple"
+        token = f"{version or f'bundle-{id(model)}'}-{self.course_model.state_token}"
+        if self.context_loader is not None and self.context_version is not None:
+            token = f"{token}-{self.context_version()}"
+        return token
+    
+    def _is_compatible(self, bundle) -> bool:
+        """保存済みモデルの特徴量定義が現在のものと一致するか確認"""
+        # model_type がない古いモデルは2値分類3本
+        model_type = bundle.get("model_type", "binary") if isinstance(bundle, dict) else None
+        required = "model" if model_type == "ranking" else "model_1st"
+        if model_type not in MODEL_TYPES or required not in bundle:
+            print("Model loading skipped: unsupported model format")
+            return False
+        # feature_version がない古いモデルは特徴量名で判定
+        version = bundle.get("feature_version", FEATURE_VERSION)
+        if version != FEATURE_VERSION or list(bundle.get("feature_names", [])) != FEATURE_NAMES:
+            print(f"Model loading skipped: feature version {version} != {FEATURE_VERSION}")
+            return False
+        return True
     
     def predict(self, entries: List) -> MLPrediction:
         """
@@ -31,26 +175,117 @@ class MLPredictor:
         
         モデルが存在しない場合は統計ベースの簡易予測を返す
         """
-        probabilities = []
+        return self.predict_batch([entries])[0]
+    
+    def predict_batch(self, entries_by_race: List[List]) -> List[MLPrediction]:
+        """複数レースの予想をまとめて生成（モデル呼び出しは1回）"""
+        # 処理中にモデルが差し替わっても、開始時のモデルとそのバージョンで最後まで処理する
+        model, version = self.serving()
+        if model is None:
+            return [self._build_prediction(entries, self._simple_prediction(entries))
+                    for entries in entries_by_race]
         
-        if self.model is not None:
-            # 学習済みモデルがある場合
-            features = self._extract_features(entries)
-            predictions = self.model.predict_proba(features)
-            
-            for i, entry in enumerate(entries):
-                prob = BoatProbability(
+        race_index, boat_index, features = self._build_features(entries_by_race)
+        executor = self.executor
+        if executor is not None:
+            probs = executor.place_probabilities(features, race_index, boat_index, version)
+        else:
+            probs = self._predict_place_probabilities(features, race_index, boat_index, model)
+        
+        results = []
+        offset = 0
+        for entries in entries_by_race:
+            race_probs = probs[offset:offset + len(entries)]
+            offset += len(entries)
+            probabilities = [
+                BoatProbability(
                     boat_no=entry.boat_no,
-                    prob_1st=float(predictions[i][0]),
-                    prob_2nd=float(predictions[i][1]),
-                    prob_3rd=float(predictions[i][2]),
-                    expected_rank=self._calculate_expected_rank(predictions[i])
+                    prob_1st=round(float(p[0]), 4),
+                    prob_2nd=round(float(p[1]), 4),
+                    prob_3rd=round(float(p[2]), 4),
+                    expected_rank=round(self._calculate_expected_rank(p), 2),
                 )
-                probabilities.append(prob)
-        else:
-            # モデルがない場合は簡易予測
-            probabilities = self._simple_prediction(entries)
+                for entry, p in zip(entries, race_probs)
+            ]
+            results.append(self._build_prediction(entries, probabilities))
+        return results
+    
+    def _build_features(self, entries_by_race: List[List]):
+        """複数レースの特徴量行列と各行のレース番号・艇インデックスを作る"""
+        all_entries = [entry for entries in entries_by_race for entry in entries]
+        race_index = np.repeat(np.arange(len(entries_by_race)), [len(e) for e in entries_by_race])
+        boat_index = np.array([entry.boat_no - 1 for entry in all_entries], dtype=int)
+        course_probs = None
+        if self.course_model.fitted:
+            course_probs = entry_course_probs(self.course_model.predict_entries(entries_by_race), entries_by_race)
+        context = self.context_loader(entries_by_race) if self.context_loader is not None else None
+        features = build_feature_matrix(entries_to_columns(all_entries), race_index, course_probs, context)
+        return race_index, boat_index, features
+    
+    def explain(self, entries: List) -> Optional[List[BoatExplanation]]:
+        """1レースの特徴量寄与（モデルがない場合は None）"""
+        return self.explain_batch([entries])[0]
+    
+    def explain_batch(self, entries_by_race: List[List]) -> List[Optional[List[BoatExplanation]]]:
+        """
+        複数レースの特徴量寄与を計算（TreeSHAP）
+        
+        (モデルバージョン, 特徴量ハッシュ) でキャッシュし、キャッシュにないレースだけを
+        まとめて1回の LightGBM 呼び出しで計算する。寄与は binary なら1着の対数オッズ、
+        ranking ならランキングスコアに対するもの
+        """
+        model, version = self.serving()
+        if model is None:
+            return [None] * len(entries_by_race)
+        version = version or f"bundle-{id(model)}"
+        
+        race_index, boat_index, features = self._build_features(entries_by_race)
+        rows = np.split(np.arange(len(race_index)), np.cumsum([len(e) for e in entries_by_race])[:-1])
+        keys = [(version, race_key(features[r], boat_index[r])) for r in rows]
+        results = [self.explanation_cache.get(key) for key in keys]
+        
+        missing = [i for i, result in enumerate(results) if result is None and len(rows[i])]
+        if missing:
+            missing_rows = np.concatenate([rows[i] for i in missing])
+            contributions = feature_contributions(model, features[missing_rows])
+            offset = 0
+            for i in missing:
+                race_contrib = contributions[offset:offset + len(rows[i])]
+                offset += len(rows[i])
+                results[i] = [
+                    BoatExplanation(
+                        boat_no=entry.boat_no,
+                        base_value=round(float(c[-1]), 4),
+                        contributions={
+                            name: round(float(value), 4) for name, value in zip(FEATURE_NAMES, c[:-1])
+                        },
+                    )
+                    for entry, c in zip(entries_by_race[i], race_contrib)
+                ]
+                self.explanation_cache.put(keys[i], results[i])
+        return results
+    
+    def _predict_place_probabilities(self, features: np.ndarray, race_index: np.ndarray,
+                                     boat_index: np.ndarray, model: Optional[Dict] = None) -> np.ndarray:
+        """1〜3着の確率 (n_rows, 3) を計算し、レースごとに各着順の合計を1に正規化"""
+        model = model or self.model
+        compiled = model.get("compiled") if len(features) <= self.COMPILED_MAX_ROWS else None
+        if model.get("model_type") == "ranking":
+            # スコアを1回だけ計算し、1着確率から2・3着確率をHarvilleモデルで導く
+            scores = compiled["model"].predict_raw(features) if compiled else model["model"].predict(features)
+            win_probs = race_softmax(scores, race_index, boat_index, model.get("temperature", 1.0))
+            return position_probabilities(win_probs)[race_index, boat_index]
         
+        probs = np.column_stack([
+            compiled[key].predict(features) if compiled else model[key].predict_proba(features)[:, 1]
+            for key in ("model_1st", "model_2nd", "model_3rd")
+        ])
+        totals = np.zeros((race_index.max() + 1, 3))
+        np.add.at(totals, race_index, probs)
+        return probs / np.maximum(totals[race_index], 1e-12)
+    
+    def _build_prediction(self, entries: List, probabilities: List[BoatProbability]) -> MLPrediction:
+        """確率リストから予想結果を組み立て"""
         # 1着確率でソート
         probabilities.sort(key=lambda x: x.prob_1st, reverse=True)
         
@@ -67,31 +302,17 @@ class MLPredictor:
             model_confidence=confidence
         )
     
-    def _extract_features(self, entries: List) -> np.ndarray:
-        """特徴量を抽出"""
-        features = []
-        
-        for entry in entries:
-            feat = [
-                entry.boat_no,
-                entry.win_rate_all or 0,
-                entry.place_rate_2_all or 0,
-                entry.win_rate_local or 0,
-                entry.place_rate_2_local or 0,
-                entry.motor_rate_2 or 0,
-                entry.boat_rate_2 or 0,
-                entry.avg_start_timing or 0,
-                self._rank_to_numeric(entry.racer_rank),
-                entry.weight or 52,  # デフォルト体重
-            ]
-            features.append(feat)
-        
-        return np.array(features)
+    def win_probabilities(self, entries: List) -> np.ndarray:
+        """予想結果を艇番順の1着確率ベクトル (6,) に変換"""
+        return self.batch_win_probabilities([entries])[0]
     
-    def _rank_to_numeric(self, rank: str) -> int:
-        """級別を数値に変換"""
-        rank_map = {"A1": 4, "A2": 3, "B1": 2, "B2": 1}
-        return rank_map.get(rank, 2)
+    def batch_win_probabilities(self, entries_by_race: List[List]) -> np.ndarray:
+        """複数レースの1着確率行列 (races, 6) を計算"""
+        probs = np.zeros((len(entries_by_race), 6))
+        for r, prediction in enumerate(self.predict_batch(entries_by_race)):
+            for p in prediction.probabilities:
+                probs[r, p.boat_no - 1] = p.prob_1st
+        return probs
     
     def _simple_prediction(self, entries: List) -> List[BoatProbability]:
         """簡易予測（モデルがない場合）"""
@@ -135,9 +356,11 @@ class MLPredictor:
     
     def _calculate_expected_rank(self, probs: np.ndarray) -> float:
         """期待順位を計算"""
-        # probs: [prob_1st, prob_2nd, prob_3rd, prob_4th, prob_5th, prob_6th]
+        # probs: [prob_1st, prob_2nd, prob_3rd]。4着以下は平均の5着として扱う
+        probs = np.asarray(probs, dtype=float)
         ranks = np.arange(1, len(probs) + 1)
-        return float(np.sum(probs * ranks))
+        rest = max(1.0 - probs.sum(), 0.0)
+        return float(np.sum(probs * ranks) + rest * 5)
     
     def _calculate_confidence(self, probabilities: List[BoatProbability]) -> float:
         """予測の信頼度を計算"""
@@ -152,3 +375,87 @@ class MLPredictor:
             confidence = probs[0] if probs else 0
         
         return round(min(confidence * 2, 1.0), 4)  # 0-1に正規化
+
+
+class ModelWatcher:
+    """
+    レジストリを監視し、現行バージョンが変わったらバックグラウンドで読み込んで差し替える
+    
+    読み込み・ウォームアップは監視スレッドで行い、リクエスト処理側は参照の差し替えしか見ないため
+    切り替え時にレイテンシが跳ねない。差し替えた後は on_swap を呼ぶ（予想の事前計算の積み直しなど）。
+    """
+    
+    def __init__(self, predictor: MLPredictor, interval: float = 10.0,
+                 on_swap: Optional[Callable[[], object]] = None):
+        self.predictor = predictor
+        self.interval = interval
+        self.on_swap = on_swap
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._seen_mtime = None
+        self.last_error = None
+    
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Model watcher error: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def trigger(self):
+        """次の確認を待たずに監視スレッドを起こす"""
+        self._wake.set()
+    
+    def check(self) -> bool:
+        """
+        現行バージョンが変わっていれば読み込んで差し替える
+        
+        Returns:
+            差し替えたかどうか
+        """
+        with self._lock:
+            mtime = self.predictor.registry.manifest_mtime()
+            if mtime is None or mtime == self._seen_mtime:
+                return False
+            
+            version = self.predictor.registry.current_version()
+            if version is None or version == self.predictor.model_version:
+                self._seen_mtime = mtime
+                return False
+            
+            # 読み込みに失敗した場合は _seen_mtime を更新せず、次の確認で読み込み直す
+            started = time.perf_counter()
+            bundle = self.predictor.load_version(version)
+            if bundle is None:
+                self.last_error = f"version {version} could not be loaded"
+                return False
+            self.predictor.swap(bundle, version)
+            self._seen_mtime = mtime
+            self.last_error = None
+            print(f"Model {version} loaded in {time.perf_counter() - started:.2f}s")
+        if self.on_swap is not None:
+            try:
+                self.on_swap()
+            except Exception as e:
+                self.last_error = f"on_swap: {e}"
+                print(f"Model swap callback failed: {e}")
+        return True
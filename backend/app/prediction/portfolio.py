@@ -0,0 +1,126 @@
+"""1日の予算を全レースに配分するポートフォリオ最適化"""
+from typing import Dict, List
+
+import numpy as np
+
+from app.prediction.betting import BET_UNIT, build_recommendations
+
+
+class PortfolioAllocator:
+    """
+    期待対数成長率を最大化する資金配分
+
+    各レースは独立、同一レース内の買い目は排他的な事象として
+    sum_r E[log(1 - S_r + f_rt * odds_rt)] を最大化する。
+    制約は f >= 0, レースごとの合計 S_r <= per_race_limit, 全体の合計 <= total_limit
+    （いずれも予算に対する比率）。Frank-Wolfe法で (races, 買い目) 配列のまま解く。
+    """
+
+    def __init__(
+        self,
+        per_race_limit: float = 0.1,
+        total_limit: float = 1.0,
+        max_iterations: int = 500,
+        tolerance: float = 1e-6,
+    ):
+        if not 0 < per_race_limit < 1:
+            raise ValueError("per_race_limit must be between 0 and 1")
+        if not 0 < total_limit <= 1:
+            raise ValueError("total_limit must be greater than 0 and at most 1")
+        if per_race_limit > total_limit:
+            raise ValueError("per_race_limit must not exceed total_limit")
+        self.per_race_limit = per_race_limit
+        self.total_limit = total_limit
+        self.max_iterations = max_iterations
+        self.tolerance = tolerance
+
+    def _objective(self, f, probs, odds, p_none) -> float:
+        """期待対数成長率"""
+        base = 1.0 - f.sum(axis=1, keepdims=True)
+        return float(np.sum(probs * np.log(base + f * odds)) + np.sum(p_none * np.log(base)))
+
+    def _gradient(self, f, probs, odds, p_none) -> np.ndarray:
+        """目的関数の勾配"""
+        base = 1.0 - f.sum(axis=1, keepdims=True)
+        wealth_hit = base + f * odds
+        hit_terms = probs / wealth_hit
+        return probs * odds / wealth_hit - hit_terms.sum(axis=1, keepdims=True) - p_none / base
+
+    def _linear_oracle(self, grad, valid):
+        """線形化した目的関数を制約集合上で最大化する頂点（各レース最良の1点に上限まで配分）"""
+        masked = np.where(valid, grad, -np.inf)
+        best = masked.argmax(axis=1)
+        best_value = masked[np.arange(len(best)), best]
+
+        vertex = np.zeros_like(grad)
+        candidates = np.flatnonzero(best_value > 0)
+        if len(candidates) == 0:
+            return vertex
+
+        # 勾配の大きいレースから全体上限まで埋める
+        candidates = candidates[np.argsort(-best_value[candidates])]
+        capacity = np.full(len(candidates), self.per_race_limit)
+        filled = np.cumsum(capacity)
+        capacity = np.clip(self.total_limit - (filled - capacity), 0.0, capacity)
+        vertex[candidates, best[candidates]] = capacity
+        return vertex
+
+    def solve(self, probs: np.ndarray, odds: np.ndarray) -> Dict:
+        """
+        配分比率を計算
+
+        Args:
+            probs: 的中確率 (races, 買い目数)
+            odds: オッズ (races, 買い目数)。購入不可の買い目はNaN
+
+        Returns:
+            fractions: 予算に対する配分比率 (races, 買い目数)
+            expected_log_growth: 最適化後の期待対数成長率
+            iterations: 反復回数
+        """
+        valid = np.isfinite(odds) & (odds > 1.0)
+        probs = np.where(valid, probs, 0.0)
+        odds = np.where(valid, odds, 0.0)
+        p_none = np.clip(1.0 - probs.sum(axis=1, keepdims=True), 0.0, 1.0)
+
+        f = np.zeros_like(probs)
+        grad = self._gradient(f, probs, odds, p_none)
+        iteration = 0
+        for iteration in range(1, self.max_iterations + 1):
+            vertex = self._linear_oracle(grad, valid)
+            direction = vertex - f
+            gap = np.sum(grad * direction)
+            if gap <= self.tolerance:
+                break
+            f += 2.0 / (iteration + 2.0) * direction
+            grad = self._gradient(f, probs, odds, p_none)
+
+        return {
+            "fractions": f,
+            "expected_log_growth": self._objective(f, probs, odds, p_none),
+            "iterations": iteration,
+        }
+
+    def allocate(
+        self,
+        race_ids: List[int],
+        bet_type: str,
+        probs: np.ndarray,
+        odds: np.ndarray,
+        budget: int,
+    ) -> Dict:
+        """予算を配分し、レースごとの買い目リストを返す"""
+        if budget <= 0:
+            raise ValueError("budget must be positive")
+        solution = self.solve(probs, odds)
+        fractions = solution["fractions"]
+        amounts = (np.floor(fractions * budget / BET_UNIT) * BET_UNIT).astype(int)
+
+        return {
+            "recommendations": build_recommendations(
+                race_ids, bet_type, probs, odds, fractions, amounts
+            ),
+            "total_amount": int(amounts.sum()),
+            "expected_log_growth": solution["expected_log_growth"],
+            "iterations": solution["iterations"],
+        }
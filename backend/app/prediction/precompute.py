@@ -0,0 +1,211 @@
+"""出走表の保存時に統計/ML予想を先に計算しておくバックグラウンド処理"""
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import db_models
+from app.models.schemas import PredictionWeights, StatisticalPrediction, MLPrediction
+from app.prediction.cache import PredictionCache, prediction_cache, prediction_key
+
+
+# 計算に失敗したレースを積み直す回数の上限
+MAX_ATTEMPTS = 3
+
+
+class PredictionPrecomputer:
+    """
+    スクレイパーが保存・更新したレースを受け取り、統計予想（既定の重み）と
+    ML予想をまとめて計算して予想キャッシュに入れる
+
+    enqueue は ID を積むだけなので保存処理は待たされない。ワーカーは ID が wait_seconds の間
+    届かなくなるまで（最長 max_wait_seconds）待って同じ開催日の他のレースをまとめ、ML は1回の
+    バッチ推論で計算する。wait_seconds はスクレイパーのリクエスト間隔（1秒）より長くしておく。
+    結果が出ているレースと開催日が過ぎたレース（過去データの取り込み）は計算しない。
+    失敗したバッチのレースは MAX_ATTEMPTS 回まで積み直す。
+    進入予測・特徴量ストア・モデルのバージョンが変わってキャッシュのキーが切り替わったときは
+    enqueue_upcoming で結果の出ていないレースをまとめて積み直す（キーが変わらないレースは計算しない）。
+    start していない間（スクレイパーを単体で動かす場合など）は enqueue しても何もしない
+    """
+
+    def __init__(self, cache: Optional[PredictionCache] = None, max_batch_races: int = 144,
+                 wait_seconds: float = 3.0, max_wait_seconds: float = 60.0):
+        self.cache = cache if cache is not None else prediction_cache  # 空のキャッシュは偽になる
+        self.max_batch_races = max_batch_races
+        self.wait_seconds = wait_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.statistical_predictor = None
+        self.ml_predictor = None
+        self._pending: Set[int] = set()
+        self._attempts: Dict[int, int] = {}
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.computed = 0
+        self.last_error = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, statistical_predictor, ml_predictor):
+        """予想エンジンを設定してワーカーを起動"""
+        self.statistical_predictor = statistical_predictor
+        self.ml_predictor = ml_predictor
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prediction-precompute", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def enqueue(self, race_id: int):
+        """レースを計算待ちに追加（同じレースが積まれていれば1回にまとまる）"""
+        if not self.running:
+            return
+        with self._condition:
+            self._pending.add(race_id)
+            self._condition.notify()
+
+    def enqueue_upcoming(self, db: Optional[Session] = None) -> int:
+        """
+        開催日が今日以降で結果の出ていないレースをすべて計算待ちに追加
+
+        結果の反映やモデルの切り替えで予想エンジンのバージョンが変わった後に呼ぶ。
+        db を渡さない場合（モデル監視スレッドなど）はセッションを開いて読む
+
+        Returns:
+            追加したレース数
+        """
+        if not self.running:
+            return 0
+        own_session = db is None
+        if own_session:
+            db = SessionLocal()
+        try:
+            finished = db.query(db_models.RaceResult.race_id)
+            race_ids = [race_id for (race_id,) in db.query(db_models.Race.id).filter(
+                db_models.Race.race_date >= date.today(),
+                db_models.Race.id.notin_(finished),
+            ).all()]
+        finally:
+            if own_session:
+                db.close()
+        if race_ids:
+            with self._condition:
+                self._pending.update(race_ids)
+                self._condition.notify()
+        return len(race_ids)
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def _take_batch(self) -> List[int]:
+        """計算待ちのレースを最大 max_batch_races 件取り出す（届くまで待つ）"""
+        with self._condition:
+            while not self._pending and not self._stop.is_set():
+                self._condition.wait()
+            # 続けて保存される同じ日のレースをまとめる（新しい ID が来なくなるまで待つ）
+            deadline = time.monotonic() + self.max_wait_seconds
+            while not self._stop.is_set() and len(self._pending) < self.max_batch_races:
+                seen = len(self._pending)
+                self._condition.wait(self.wait_seconds)
+                if len(self._pending) == seen or time.monotonic() >= deadline:
+                    break
+            batch = sorted(self._pending)[:self.max_batch_races]
+            self._pending.difference_update(batch)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if not batch or self._stop.is_set():
+                continue
+            db = SessionLocal()
+            try:
+                self.process(db, batch)
+                self.last_error = None
+                for race_id in batch:
+                    self._attempts.pop(race_id, None)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Prediction precompute failed: {e}")
+                self._retry(batch)
+            finally:
+                db.close()
+
+    def _retry(self, batch: List[int]):
+        """失敗したバッチのレースを、上限回数に達していなければ積み直す"""
+        retry = []
+        for race_id in batch:
+            attempts = self._attempts.get(race_id, 0) + 1
+            if attempts < MAX_ATTEMPTS:
+                self._attempts[race_id] = attempts
+                retry.append(race_id)
+            else:
+                self._attempts.pop(race_id, None)
+        if retry:
+            with self._condition:
+                self._pending.update(retry)
+
+    def process(self, db: Session, race_ids: List[int]) -> Dict[str, int]:
+        """
+        レースの予想を計算してキャッシュに入れる（キャッシュ済みのものは計算しない）
+
+        Returns:
+            statistical / ml: 新たに計算したレース数
+        """
+        # 結果が出たレース・開催日が過ぎたレースの予想は見られないので計算しない
+        finished = db.query(db_models.RaceResult.race_id).filter(db_models.RaceResult.race_id.in_(race_ids))
+        races = db.query(db_models.Race).filter(
+            db_models.Race.id.in_(race_ids),
+            db_models.Race.race_date >= date.today(),
+            db_models.Race.id.notin_(finished),
+        ).all()
+        entries_by_race: Dict[int, List] = {}
+        for entry in db.query(db_models.RaceEntry).filter(db_models.RaceEntry.race_id.in_(race_ids)).all():
+            entries_by_race.setdefault(entry.race_id, []).append(entry)
+        races = [race for race in races if race.id in entries_by_race]
+
+        counts = {"statistical": 0, "ml": 0}
+        if self.statistical_predictor is not None:
+            weights = PredictionWeights()
+            version = self.statistical_predictor.engine_version
+            for race in races:
+                entries = entries_by_race[race.id]
+                key = prediction_key("statistical", race, entries, weights.model_dump(), version)
+                if self.cache.get(db, key, StatisticalPrediction) is None:
+                    result = self.statistical_predictor.predict(entries, weights)
+                    self.cache.put(db, "statistical", race.id, key, result)
+                    counts["statistical"] += 1
+
+        if self.ml_predictor is not None:
+            version = self.ml_predictor.engine_version
+            missing = []
+            for race in races:
+                entries = entries_by_race[race.id]
+                key = prediction_key("ml", race, entries, None, version)
+                if self.cache.get(db, key, MLPrediction) is None:
+                    missing.append((race, key))
+            if missing:
+                results = self.ml_predictor.predict_batch([entries_by_race[race.id] for race, _ in missing])
+                for (race, key), result in zip(missing, results):
+                    self.cache.put(db, "ml", race.id, key, result)
+                counts["ml"] = len(missing)
+
+        self.computed += counts["statistical"] + counts["ml"]
+        return counts
+
+
+prediction_precomputer = PredictionPrecomputer()
@@ -0,0 +1,124 @@
+"""ML推論を別プロセスで実行するワーカープール"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+
+
+# ワーカープロセス内の予測器（プロセスごとに1回だけモデルを読み込む）
+_worker_predictor = None
+
+
+def _init_worker(bundle: Optional[Dict], registry_dir: Optional[str]):
+    global _worker_predictor
+    from app.prediction.ml_model import MLPredictor
+    from ml.registry import ModelRegistry
+
+    _worker_predictor = MLPredictor(bundle=bundle, registry=ModelRegistry(registry_dir))
+
+
+def _noop():
+    return None
+
+
+def _shared_arrays(buffer, n_rows: int, n_features: int):
+    """共有メモリ上の配列: 特徴量 (n, f), レース番号 (n,), 艇番号 (n,), 出力 (n, 3)"""
+    block = np.ndarray((n_rows * (n_features + 5),), dtype=np.float64, buffer=buffer)
+    features = block[:n_rows * n_features].reshape(n_rows, n_features)
+    offset = n_rows * n_features
+    race_index = block[offset:offset + n_rows]
+    boat_index = block[offset + n_rows:offset + 2 * n_rows]
+    output = block[offset + 2 * n_rows:].reshape(n_rows, 3)
+    return features, race_index, boat_index, output
+
+
+def _worker_place_probabilities(shm_name: str, n_rows: int, n_features: int, version: Optional[str]):
+    """共有メモリの特徴量から1〜3着確率を計算して同じ共有メモリに書き込む"""
+    predictor = _worker_predictor
+    if version is not None and version != predictor.model_version:
+        bundle = predictor.load_version(version)
+        if bundle is not None:
+            predictor.swap(bundle, version)
+    if predictor.model is None:
+        raise RuntimeError("No model is loaded in the inference worker")
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        features, race_index, boat_index, output = _shared_arrays(shm.buf, n_rows, n_features)
+        output[:] = predictor._predict_place_probabilities(
+            features, race_index.astype(int), boat_index.astype(int)
+        )
+        del features, race_index, boat_index, output
+    finally:
+        shm.close()
+
+
+class ProcessInferenceEngine:
+    """
+    モデルを読み込んだワーカープロセスのプールで推論する
+
+    特徴量・確率の配列は共有メモリでやり取りし、プロセス間で送るのは共有メモリ名と
+    行数だけにする。推論中にGILを持つ処理がAPIプロセスの他のリクエストを遅らせない。
+    """
+
+    def __init__(self, n_workers: int = 2, bundle: Optional[Dict] = None,
+                 registry_dir: Optional[str] = None):
+        """
+        Args:
+            n_workers: ワーカープロセス数
+            bundle: ワーカーで使うモデル（省略時は各ワーカーがレジストリから読み込む）
+            registry_dir: レジストリのディレクトリ（省略時は既定の場所）
+        """
+        if n_workers < 1:
+            raise ValueError("n_workers must be at least 1")
+        self.n_workers = n_workers
+        self.bundle = bundle
+        self.registry_dir = registry_dir
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """ワーカーを起動し、全ワーカーでモデルの読み込みを済ませる"""
+        if self._pool is not None:
+            return
+        # スレッドを持つAPIプロセスから fork しないよう spawn で起動する
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.bundle, self.registry_dir),
+        )
+        # 最初のリクエストでワーカーの起動・モデル読み込みを待たないよう先に起こしておく
+        for future in [self._pool.submit(_noop) for _ in range(self.n_workers)]:
+            future.result()
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def place_probabilities(self, features: np.ndarray, race_index: np.ndarray,
+                            boat_index: np.ndarray, version: Optional[str] = None) -> np.ndarray:
+        """
+        1〜3着の確率 (n_rows, 3) をワーカーで計算
+
+        Args:
+            version: 使用するモデルのバージョン（ワーカーの読み込み済みバージョンと違えば切り替える）
+        """
+        if self._pool is None:
+            raise RuntimeError("ProcessInferenceEngine is not started")
+        n_rows, n_features = features.shape
+        shm = shared_memory.SharedMemory(create=True, size=max(n_rows * (n_features + 5), 1) * 8)
+        try:
+            shared_features, shared_race, shared_boat, output = _shared_arrays(shm.buf, n_rows, n_features)
+            shared_features[:] = features
+            shared_race[:] = race_index
+            shared_boat[:] = boat_index
+            self._pool.submit(_worker_place_probabilities, shm.name, n_rows, n_features, version).result()
+            result = output.copy()
+            del shared_features, shared_race, shared_boat, output
+        finally:
+            shm.close()
+            shm.unlink()
+        return result
@@ -0,0 +1,203 @@
+"""モンテカルロ法によるレースシミュレーション"""
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models.schemas import SimulationPrediction, BoatProbability, TicketProbability
+from app.prediction.betting import BOAT_COUNT, TICKET_COMBINATIONS, TICKET_LABELS
+from app.prediction.course_entry import CourseEntryModel, course_entry_model
+from app.prediction.start_timing import (
+    DEFAULT_ST_MEAN, ST_PRIOR_WEIGHT, StartTimingModel, start_timing_model
+)
+
+
+# コース別の有利度（1コースが最も有利）
+COURSE_EFFECT = np.array([1.2, 0.35, 0.3, 0.2, 0.0, -0.2])
+
+# 3連単の艇番組 (a, b, c) → 買い目インデックスの対応表（a*36 + b*6 + c）
+_TRIFECTA_LOOKUP = np.full(BOAT_COUNT ** 3, -1)
+for _i, (_a, _b, _c) in enumerate(TICKET_COMBINATIONS["3連単"]):
+    _TRIFECTA_LOOKUP[(_a - 1) * 36 + (_b - 1) * 6 + (_c - 1)] = _i
+
+
+class RaceSimulator:
+    """
+    スタートタイミングと能力差から着順を多数回サンプリングする
+
+    各艇の ST を選手ごとの正規分布から引き、コース・モーター・選手能力の効果と
+    ノイズを加えた総合値の順で着順を決める。フライング（ST < 0）の艇は最下位扱い。
+    すべて (races, simulations, 6) の配列演算で処理する。
+    """
+
+    def __init__(
+        self,
+        n_simulations: int = 100_000,
+        max_batch_samples: int = 500_000,
+        st_coef: float = 12.0,
+        skill_coef: float = 0.45,
+        motor_coef: float = 0.2,
+        noise_scale: float = 1.0,
+        seed: Optional[int] = None,
+        start_timing: Optional[StartTimingModel] = None,
+        course_model: Optional[CourseEntryModel] = None,
+    ):
+        self.n_simulations = n_simulations
+        self.max_batch_samples = max_batch_samples
+        self.st_coef = st_coef
+        self.skill_coef = skill_coef
+        self.motor_coef = motor_coef
+        self.noise_scale = noise_scale
+        self.rng = np.random.default_rng(seed)
+        self.start_timing = start_timing or start_timing_model
+        self.course_model = course_model or course_entry_model
+
+    def simulate(
+        self,
+        st_mean: np.ndarray,
+        st_std: np.ndarray,
+        skill: np.ndarray,
+        motor: np.ndarray,
+        course: Optional[np.ndarray] = None,
+        n_simulations: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        複数レースの着順分布を計算
+
+        Args:
+            st_mean, st_std: 各艇のST分布 (races, 6)
+            skill, motor: レース内で標準化した能力・モーター指標 (races, 6)
+            course: 各艇の進入コース 1-6 (races, 6)。省略時は艇番どおり
+
+        Returns:
+            position_probs: 各艇の着順確率 (races, 6艇, 6着)
+            trifecta_probs: 3連単の確率 (races, 120)。列順は TICKET_COMBINATIONS と同じ
+        """
+        n_simulations = n_simulations or self.n_simulations
+        races = st_mean.shape[0]
+        if course is None:
+            course = np.tile(np.arange(1, BOAT_COUNT + 1), (races, 1))
+
+        base = (
+            COURSE_EFFECT[course - 1]
+            + self.skill_coef * skill
+            + self.motor_coef * motor
+        )[:, None, :]
+
+        position_counts = np.zeros(races * BOAT_COUNT * BOAT_COUNT)
+        trifecta_counts = np.zeros(races * 120)
+        race_offset = np.arange(races)[:, None]
+
+        # メモリ使用量を抑えるため races × simulations を一定サイズずつ処理
+        chunk_size = max(1, self.max_batch_samples // races)
+        done = 0
+        while done < n_simulations:
+            size = min(chunk_size, n_simulations - done)
+            shape = (races, size, BOAT_COUNT)
+
+            st = st_mean[:, None, :] + st_std[:, None, :] * self.rng.standard_normal(shape)
+            st_gap = st - st.min(axis=2, keepdims=True)
+            performance = base - self.st_coef * st_gap + self.noise_scale * self.rng.gumbel(size=shape)
+            performance = np.where(st < 0, -np.inf, performance)
+
+            order = np.argsort(-performance, axis=2)  # 着順ごとの艇インデックス
+
+            # 艇×着順のカウント（レースごとにオフセットを付けて一括bincount）
+            flat = (race_offset[:, :, None] * BOAT_COUNT + order) * BOAT_COUNT + np.arange(BOAT_COUNT)
+            position_counts += np.bincount(flat.ravel(), minlength=position_counts.size)
+
+            trifecta = _TRIFECTA_LOOKUP[order[:, :, 0] * 36 + order[:, :, 1] * 6 + order[:, :, 2]]
+            trifecta_counts += np.bincount(
+                (race_offset * 120 + trifecta).ravel(), minlength=trifecta_counts.size
+            )
+            done += size
+
+        return {
+            "position_probs": position_counts.reshape(races, BOAT_COUNT, BOAT_COUNT) / n_simulations,
+            "trifecta_probs": trifecta_counts.reshape(races, 120) / n_simulations,
+        }
+
+    def build_inputs(self, entries_by_race: List[List]) -> Dict[str, np.ndarray]:
+        """
+        出走表からシミュレーション入力配列 (races, 6) を作成
+
+        進入コースは進入予測モデルで最も尤もらしい並びとし、ST分布は選手の
+        その進入コースでの過去STから求める。平均は出走表の平均STを事前値として
+        過去の出走数に応じて寄せる。
+        """
+        races = len(entries_by_race)
+        registration_nos = np.full((races, BOAT_COUNT), None, dtype=object)
+        avg_st = np.full((races, BOAT_COUNT), DEFAULT_ST_MEAN)
+        win_rate = np.zeros((races, BOAT_COUNT))
+        motor_rate = np.zeros((races, BOAT_COUNT))
+
+        for r, entries in enumerate(entries_by_race):
+            for entry in entries:
+                b = entry.boat_no - 1
+                registration_nos[r, b] = entry.racer_registration_no
+                if entry.avg_start_timing:
+                    avg_st[r, b] = entry.avg_start_timing
+                win_rate[r, b] = entry.win_rate_all or 0
+                motor_rate[r, b] = entry.motor_rate_2 or 0
+
+        courses = self.course_model.predict_entries(entries_by_race)["courses"]
+        st = self.start_timing.distributions(registration_nos.ravel(), courses.ravel())
+        count = st["racer_count"].reshape(races, BOAT_COUNT)
+        st_mean = (
+            count * st["mean"].reshape(races, BOAT_COUNT) + ST_PRIOR_WEIGHT * avg_st
+        ) / (count + ST_PRIOR_WEIGHT)
+
+        return {
+            "st_mean": st_mean,
+            "st_std": st["std"].reshape(races, BOAT_COUNT),
+            "skill": _standardize(win_rate),
+            "motor": _standardize(motor_rate),
+            "course": courses,
+        }
+
+    def simulate_races(self, db: Session, entries_by_race: List[List],
+                       n_simulations: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """出走表のリストから着順分布を一括計算"""
+        self.start_timing.ensure_fitted(db)
+        self.course_model.ensure_fitted(db)
+        inputs = self.build_inputs(entries_by_race)
+        return self.simulate(n_simulations=n_simulations, **inputs)
+
+    def predict(self, db: Session, entries: List, n_simulations: Optional[int] = None) -> SimulationPrediction:
+        """1レース分のシミュレーション予想を生成"""
+        n_simulations = n_simulations or self.n_simulations
+        result = self.simulate_races(db, [entries], n_simulations)
+        positions = result["position_probs"][0]
+        trifecta = result["trifecta_probs"][0]
+
+        ranks = np.arange(1, BOAT_COUNT + 1)
+        probabilities = [
+            BoatProbability(
+                boat_no=entry.boat_no,
+                prob_1st=round(float(positions[entry.boat_no - 1, 0]), 4),
+                prob_2nd=round(float(positions[entry.boat_no - 1, 1]), 4),
+                prob_3rd=round(float(positions[entry.boat_no - 1, 2]), 4),
+                expected_rank=round(float(np.sum(positions[entry.boat_no - 1] * ranks)), 2),
+            )
+            for entry in entries
+        ]
+        probabilities.sort(key=lambda x: x.prob_1st, reverse=True)
+
+        top = np.argsort(-trifecta)[:10]
+        labels = TICKET_LABELS["3連単"]
+        return SimulationPrediction(
+            race_id=entries[0].race_id if entries else 0,
+            probabilities=probabilities,
+            predicted_rank=labels[top[0]],
+            trifecta_top=[
+                TicketProbability(numbers=labels[t], probability=round(float(trifecta[t]), 5))
+                for t in top
+            ],
+            n_simulations=n_simulations,
+        )
+
+
+def _standardize(values: np.ndarray) -> np.ndarray:
+    """レース内で平均0・標準偏差1に標準化"""
+    std = values.std(axis=1, keepdims=True)
+    return (values - values.mean(axis=1, keepdims=True)) / np.where(std > 0, std, 1.0)
@@ -0,0 +1,201 @@
+"""選手のスタートタイミング（ST）分布モデル"""
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.models import db_models
+from app.prediction.betting import BOAT_COUNT
+
+
+DEFAULT_ST_MEAN = 0.17
+DEFAULT_ST_STD = 0.05
+ST_PRIOR_WEIGHT = 5  # ST標準偏差を既定値に寄せる際の事前サンプル数
+COURSE_PRIOR_WEIGHT = 10  # コース別の値を選手全体の値に寄せる際の事前サンプル数
+LATE_ST = 0.25  # これ以上のSTを出遅れとみなす
+
+# 集計値の並び（選手 × [全コース, 1〜6コース] × 項目）
+_COUNT, _SUM, _SQUARE, _FLYING, _LATE = range(5)
+_N_STATS = 5
+
+
+def load_result_starts(db: Session, after_result_id: int = 0, before: Optional[date] = None,
+                       full_races_only: bool = False) -> Dict[str, np.ndarray]:
+    """
+    結果ID が after_result_id より大きいレースの出走を1行ずつ取得（before 指定時はその日より前のレースのみ）
+
+    full_races_only=True なら学習データと同じく6艇が揃ったレースだけを対象にする
+
+    Returns:
+        registration_no, boat_no, course（進入コース、不明は0）, st: 各 (n,)
+        max_result_id: 読み込んだ結果IDの最大値（なければ after_result_id）
+    """
+    query = db.query(
+        db_models.RaceResult.id,
+        db_models.RaceEntry.racer_registration_no,
+        db_models.RaceEntry.boat_no,
+        *[getattr(db_models.RaceResult, f"st_{i}") for i in range(1, BOAT_COUNT + 1)],
+        *[getattr(db_models.RaceResult, f"course_{i}") for i in range(1, BOAT_COUNT + 1)],
+    ).join(
+        db_models.RaceEntry, db_models.RaceEntry.race_id == db_models.RaceResult.race_id
+    ).filter(
+        db_models.RaceResult.id > after_result_id,
+        db_models.RaceEntry.racer_registration_no.isnot(None),
+        db_models.RaceEntry.boat_no.between(1, BOAT_COUNT),
+    )
+    if before is not None:
+        query = query.join(
+            db_models.Race, db_models.Race.id == db_models.RaceResult.race_id
+        ).filter(db_models.Race.race_date < before)
+    if full_races_only:
+        full_races = select(db_models.RaceEntry.race_id).group_by(
+            db_models.RaceEntry.race_id
+        ).having(func.count(db_models.RaceEntry.id) == BOAT_COUNT)
+        query = query.filter(db_models.RaceResult.race_id.in_(full_races))
+    rows = query.all()
+
+    values = np.array([row[2:] for row in rows], dtype=float).reshape(len(rows), 1 + 2 * BOAT_COUNT)
+    boat_no = values[:, 0].astype(int)
+    in_course = values[:, 1 + BOAT_COUNT:] == boat_no[:, None]
+    return {
+        "registration_no": np.array([row[1] for row in rows], dtype=object),
+        "boat_no": boat_no,
+        "course": np.where(in_course.any(axis=1), in_course.argmax(axis=1) + 1, 0),
+        "st": values[np.arange(len(rows)), boat_no],
+        "max_result_id": max((row[0] for row in rows), default=after_result_id),
+    }
+
+
+class StartTimingModel:
+    """
+    選手ごと・進入コースごとのST分布（平均・標準偏差・フライング率・出遅れ率）
+
+    RaceResult の st_1..6 と course_1..6 から、選手 × コースの件数・合計・二乗和・
+    フライング数・出遅れ数を配列で保持する。新しい結果は結果IDのウォーターマーク
+    以降の行だけを読み込んで加算する（既存の結果の修正は次の fit で反映される）。
+    分布の参照はメモリ上の配列から行うので、DBへの問い合わせは発生しない。
+    """
+
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._stats = np.zeros((0, BOAT_COUNT + 1, _N_STATS))
+        self.max_result_id = 0
+        self.fitted = False
+        self._lock = threading.Lock()
+
+    def _accumulate(self, registration_no: np.ndarray, course: np.ndarray, st: np.ndarray):
+        """ST の集計値を加算（コース不明の出走は全コースの集計にだけ入れる）"""
+        valid = np.isfinite(st)
+        registration_no, course, st = registration_no[valid], course[valid], st[valid]
+        if len(st) == 0:
+            return
+
+        for reg in dict.fromkeys(registration_no):
+            if reg not in self._index:
+                self._index[reg] = len(self._index)
+        if len(self._index) > len(self._stats):
+            grown = np.zeros((len(self._index), BOAT_COUNT + 1, _N_STATS))
+            grown[:len(self._stats)] = self._stats
+            self._stats = grown
+
+        rows = np.array([self._index[reg] for reg in registration_no])
+        values = np.column_stack([np.ones(len(st)), st, st ** 2, st < 0, st >= LATE_ST])
+        np.add.at(self._stats, (rows, 0), values)
+        known = course > 0
+        np.add.at(self._stats, (rows[known], course[known]), values[known])
+
+    def fit(self, db: Session) -> int:
+        """全結果から集計し直す（集計した出走数を返す）"""
+        starts = load_result_starts(db)
+        with self._lock:
+            self._index = {}
+            self._stats = np.zeros((0, BOAT_COUNT + 1, _N_STATS))
+            self._accumulate(starts["registration_no"], starts["course"], starts["st"])
+            self.max_result_id = starts["max_result_id"]
+            self.fitted = True
+        return len(starts["st"])
+
+    def refresh(self, db: Session) -> int:
+        """前回以降に追加された結果だけを加算（未学習なら fit）"""
+        if not self.fitted:
+            return self.fit(db)
+        # 同時に呼ばれても同じ出走を二重に加算しないよう、読み込みから加算までをロックする
+        with self._lock:
+            starts = load_result_starts(db, self.max_result_id)
+            self._accumulate(starts["registration_no"], starts["course"], starts["st"])
+            self.max_result_id = starts["max_result_id"]
+        return len(starts["st"])
+
+    def ensure_fitted(self, db: Session):
+        if not self.fitted:
+            self.fit(db)
+
+    def distributions(self, registration_nos: Sequence[Optional[str]],
+                      courses: Optional[Sequence[int]] = None) -> Dict[str, np.ndarray]:
+        """
+        各行の選手（・進入コース）のST分布
+
+        コース別の値は出走数に応じて選手全体の値へ、選手全体の標準偏差は既定値へ
+        縮小推定する。履歴のない選手は既定値・件数0を返す。
+
+        Args:
+            registration_nos: 選手登録番号 (n,)
+            courses: 進入コース 1-6 (n,)。省略時は全コースの分布
+
+        Returns:
+            mean, std, flying_rate, late_rate, count: 各 (n,)。courses 指定時は
+            コース別の件数 count に加えて選手全体の件数 racer_count も返す
+        """
+        with self._lock:
+            rows = np.array([self._index.get(reg, -1) for reg in registration_nos], dtype=int)
+            stats = np.zeros((len(rows), 2, _N_STATS))
+            known = rows >= 0
+            course_idx = np.zeros(len(rows), dtype=int) if courses is None else np.asarray(courses, dtype=int)
+            course_idx = np.where((course_idx >= 1) & (course_idx <= BOAT_COUNT), course_idx, 0)
+            stats[known, 0] = self._stats[rows[known], 0]
+            stats[known, 1] = self._stats[rows[known], course_idx[known]]
+
+        # 選手全体の分布
+        count = stats[:, 0, _COUNT]
+        n = np.maximum(count, 1)
+        mean = np.where(count > 0, stats[:, 0, _SUM] / n, DEFAULT_ST_MEAN)
+        var = np.where(count > 0, np.maximum(stats[:, 0, _SQUARE] / n - mean ** 2, 0.0), DEFAULT_ST_STD ** 2)
+        var = (count * var + ST_PRIOR_WEIGHT * DEFAULT_ST_STD ** 2) / (count + ST_PRIOR_WEIGHT)
+        flying = stats[:, 0, _FLYING] / n
+        late = stats[:, 0, _LATE] / n
+        if courses is None:
+            return {"mean": mean, "std": np.sqrt(var), "flying_rate": flying, "late_rate": late, "count": count}
+
+        # コース別の値を選手全体の値へ寄せる
+        course_count = stats[:, 1, _COUNT]
+        weight = course_count + COURSE_PRIOR_WEIGHT
+        course_mean = (stats[:, 1, _SUM] + COURSE_PRIOR_WEIGHT * mean) / weight
+        course_square = stats[:, 1, _SQUARE] + COURSE_PRIOR_WEIGHT * (var + mean ** 2)
+        course_var = np.maximum(course_square / weight - course_mean ** 2, 0.0)
+        return {
+            "mean": course_mean,
+            "std": np.sqrt(course_var),
+            "flying_rate": (stats[:, 1, _FLYING] + COURSE_PRIOR_WEIGHT * flying) / weight,
+            "late_rate": (stats[:, 1, _LATE] + COURSE_PRIOR_WEIGHT * late) / weight,
+            "count": course_count,
+            "racer_count": count,
+        }
+
+    def racer_summary(self, registration_no: str) -> Optional[List[Dict]]:
+        """選手の全コース・コース別のST分布（course=None が全コース）。履歴がなければ None"""
+        if registration_no not in self._index:
+            return None
+        overall = self.distributions([registration_no])
+        by_course = self.distributions([registration_no] * BOAT_COUNT, list(range(1, BOAT_COUNT + 1)))
+        summary = [{"course": None, **{k: float(v[0]) for k, v in overall.items()}}]
+        summary += [
+            {"course": c, **{k: float(v[c - 1]) for k, v in by_course.items() if k != "racer_count"}}
+            for c in range(1, BOAT_COUNT + 1)
+        ]
+        return summary
+
+
+start_timing_model = StartTimingModel()
@@ -1,11 +1,26 @@
 """統計ベース予想エンジン"""
-from typing import List
+from typing import List, Optional
+import numpy as np
+
 from app.models.schemas import PredictionWeights, StatisticalPrediction, BoatScore
+from app.prediction.course_entry import CourseEntryModel, course_entry_model
 
 
 class StatisticalPredictor:
     """統計分析による予想"""
     
+    # スコアの計算方法を変えたら上げる（予想キャッシュのキーに含まれる）
+    ENGINE_VERSION = 1
+    
+    def __init__(self, course_model: Optional[CourseEntryModel] = None):
+        """course_model が学習済みならコース別勝率を予測した進入コースの分布で平均する"""
+        self.course_model = course_model or course_entry_model
+    
+    @property
+    def engine_version(self) -> str:
+        """予想キャッシュのキーに含めるバージョン（進入予測の学習状態でコース別勝率が変わる）"""
+        return f"{self.ENGINE_VERSION}-{self.course_model.state_token}"
+    
     def predict(self, entries: List, weights: PredictionWeights) -> StatisticalPrediction:
         """
         出走表から統計スコアを計算して予想を生成
@@ -13,10 +28,13 @@ class StatisticalPredictor:
         各項目を正規化してスコア化し、重み付けで総合スコアを算出
         """
         scores = []
+        course_probs = None
+        if self.course_model.fitted:
+            course_probs = self.course_model.predict_entries([entries])["probs"][0]
         
         # 各艇のスコアを計算
         for entry in entries:
-            score_details = self._calculate_score_details(entry, entries, weights)
+            score_details = self._calculate_score_details(entry, entries, weights, course_probs)
             total_score = sum(score_details.values())
             
             scores.append({
@@ -51,7 +69,16 @@ class StatisticalPredictor:
             weights_used=weights
         )
     
-    def _calculate_score_details(self, entry, all_entries, weights: PredictionWeights) -> dict:
+    def win_probabilities(self, entries: List, weights: PredictionWeights) -> np.ndarray:
+        """総合スコアを艇番順の1着確率ベクトル (6,) に変換（スコア比で按分）"""
+        probs = np.zeros(6)
+        for s in self.predict(entries, weights).scores:
+            probs[s.boat_no - 1] = max(s.score, 0.0)
+        total = probs.sum()
+        return probs / total if total > 0 else np.full(6, 1 / 6)
+    
+    def _calculate_score_details(self, entry, all_entries, weights: PredictionWeights,
+                                 course_probs: Optional[np.ndarray] = None) -> dict:
         """各項目のスコアを計算"""
         details = {}
         
@@ -91,8 +118,8 @@ class StatisticalPredictor:
         else:
             details["avg_st"] = 0
         
-        # コース別勝率（枠番に基づく）
-        course_rate = self._get_course_rate_for_boat(entry)
+        # コース別勝率（進入予測があれば進入コースの期待値、なければ枠番に基づく）
+        course_rate = self._get_course_rate_for_boat(entry, course_probs)
         details["course_rate"] = round(course_rate * weights.course_rate, 2)
         
         # 今節成績スコア
@@ -101,8 +128,13 @@ class StatisticalPredictor:
         
         return details
     
-    def _get_course_rate_for_boat(self, entry) -> float:
-        """艇番に基づくコース勝率を取得"""
+    def _get_course_rate_for_boat(self, entry, course_probs: Optional[np.ndarray] = None) -> float:
+        """
+        艇番に基づくコース勝率を取得
+        
+        course_probs（艇番順の進入コース確率 (6, 6)）を渡すと、その艇の進入コースの
+        分布で平均したコース勝率を返す
+        """
         # インコースほど有利（1コースが最も有利）
         # 基本的なコース別勝率（統計的な傾向）
         base_rates = {
@@ -113,6 +145,8 @@ class StatisticalPredictor:
             5: 6.0,
             6: 2.0
         }
+        if course_probs is not None and entry.boat_no in base_rates:
+            return float(course_probs[entry.boat_no - 1] @ np.array([base_rates[c] for c in range(1, 7)]))
         return base_rates.get(entry.boat_no, 10.0)
     
     def _calculate_current_series_score(self, results: str) -> float:
@@ -0,0 +1,63 @@
+"""分析用データのエクスポートと集計クエリ"""
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+
+from app.database import SessionLocal
+from app.analytics.export import ParquetExporter
+from app.analytics.queries import AnalyticsEngine, QueryError
+
+router = APIRouter()
+exporter = ParquetExporter()
+analytics_engine = AnalyticsEngine(exporter.export_dir)
+
+
+def _run_export(incremental: bool):
+    """バックグラウンドでエクスポートを実行"""
+    db = SessionLocal()
+    try:
+        result = exporter.export(db, incremental=incremental)
+        print(f"Parquet export completed: {result}")
+    finally:
+        db.close()
+
+
+@router.post("/export")
+def export_parquet(background_tasks: BackgroundTasks, incremental: bool = True):
+    """レース履歴をParquetにエクスポート（バックグラウンド実行）"""
+    background_tasks.add_task(_run_export, incremental)
+    return {
+        "message": "Parquet export started in background",
+        "incremental": incremental,
+        "export_dir": exporter.export_dir,
+    }
+
+
+@router.get("/export")
+def get_export_status():
+    """エクスポート済みパーティションの状況を取得"""
+    manifest = exporter.read_manifest()
+    return {
+        "export_dir": exporter.export_dir,
+        "exported_at": manifest.get("exported_at"),
+        "partitions": len(manifest["partitions"]),
+    }
+
+
+@router.get("/queries")
+def list_queries():
+    """実行可能な集計クエリの一覧"""
+    return analytics_engine.list_queries()
+
+
+@router.get("/query/{name}")
+def run_query(name: str, request: Request):
+    """
+    登録済みの集計クエリを実行（パラメータはクエリ文字列で指定）
+    
+    例: /api/analytics/query/course_win_rate?venue_code=12&min_wind_speed=5
+    """
+    try:
+        return analytics_engine.run(name, dict(request.query_params))
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,62 @@
+"""学習済みモデルのバージョン管理"""
+from fastapi import APIRouter, HTTPException
+
+from app.models import schemas
+from app.routers.predictions import ml_predictor, model_watcher
+
+router = APIRouter()
+
+
+def _status() -> schemas.ModelRegistryStatus:
+    manifest = ml_predictor.registry.read_manifest()
+    active, pinned = manifest.get("active"), manifest.get("pinned")
+    serving = ml_predictor.model_version
+    return schemas.ModelRegistryStatus(
+        active=active,
+        pinned=pinned,
+        serving=serving,
+        watcher_error=model_watcher.last_error,
+        versions=[
+            schemas.ModelVersion(
+                **{k: v for k, v in meta.items() if k in schemas.ModelVersion.model_fields},
+                active=meta["version"] == active,
+                pinned=meta["version"] == pinned,
+                serving=meta["version"] == serving,
+            )
+            for meta in ml_predictor.registry.list_versions()
+        ],
+    )
+
+
+def _apply(change, *args) -> schemas.ModelRegistryStatus:
+    """マニフェストを更新し、新しい現行バージョンをこのリクエストのスレッドで読み込んで差し替え"""
+    try:
+        change(*args)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    model_watcher.check()
+    return _status()
+
+
+@router.get("/", response_model=schemas.ModelRegistryStatus)
+def list_models():
+    """登録済みモデルの一覧と使用中のバージョン"""
+    return _status()
+
+
+@router.post("/{version}/pin", response_model=schemas.ModelRegistryStatus)
+def pin_model(version: str):
+    """指定バージョンに固定（以後の昇格があっても切り替えない）"""
+    return _apply(ml_predictor.registry.pin, version)
+
+
+@router.delete("/pin", response_model=schemas.ModelRegistryStatus)
+def unpin_model():
+    """固定を解除して active のバージョンに戻す"""
+    return _apply(ml_predictor.registry.unpin)
+
+
+@router.post("/{version}/promote", response_model=schemas.ModelRegistryStatus)
+def promote_model(version: str):
+    """指定バージョンを active に昇格"""
+    return _apply(ml_predictor.registry.promote, version)
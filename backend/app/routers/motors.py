@@ -0,0 +1,34 @@
+"""モーター・ボートの成績履歴"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.models import schemas
+from ml.feature_store import equipment_feature_store
+
+router = APIRouter()
+
+
+def _history(kind: str, venue_code: str, number: str, limit: int, db: Session) -> schemas.EquipmentHistory:
+    rows = equipment_feature_store.history(db, kind, venue_code, number, limit)
+    if not rows:
+        raise HTTPException(status_code=404, detail=f"No {kind} history found")
+    return schemas.EquipmentHistory(
+        kind=kind,
+        venue_code=venue_code,
+        number=number,
+        latest=rows[0],
+        history=rows,
+    )
+
+
+@router.get("/{venue_code}/boats/{boat_no}", response_model=schemas.EquipmentHistory)
+def get_boat_history(venue_code: str, boat_no: str, limit: int = 100, db: Session = Depends(get_db)):
+    """ボートの成績履歴（集計日ごと、新しい順）"""
+    return _history("boat", venue_code, boat_no, limit, db)
+
+
+@router.get("/{venue_code}/{motor_no}", response_model=schemas.EquipmentHistory)
+def get_motor_history(venue_code: str, motor_no: str, limit: int = 100, db: Session = Depends(get_db)):
+    """モーターの成績履歴（交換以降の成績・直近の着順、集計日ごとに新しい順）"""
+    return _history("motor", venue_code, motor_no, limit, db)
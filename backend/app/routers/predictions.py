@@ -1,15 +1,73 @@
+import os
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
+import numpy as np
 
 from app.database import get_db
 from app.models import schemas, db_models
 from app.prediction.statistical import StatisticalPredictor
-from app.prediction.ml_model import MLPredictor
+from app.prediction.ml_model import MLPredictor, ModelWatcher
+from app.prediction.batching import InferenceBatcher
+from app.prediction.cache import prediction_cache, prediction_key
+from app.prediction.process_pool import ProcessInferenceEngine
+from app.prediction.betting import (
+    TicketOptimizer, TICKET_COMBINATIONS, ticket_probabilities, odds_to_array
+)
+from app.prediction.portfolio import PortfolioAllocator
+from app.prediction.precompute import prediction_precomputer
+from app.prediction.simulator import RaceSimulator
 
 router = APIRouter()
 statistical_predictor = StatisticalPredictor()
 ml_predictor = MLPredictor()
+# モデルを切り替えたら結果の出ていないレースの予想を新しいモデルで計算し直す
+model_watcher = ModelWatcher(ml_predictor, on_swap=prediction_precomputer.enqueue_upcoming)
+# 同時に届いたML予想リクエストを数ミリ秒待ち合わせて1回の推論にまとめる
+ml_batcher = InferenceBatcher(ml_predictor.predict_batch, max_batch_size=64, max_wait_ms=2.0)
+# 1以上にするとモデル推論をワーカープロセスで行う（推論中もAPIプロセスのGILを占有しない）
+# 環境変数 ML_PROCESS_WORKERS で指定する（マルチコアの本番環境向け。既定はプロセス内で推論）
+ML_PROCESS_WORKERS = int(os.environ.get("ML_PROCESS_WORKERS", "0"))
+ml_process_engine = ProcessInferenceEngine(ML_PROCESS_WORKERS) if ML_PROCESS_WORKERS > 0 else None
+race_simulator = RaceSimulator()
+
+
+def _win_probabilities(entries: List, engine: str, db: Session) -> np.ndarray:
+    """予想エンジンの出力を艇番順の1着確率ベクトルに変換"""
+    return _batch_win_probabilities([entries], engine, db)[0]
+
+
+def _batch_win_probabilities(entries_by_race: List[List], engine: str, db: Session) -> np.ndarray:
+    """複数レースの1着確率行列 (races, 6) を計算"""
+    if engine == "simulation":
+        # 買い目最適化では1着確率のみ必要なため試行回数を抑える
+        result = race_simulator.simulate_races(db, entries_by_race, n_simulations=20_000)
+        return result["position_probs"][:, :, 0]
+    if engine == "statistical":
+        weights = schemas.PredictionWeights()
+        return np.vstack([
+            statistical_predictor.win_probabilities(entries, weights) for entries in entries_by_race
+        ])
+    return ml_predictor.batch_win_probabilities(entries_by_race)
+
+
+def _day_win_probabilities(race_ids: List[int], engine: str, db: Session):
+    """複数レースの出走表をまとめて取得し、1着確率行列 (races, 6) を返す"""
+    entries = db.query(db_models.RaceEntry).filter(
+        db_models.RaceEntry.race_id.in_(race_ids)
+    ).all()
+    
+    entries_by_race = {}
+    for entry in entries:
+        entries_by_race.setdefault(entry.race_id, []).append(entry)
+    
+    race_ids = [race_id for race_id in race_ids if race_id in entries_by_race]
+    if not race_ids:
+        raise HTTPException(status_code=404, detail="No entries found for these races")
+    
+    win_probs = _batch_win_probabilities([entries_by_race[race_id] for race_id in race_ids], engine, db)
+    return race_ids, win_probs
 
 
 @router.get("/race/{race_id}", response_model=List[schemas.Prediction])
@@ -56,13 +114,44 @@ def get_statistical_prediction(
     if weights is None:
         weights = schemas.PredictionWeights()
     
-    result = statistical_predictor.predict(entries, weights)
+    key = prediction_key(
+        "statistical", race, entries, weights.model_dump(), statistical_predictor.engine_version
+    )
+    result = prediction_cache.get(db, key, schemas.StatisticalPrediction)
+    if result is None:
+        result = statistical_predictor.predict(entries, weights)
+        # 既定の重みの予想だけをテーブルに保存する（任意の重みはメモリ上だけ）
+        prediction_cache.put(db, "statistical", race_id, key, result,
+                             persist=weights == schemas.PredictionWeights())
     return result
 
 
+def _day_explanations(race: db_models.Race, db: Session):
+    """
+    開催日の全レースの特徴量寄与をまとめて計算し、指定レースの分を返す
+
+    同じ日の他のレースの寄与もキャッシュに入るため、続けて別のレースを見る場合は計算しない
+    """
+    entries = db.query(db_models.RaceEntry).join(
+        db_models.Race, db_models.Race.id == db_models.RaceEntry.race_id
+    ).filter(db_models.Race.race_date == race.race_date).all()
+    
+    entries_by_race = {}
+    for entry in entries:
+        entries_by_race.setdefault(entry.race_id, []).append(entry)
+    
+    race_ids = list(entries_by_race)
+    explanations = ml_predictor.explain_batch([entries_by_race[r] for r in race_ids])
+    return explanations[race_ids.index(race.id)]
+
+
 @router.post("/ml/{race_id}", response_model=schemas.MLPrediction)
-def get_ml_prediction(race_id: int, db: Session = Depends(get_db)):
-    """機械学習ベース予想を取得"""
+def get_ml_prediction(race_id: int, explain: bool = False, db: Session = Depends(get_db)):
+    """
+    機械学習ベース予想を取得
+    
+    explain=true の場合は各艇の特徴量寄与（TreeSHAP）を添える
+    """
     race = db.query(db_models.Race).filter(db_models.Race.id == race_id).first()
     if race is None:
         raise HTTPException(status_code=404, detail="Race not found")
@@ -74,10 +163,133 @@ def get_ml_prediction(race_id: int, db: Session = Depends(get_db)):
     if not entries:
         raise HTTPException(status_code=404, detail="No entries found for this race")
     
-    result = ml_predictor.predict(entries)
+    key = prediction_key("ml", race, entries, None, ml_predictor.engine_version)
+    result = prediction_cache.get(db, key, schemas.MLPrediction)
+    if result is None:
+        result = ml_batcher.predict(entries)
+        prediction_cache.put(db, "ml", race_id, key, result)
+    if explain:
+        result = result.model_copy(update={"explanations": _day_explanations(race, db)})
     return result
 
 
+@router.post("/tickets/day", response_model=List[schemas.TicketRecommendation])
+def optimize_day_tickets(
+    request: schemas.DayTicketOptimizationRequest,
+    db: Session = Depends(get_db)
+):
+    """複数レースの買い目を予算内でまとめて最適化"""
+    if request.bet_type not in TICKET_COMBINATIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported bet type: {request.bet_type}")
+    
+    race_ids, win_probs = _day_win_probabilities(list(request.odds.keys()), request.engine, db)
+    
+    optimizer = TicketOptimizer(
+        kelly_fraction=request.kelly_fraction,
+        min_expected_value=request.min_expected_value,
+        max_tickets_per_race=request.max_tickets,
+    )
+    return optimizer.optimize(
+        race_ids,
+        win_probs,
+        [request.odds[race_id] for race_id in race_ids],
+        request.bet_type,
+        request.budget,
+    )
+
+
+@router.post("/portfolio", response_model=schemas.PortfolioAllocation)
+def allocate_portfolio(
+    request: schemas.PortfolioRequest,
+    db: Session = Depends(get_db)
+):
+    """1日の予算を全レースに配分（期待対数成長率の最大化）"""
+    if request.bet_type not in TICKET_COMBINATIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported bet type: {request.bet_type}")
+    
+    race_ids, win_probs = _day_win_probabilities(list(request.odds.keys()), request.engine, db)
+    probs = ticket_probabilities(win_probs, request.bet_type)
+    odds = np.vstack([odds_to_array(request.bet_type, request.odds[race_id]) for race_id in race_ids])
+    
+    try:
+        allocator = PortfolioAllocator(
+            per_race_limit=request.per_race_limit,
+            total_limit=request.total_limit,
+        )
+        result = allocator.allocate(race_ids, request.bet_type, probs, odds, request.budget)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    saved = 0
+    if request.save:
+        for recommendation in result["recommendations"]:
+            for ticket in recommendation.tickets:
+                db.add(db_models.Prediction(
+                    race_id=recommendation.race_id,
+                    prediction_type="portfolio",
+                    bet_type=ticket.bet_type,
+                    bet_numbers=ticket.numbers,
+                    bet_amount=ticket.amount,
+                    memo=f"EV {ticket.expected_value:+.3f} / p {ticket.probability:.4f} / odds {ticket.odds}",
+                ))
+                saved += 1
+        db.commit()
+    
+    return schemas.PortfolioAllocation(**result, saved_predictions=saved)
+
+
+@router.post("/tickets/{race_id}", response_model=schemas.TicketRecommendation)
+def optimize_tickets(
+    race_id: int,
+    request: schemas.TicketOptimizationRequest,
+    db: Session = Depends(get_db)
+):
+    """オッズと予想確率から期待値・ケリー基準で買い目を選択"""
+    if request.bet_type not in TICKET_COMBINATIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported bet type: {request.bet_type}")
+    
+    entries = db.query(db_models.RaceEntry).filter(
+        db_models.RaceEntry.race_id == race_id
+    ).all()
+    
+    if not entries:
+        raise HTTPException(status_code=404, detail="No entries found for this race")
+    
+    optimizer = TicketOptimizer(
+        kelly_fraction=request.kelly_fraction,
+        min_expected_value=request.min_expected_value,
+        max_tickets_per_race=request.max_tickets,
+    )
+    win_probs = _win_probabilities(entries, request.engine, db)[None, :]
+    return optimizer.optimize(
+        [race_id], win_probs, [request.odds], request.bet_type, request.budget
+    )[0]
+
+
+@router.post("/simulation/{race_id}", response_model=schemas.SimulationPrediction)
+def get_simulation_prediction(
+    race_id: int,
+    n_simulations: int = 100_000,
+    db: Session = Depends(get_db)
+):
+    """モンテカルロ・シミュレーションによる着順分布を取得"""
+    race = db.query(db_models.Race).filter(db_models.Race.id == race_id).first()
+    if race is None:
+        raise HTTPException(status_code=404, detail="Race not found")
+    
+    entries = db.query(db_models.RaceEntry).filter(
+        db_models.RaceEntry.race_id == race_id
+    ).all()
+    
+    if not entries:
+        raise HTTPException(status_code=404, detail="No entries found for this race")
+    
+    if not 0 < n_simulations <= 1_000_000:
+        raise HTTPException(status_code=400, detail="n_simulations must be between 1 and 1000000")
+    
+    return race_simulator.predict(db, entries, n_simulations)
+
+
 @router.put("/{prediction_id}", response_model=schemas.Prediction)
 def update_prediction(
     prediction_id: int,
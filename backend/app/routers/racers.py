@@ -4,6 +4,8 @@ from typing import List, Optional
 
 from app.database import get_db
 from app.models import schemas, db_models
+from app.prediction.start_timing import start_timing_model
+from ml.matchup import matchup_matrix
 
 router = APIRouter()
 
@@ -45,6 +47,26 @@ def get_racer_by_registration(registration_no: str, db: Session = Depends(get_db
     return racer
 
 
+@router.get("/registration/{registration_no}/start-timing", response_model=schemas.RacerStartTiming)
+def get_racer_start_timing(registration_no: str, db: Session = Depends(get_db)):
+    """選手の過去STの分布（全コース・進入コース別）"""
+    start_timing_model.ensure_fitted(db)
+    distributions = start_timing_model.racer_summary(registration_no)
+    if distributions is None:
+        raise HTTPException(status_code=404, detail="No start timing history found")
+    return schemas.RacerStartTiming(registration_no=registration_no, distributions=distributions)
+
+
+@router.get("/registration/{registration_no}/matchups/{opponent_no}", response_model=schemas.Matchup)
+def get_racer_matchup(registration_no: str, opponent_no: str, db: Session = Depends(get_db)):
+    """2選手の過去の対戦成績（registration_no から見た先着数・先着率）"""
+    matchup_matrix.ensure_loaded(db)
+    matchup = matchup_matrix.pair(registration_no, opponent_no)
+    if matchup["meetings"] == 0:
+        raise HTTPException(status_code=404, detail="No matchup history found")
+    return matchup
+
+
 @router.post("/", response_model=schemas.Racer)
 def create_racer(racer: schemas.RacerCreate, db: Session = Depends(get_db)):
     """選手を作成"""
@@ -5,6 +5,9 @@ from datetime import date
 
 from app.database import get_db
 from app.models import schemas, db_models
+from app import events
+from ml.matchup import matchup_matrix
+from ml.similar_races import similar_race_index
 
 router = APIRouter()
 
@@ -38,6 +41,62 @@ def get_race(race_id: int, db: Session = Depends(get_db)):
     return race
 
 
+@router.get("/{race_id}/matchups", response_model=schemas.RaceMatchups)
+def get_race_matchups(race_id: int, db: Session = Depends(get_db)):
+    """出走選手同士の過去の対戦成績（先着数・同走数）"""
+    entries = db.query(db_models.RaceEntry).filter(
+        db_models.RaceEntry.race_id == race_id
+    ).order_by(db_models.RaceEntry.boat_no).all()
+    if not entries:
+        raise HTTPException(status_code=404, detail="Race entries not found")
+    
+    matchup_matrix.ensure_loaded(db)
+    features = matchup_matrix.race_card(entries)
+    boats = []
+    for entry in entries:
+        i = entry.boat_no - 1
+        opponents = []
+        for other in entries:
+            j = other.boat_no - 1
+            if j == i:
+                continue
+            opponents.append(schemas.Matchup(
+                registration_no=entry.racer_registration_no or "",
+                opponent_no=other.racer_registration_no or "",
+                meetings=int(features["meetings"][i, j]),
+                ahead=int(features["ahead"][i, j]),
+                behind=int(features["ahead"][j, i]),
+                ahead_rate=float(features["ahead_rate"][i, j]),
+            ))
+        boats.append(schemas.BoatMatchups(
+            boat_no=entry.boat_no,
+            registration_no=entry.racer_registration_no,
+            field_score=float(features["field_score"][i]),
+            opponents=opponents,
+        ))
+    return schemas.RaceMatchups(race_id=race_id, boats=boats)
+
+
+@router.get("/{race_id}/similar", response_model=schemas.SimilarRaces)
+def get_similar_races(race_id: int, k: int = 10, db: Session = Depends(get_db)):
+    """出走表・会場・水面条件が似ている過去のレースと、その結果"""
+    if not 1 <= k <= 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+    matches = similar_race_index.similar(db, race_id, k)
+    if matches is None:
+        raise HTTPException(status_code=404, detail="Race entries not found")
+    
+    race_ids = [match_id for match_id, _ in matches]
+    races = {race.id: race for race in db.query(db_models.Race).filter(db_models.Race.id.in_(race_ids))}
+    return schemas.SimilarRaces(
+        race_id=race_id,
+        matches=[
+            schemas.SimilarRace(race=races[match_id], distance=distance, result=races[match_id].result)
+            for match_id, distance in matches if match_id in races
+        ],
+    )
+
+
 @router.post("/", response_model=schemas.Race)
 def create_race(race: schemas.RaceCreate, db: Session = Depends(get_db)):
     """レースを作成"""
@@ -61,6 +120,7 @@ def update_race(race_id: int, race: schemas.RaceUpdate, db: Session = Depends(ge
     
     db.commit()
     db.refresh(db_race)
+    events.race_saved(db, race_id)
     return db_race
 
 
@@ -5,6 +5,7 @@ from datetime import date
 
 from app.database import get_db
 from app.models import schemas, db_models
+from app import events
 
 router = APIRouter()
 
@@ -51,6 +52,8 @@ def create_result(result: schemas.RaceResultCreate, db: Session = Depends(get_db
     db.add(db_result)
     db.commit()
     db.refresh(db_result)
+    # 結果から集計している特徴量・モデルを更新
+    events.result_saved(db, db_result.race_id)
     return db_result
 
 
@@ -7,6 +7,7 @@ from typing import Optional, List, Dict
 from sqlalchemy.orm import Session
 
 from app.models import db_models
+from app import events
 
 
 class BoatRaceScraper:
@@ -61,6 +62,9 @@ class BoatRaceScraper:
         for entry_data in entries_data:
             self._save_entry(entry_data, db)
         
+        # 出走表が変わった可能性があるので計算済みの予想を捨てる
+        events.race_saved(db, db_race.id)
+        
         return {
             "race": race_data,
             "entries": entries_data
@@ -379,9 +383,12 @@ class BoatRaceScraper:
             for key, value in result_data.items():
                 setattr(existing, key, value)
             db.commit()
-            return existing
+            db_result = existing
+        else:
+            db_result = db_models.RaceResult(**result_data)
+            db.add(db_result)
+            db.commit()
         
-        db_result = db_models.RaceResult(**result_data)
-        db.add(db_result)
-        db.commit()
+        # 結果から集計している特徴量・モデルを更新
+        events.result_saved(db, result_data["race_id"])
         return db_result
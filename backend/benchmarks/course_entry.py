@@ -0,0 +1,86 @@
+"""進入予測のベンチマーク
+
+使い方:
+    cd backend
+    python -m benchmarks.course_entry --repeat 200
+
+DBの結果で進入予測モデルを学習し、1レース / 1日分（72レース）の進入予測の
+所要時間と、統計・ML予想で進入予測を使う場合と使わない（艇番どおり）場合の
+1回あたりの所要時間を比較する。
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal
+from app.models import db_models
+from app.models.schemas import PredictionWeights
+from app.prediction.course_entry import CourseEntryModel
+from app.prediction.ml_model import MLPredictor
+from app.prediction.statistical import StatisticalPredictor
+from benchmarks.common import load_bundle, synthetic_races
+
+
+def timed(func, repeat: int) -> float:
+    """1回あたりの所要時間[ms]"""
+    func()  # ウォームアップ
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark course-entry prediction")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--races", type=int, default=72, help="races per day batch")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    model = CourseEntryModel()
+    try:
+        started = time.perf_counter()
+        starts = model.fit(db)
+        fit_seconds = time.perf_counter() - started
+        known = [row[0] for row in db.query(db_models.RaceEntry.racer_registration_no).filter(
+            db_models.RaceEntry.racer_registration_no.isnot(None)
+        ).distinct()]
+    finally:
+        db.close()
+    print(f"Fitted on {starts} starts in {fit_seconds:.2f}s")
+
+    # DBにいる選手で出走表を作る（いなければ合成の登録番号のまま）
+    races = synthetic_races(args.races)
+    if known:
+        rng = np.random.default_rng(0)
+        for entries in races:
+            for entry, reg in zip(entries, rng.choice(known, len(entries))):
+                entry.racer_registration_no = str(reg)
+
+    print(f"\n{'step':<28}{'1 race[ms]':>12}{f'{args.races} races[ms]':>16}")
+    print(f"{'course prediction':<28}"
+          f"{timed(lambda: model.predict_entries(races[:1]), args.repeat):>12.3f}"
+          f"{timed(lambda: model.predict_entries(races), args.repeat):>16.3f}")
+
+    weights = PredictionWeights()
+    bundle, label = load_bundle()
+    unfitted = CourseEntryModel()
+    for name, course_model in (("identity", unfitted), ("predicted", model)):
+        statistical = StatisticalPredictor(course_model=course_model)
+        ml = MLPredictor(bundle=bundle, course_model=course_model, context_loader=None)
+        print(f"{f'statistical ({name})':<28}"
+              f"{timed(lambda: statistical.predict(races[0], weights), args.repeat):>12.3f}"
+              f"{timed(lambda: [statistical.predict(e, weights) for e in races], args.repeat // 10 or 1):>16.3f}")
+        print(f"{f'ML ({name})':<28}"
+              f"{timed(lambda: ml.predict_batch(races[:1]), args.repeat):>12.3f}"
+              f"{timed(lambda: ml.predict_batch(races), args.repeat):>16.3f}")
+    print(f"\nML model: {label}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""特徴量寄与（TreeSHAP）のベンチマーク
+
+使い方:
+    cd backend
+    python -m benchmarks.explanations --races 144
+
+1日分のレースについて、出走表1枚あたりの寄与の計算時間を
+1レースずつ計算する場合・まとめて1回で計算する場合・キャッシュから返す場合で比較する。
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.prediction.ml_model import MLPredictor
+from benchmarks.common import load_bundle, synthetic_races
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched TreeSHAP explanations")
+    parser.add_argument("--races", type=int, default=144, help="race cards in one day")
+    parser.add_argument("--mode", choices=["binary", "ranking"], default="binary")
+    args = parser.parse_args()
+
+    bundle, label = load_bundle(args.mode)
+    predictor = MLPredictor(bundle=bundle, context_loader=None)  # 合成レースは DB にないので特徴量ストアを引かない
+    print(f"Using {label}")
+    races = synthetic_races(args.races)
+
+    def timed(func):
+        predictor.explanation_cache.clear()
+        started = time.perf_counter()
+        func()
+        return (time.perf_counter() - started) / len(races) * 1000
+
+    predict_ms = timed(lambda: predictor.predict_batch(races))
+    single_ms = timed(lambda: [predictor.explain(race) for race in races])
+    batch_ms = timed(lambda: predictor.explain_batch(races))
+
+    predictor.explain_batch(races)
+    started = time.perf_counter()
+    predictor.explain_batch(races)
+    cached_ms = (time.perf_counter() - started) / len(races) * 1000
+
+    print(f"\n{'':<28}{'ms/race card':>14}")
+    print(f"{'prediction only (batch)':<28}{predict_ms:>14.3f}")
+    print(f"{'explain per race':<28}{single_ms:>14.3f}")
+    print(f"{'explain batch':<28}{batch_ms:>14.3f}")
+    print(f"{'explain cached':<28}{cached_ms:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""推論キュー（マイクロバッチ）のベンチマーク
+
+使い方:
+    cd backend
+    python -m benchmarks.inference_batching --requests 2000
+
+同時実行数ごとに、リクエストごとに MLPredictor.predict を呼ぶ場合と
+InferenceBatcher でまとめる場合のスループット・レイテンシを比較する。
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.prediction.batching import InferenceBatcher
+from app.prediction.ml_model import MLPredictor
+from benchmarks.common import load_bundle, synthetic_races
+
+
+CONCURRENCY = (1, 4, 16, 64)
+
+
+def run(func, races, concurrency: int, n_requests: int):
+    """n_requests 件を concurrency スレッドで実行し、(スループット, 各レイテンシ[ms]) を返す"""
+    def call(i):
+        started = time.perf_counter()
+        func(races[i % len(races)])
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = np.array(list(pool.map(call, range(n_requests)))) * 1000
+    return n_requests / (time.perf_counter() - started), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched ML inference")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    bundle, label = load_bundle()
+    predictor = MLPredictor(bundle=bundle, context_loader=None)  # 合成レースは DB にないので特徴量ストアを引かない
+    print(f"Using {label}")
+
+    batch_sizes = []
+
+    def counted_batch(items):
+        batch_sizes.append(len(items))
+        return predictor.predict_batch(items)
+
+    batcher = InferenceBatcher(counted_batch, args.max_batch_size, args.max_wait_ms)
+    races = synthetic_races(500)
+
+    print(f"\n{'mode':<10}{'threads':>8}{'req/s':>10}{'p50[ms]':>10}{'p99[ms]':>10}{'batch':>8}")
+    for concurrency in CONCURRENCY:
+        for mode, func in (("direct", predictor.predict), ("batched", batcher.predict)):
+            batch_sizes.clear()
+            throughput, latencies = run(func, races, concurrency, args.requests)
+            mean_batch = f"{np.mean(batch_sizes):.1f}" if batch_sizes else "1.0"
+            print(f"{mode:<10}{concurrency:>8}{throughput:>10.0f}"
+                  f"{np.median(latencies):>10.2f}{np.percentile(latencies, 99):>10.2f}{mean_batch:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""ML推論の実行モード（スレッド / プロセスプール）による他の処理への影響のベンチマーク
+
+使い方:
+    cd backend
+    python -m benchmarks.process_inference --ml-threads 8 --duration 5
+
+ML推論（1日分=72レースのバッチ）を複数スレッドで流し続けながら、軽い処理
+（ヘルスチェック程度のPython処理）のレイテンシを計測し、p50/p99 を比較する。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.prediction.ml_model import MLPredictor
+from app.prediction.process_pool import ProcessInferenceEngine
+from benchmarks.common import load_bundle, synthetic_races
+
+
+def light_request():
+    """軽いエンドポイント相当の処理"""
+    return json.dumps({"status": "healthy", "items": list(range(20))})
+
+
+def measure(predictor: MLPredictor, races, ml_threads: int, duration: float, interval: float = 0.002):
+    """ML負荷をかけながら軽い処理のレイテンシ[ms]とML推論の処理件数を計測"""
+    stop = threading.Event()
+    ml_calls = [0] * ml_threads
+
+    def ml_load(i):
+        while not stop.is_set():
+            predictor.predict_batch(races)
+            ml_calls[i] += 1
+
+    workers = [threading.Thread(target=ml_load, args=(i,)) for i in range(ml_threads)]
+    for w in workers:
+        w.start()
+
+    # 到着予定時刻から処理完了までを計測する（GILの取得待ちも含む）
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        arrival = time.perf_counter() + interval
+        time.sleep(interval)
+        light_request()
+        latencies.append(time.perf_counter() - arrival)
+
+    stop.set()
+    for w in workers:
+        w.join()
+    return np.array(latencies) * 1000, sum(ml_calls) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Light-endpoint latency under concurrent ML load")
+    parser.add_argument("--ml-threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2, help="process pool size")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--races", type=int, default=72, help="races per ML batch")
+    args = parser.parse_args()
+
+    bundle, label = load_bundle()
+    print(f"Using {label}; {args.ml_threads} threads running {args.races}-race ML batches")
+    races = synthetic_races(args.races)
+
+    predictor = MLPredictor(bundle=bundle, context_loader=None)  # 合成レースは DB にないので特徴量ストアを引かない
+    print(f"\n{'mode':<10}{'light p50[ms]':>15}{'light p99[ms]':>15}{'ML batches/s':>14}")
+
+    baseline, _ = measure(predictor, races, 0, args.duration)
+    print(f"{'idle':<10}{np.median(baseline):>15.3f}{np.percentile(baseline, 99):>15.3f}{'-':>14}")
+
+    latencies, rate = measure(predictor, races, args.ml_threads, args.duration)
+    print(f"{'thread':<10}{np.median(latencies):>15.3f}{np.percentile(latencies, 99):>15.3f}{rate:>14.1f}")
+
+    engine = ProcessInferenceEngine(args.workers, bundle=bundle)
+    engine.start()
+    expected = predictor.predict_batch(races)
+    predictor.executor = engine
+    try:
+        actual = predictor.predict_batch(races)
+        max_diff = max(
+            abs(a.prob_1st - e.prob_1st)
+            for race_a, race_e in zip(actual, expected)
+            for a, e in zip(race_a.probabilities, race_e.probabilities)
+        )
+        print(f"{'(check)':<10}max |process - thread| prob_1st: {max_diff:.2e}")
+        latencies, rate = measure(predictor, races, args.ml_threads, args.duration)
+        print(f"{'process':<10}{np.median(latencies):>15.3f}{np.percentile(latencies, 99):>15.3f}{rate:>14.1f}")
+    finally:
+        predictor.executor = None
+        engine.stop()
+
+
+if __name__ == "__main__":
+    main()
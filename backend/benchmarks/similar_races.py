@@ -0,0 +1,81 @@
+"""類似レース検索のベンチマーク
+
+使い方:
+    cd backend
+    python -m benchmarks.similar_races --races 1000000
+
+合成したレースのベクトルで SimilarRaceIndex を作り、追加分を含めた1件ずつの
+検索時間を総当たりの場合と比べる。調べるリスト数ごとに、総当たりの上位 k 件の
+うち見つかった割合（再現率）も表示する。
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.similar_races import SimilarRaceIndex, BOAT_FEATURES, CONDITION_FEATURES, VENUE_COUNT
+from app.prediction.betting import BOAT_COUNT
+
+
+def synthetic_raw(n_races: int, seed: int = 0):
+    """標準化前の特徴量と会場（艇の特徴はレース内で相関させる）"""
+    rng = np.random.default_rng(seed)
+    n_boat = BOAT_COUNT * len(BOAT_FEATURES)
+    level = rng.normal(size=(n_races, 1))
+    raw = np.hstack([
+        level + rng.normal(scale=0.7, size=(n_races, n_boat)),
+        rng.normal(size=(n_races, len(CONDITION_FEATURES))),
+    ])
+    return raw, rng.integers(1, VENUE_COUNT + 1, n_races)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark similar-race retrieval")
+    parser.add_argument("--races", type=int, default=1_000_000)
+    parser.add_argument("--extra", type=int, default=10_000, help="rows in the incremental buffer")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16, 32])
+    args = parser.parse_args()
+
+    raw, venue = synthetic_raw(args.races + args.extra)
+    index = SimilarRaceIndex(path=os.devnull)
+    vectors = index.vectors(raw, venue)
+    race_ids = np.arange(1, len(vectors) + 1)
+
+    started = time.perf_counter()
+    base = vectors[:args.races]
+    index._set_lists(base, race_ids[:args.races], index._fit_centroids(base))
+    print(f"Indexed {args.races} races ({vectors.shape[1]} dims, {len(index._centroids)} lists) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    queries_raw, queries_venue = synthetic_raw(args.queries, seed=1)
+    queries = index.vectors(queries_raw, queries_venue)
+
+    def timed(func):
+        started = time.perf_counter()
+        results = [func(q) for q in queries]
+        return (time.perf_counter() - started) / len(queries) * 1000, results
+
+    def brute(q):
+        dist = np.sqrt(((vectors - q) ** 2).sum(axis=1))
+        return race_ids[np.argsort(dist)[:args.k]].tolist()
+
+    brute_ms, expected = timed(brute)
+    print(f"\n{'search':<26}{'ms/query':>10}{f'recall@{args.k}':>12}")
+    print(f"{'brute force':<26}{brute_ms:>10.2f}{1:>12.0%}")
+
+    index._extra_vectors, index._extra_ids = vectors[args.races:], race_ids[args.races:]
+    for n_probe in args.probes:
+        index.n_probe = n_probe
+        ms, found = timed(lambda q: [race_id for race_id, _ in index.query(q[None], args.k)[0]])
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(found, expected)])
+        print(f"{f'{n_probe} lists + {args.extra} extra':<26}{ms:>10.2f}{recall:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
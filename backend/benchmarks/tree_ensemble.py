@@ -0,0 +1,120 @@
+"""決定木アンサンブルの推論ベンチマーク（LightGBM の predict_proba と配列化した木の比較）
+
+使い方:
+    cd backend
+    python -m benchmarks.tree_ensemble --repeats 200
+
+レジストリの現行モデルがあればそれを、なければ合成データで学習したモデルを使う。
+計測の前に、欠損値・0を含む入力で両者の予測値が一致することを確認する。
+"""
+import os
+import sys
+import time
+import argparse
+from typing import Dict
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.prediction.tree_ensemble import CompiledTreeEnsemble
+from ml.features import FEATURE_NAMES
+from ml.registry import ModelRegistry
+
+
+BATCH_SIZES = (6, 72, 3000)  # 1レース, 1日分（12R×6場）, 大量バッチ
+
+
+def load_models() -> Dict:
+    """レジストリの現行モデル（なければ合成データで学習したモデル）"""
+    registry = ModelRegistry()
+    version = registry.current_version()
+    if version is not None:
+        bundle = registry.load(version)
+        keys = ("model",) if bundle.get("model_type") == "ranking" else ("model_1st", "model_2nd", "model_3rd")
+        print(f"Using registry model {version} ({bundle.get('model_type', 'binary')})")
+        return {key: bundle[key] for key in keys}
+
+    from lightgbm import LGBMClassifier, LGBMRanker
+
+    print("No registered model; training synthetic models")
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(6 * 3_000, len(FEATURE_NAMES)))
+    X[rng.random(X.shape) < 0.02] = np.nan
+    X[rng.random(X.shape) < 0.02] = 0.0
+    signal = np.nan_to_num(X[:, 0] + 0.5 * X[:, 1] - 0.3 * X[:, 2]) + rng.normal(size=len(X))
+    params = {"n_estimators": 100, "num_leaves": 31, "max_depth": 6, "verbose": -1}
+    return {
+        "binary": LGBMClassifier(**params).fit(X, (signal > 1).astype(int)),
+        "ranking": LGBMRanker(**params).fit(
+            X, np.clip(signal + 2, 0, 5).astype(int), group=[6] * (len(X) // 6)
+        ),
+    }
+
+
+def sample_rows(compiled: CompiledTreeEnsemble, n_rows: int, rng) -> np.ndarray:
+    """分岐の閾値の範囲から入力を作る（両方の枝を通り、欠損値・0も含む）"""
+    X = rng.normal(size=(n_rows, compiled.n_features))
+    for f in range(compiled.n_features):
+        split = (compiled.feature == f) & (compiled.left != np.arange(len(compiled.left)))
+        thresholds = compiled.threshold[split]
+        thresholds = thresholds[np.abs(thresholds) < 1e30]
+        if len(thresholds):
+            low, high = thresholds.min(), thresholds.max()
+            margin = max(high - low, 1.0) * 0.1
+            X[:, f] = rng.uniform(low - margin, high + margin, n_rows)
+    X[rng.random(X.shape) < 0.02] = np.nan
+    X[rng.random(X.shape) < 0.02] = 0.0
+    return X
+
+
+def lightgbm_predict(model, X: np.ndarray) -> np.ndarray:
+    return model.predict_proba(X)[:, 1] if hasattr(model, "predict_proba") else model.predict(X)
+
+
+def check_equivalence(model, compiled: CompiledTreeEnsemble, X: np.ndarray) -> float:
+    """予測値が一致することを確認し、最大誤差を返す"""
+    expected = lightgbm_predict(model, X)
+    actual = compiled.predict(X)
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12)
+    return float(np.max(np.abs(actual - expected)))
+
+
+def time_calls(func, X: np.ndarray, repeats: int) -> np.ndarray:
+    func(X)  # ウォームアップ
+    elapsed = np.empty(repeats)
+    for i in range(repeats):
+        started = time.perf_counter()
+        func(X)
+        elapsed[i] = time.perf_counter() - started
+    return elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compiled tree ensembles against LightGBM")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    models = load_models()
+
+    print(f"\n{'model':<12}{'trees':>6}{'depth':>6}{'rows':>6}"
+          f"{'lgbm p50':>10}{'lgbm p99':>10}{'numpy p50':>11}{'numpy p99':>11}{'speedup':>9}")
+    for name, model in models.items():
+        compiled = CompiledTreeEnsemble.from_lightgbm(model)
+        max_error = check_equivalence(model, compiled, sample_rows(compiled, 10_000, rng))
+
+        for rows in BATCH_SIZES:
+            X = sample_rows(compiled, rows, rng)
+            lgbm = time_calls(lambda x: lightgbm_predict(model, x), X, args.repeats)
+            numpy_ = time_calls(compiled.predict, X, args.repeats)
+            print(f"{name:<12}{compiled.n_trees:>6}{compiled.depth:>6}{rows:>6}"
+                  f"{np.median(lgbm):>10.3f}{np.percentile(lgbm, 99):>10.3f}"
+                  f"{np.median(numpy_):>11.3f}{np.percentile(numpy_, 99):>11.3f}"
+                  f"{np.median(lgbm) / np.median(numpy_):>8.1f}x")
+        print(f"{'':<12}equivalent (max abs error {max_error:.2e})")
+    print("\n(times in ms per call)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""予想戦略のウォークフォワード・バックテスト"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# パスを追加
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import db_models, schemas
+from app.prediction.course_entry import CourseEntryModel
+from app.prediction.statistical import StatisticalPredictor
+from app.prediction.betting import (
+    BET_UNIT, BOAT_COUNT, TICKET_LABELS, ticket_label, ticket_probabilities
+)
+from ml.snapshot import DatasetSnapshotStore
+
+
+# 賭け式 → (的中に必要な着順数, 払戻金カラム)
+SETTLEMENT = {
+    "単勝": (1, "win_payout"),
+    "2連単": (2, "exacta_payout"),
+    "2連複": (2, "quinella_payout"),
+    "3連単": (3, "trifecta_payout"),
+    "3連複": (3, "trio_payout"),
+}
+
+
+class BacktestStrategy:
+    """バックテスト対象の戦略（予想エンジン + 買い目ルール）"""
+
+    def __init__(
+        self,
+        engine: str = "statistical",
+        bet_type: str = "3連単",
+        tickets_per_race: int = 1,
+        min_probability: float = 0.0,
+        stake: int = BET_UNIT,
+        weights: Optional[schemas.PredictionWeights] = None,
+    ):
+        if engine not in ("statistical", "ml"):
+            raise ValueError(f"Unsupported engine: {engine}")
+        if bet_type not in SETTLEMENT:
+            raise ValueError(f"Unsupported bet type: {bet_type}")
+        self.engine = engine
+        self.bet_type = bet_type
+        self.tickets_per_race = tickets_per_race
+        self.min_probability = min_probability
+        self.stake = stake
+        self.weights = weights or schemas.PredictionWeights()
+
+    def select_tickets(self, win_probs: np.ndarray) -> np.ndarray:
+        """
+        的中確率の高い順に買い目を選択
+
+        Returns:
+            購入フラグ (races, 買い目数)
+        """
+        probs = ticket_probabilities(win_probs, self.bet_type)
+        order = np.argsort(-probs, axis=1)[:, :self.tickets_per_race]
+        selected = np.zeros(probs.shape, dtype=bool)
+        np.put_along_axis(selected, order, True, axis=1)
+        return selected & (probs >= self.min_probability)
+
+
+def _month_chunks(start: date, end: date) -> List[Tuple[date, date]]:
+    """期間を月単位のチャンク [start, end) に分割"""
+    chunks = []
+    current = start
+    while current <= end:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunk_end = min(next_month, end + timedelta(days=1))
+        chunks.append((current, chunk_end))
+        current = chunk_end
+    return chunks
+
+
+def _load_chunk(db: Session, start: date, end: date):
+    """チャンク内の結果確定レースと出走表を取得"""
+    rows = db.query(db_models.Race, db_models.RaceResult).join(
+        db_models.RaceResult
+    ).filter(
+        db_models.Race.race_date >= start,
+        db_models.Race.race_date < end,
+    ).order_by(
+        db_models.Race.race_date, db_models.Race.race_no, db_models.Race.venue_code
+    ).all()
+
+    entries = db.query(db_models.RaceEntry).join(
+        db_models.Race
+    ).filter(
+        db_models.Race.race_date >= start,
+        db_models.Race.race_date < end,
+    ).all()
+
+    entries_by_race = {}
+    for entry in entries:
+        entries_by_race.setdefault(entry.race_id, []).append(entry)
+
+    return [(race, result, entries_by_race[race.id]) for race, result in rows if race.id in entries_by_race]
+
+
+def _fit_ml_model(db: Session, cutoff: date, n_jobs: int = -1):
+    """カットオフ日より前のデータだけで1着モデルを学習（n_jobs は LightGBM のスレッド数）"""
+    from lightgbm import LGBMClassifier
+
+    data = DatasetSnapshotStore().load(db, before=cutoff, refresh=False)
+    X, y_1st = data["X"], (data["position"] == 1).astype(int)
+    if len(X) == 0 or y_1st.sum() == 0:
+        return None
+
+    model = LGBMClassifier(n_estimators=100, max_depth=6, learning_rate=0.1, num_leaves=31,
+                           random_state=42, n_jobs=n_jobs, verbose=-1)
+    model.fit(X, y_1st)
+    return model
+
+
+def _ml_win_probabilities(db: Session, model, race_ids: List[int], start: date,
+                          end: date) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    学習済み1着モデルで艇番順の1着確率 (races, 6) を一括計算
+
+    特徴量は学習と同じスナップショットの行（進入予測などは各レースの前日までの情報）を使う。
+
+    Returns:
+        1着確率 (races, 6) と、スナップショットに行があったレースのフラグ (races,)
+    """
+    probs = np.zeros((len(race_ids), BOAT_COUNT))
+    covered = np.zeros(len(race_ids), dtype=bool)
+    if model is None:
+        return probs, covered
+    data = DatasetSnapshotStore().load(db, before=end, since=start, refresh=False)
+    position = {race_id: r for r, race_id in enumerate(race_ids)}
+    race_index = np.array([position.get(int(race_id), -1) for race_id in data["race_id"]], dtype=int)
+    rows = race_index >= 0
+    if rows.any():
+        boat_idx = np.asarray(data["boat_no"][rows], dtype=int) - 1
+        probs[race_index[rows], boat_idx] = model.predict_proba(np.asarray(data["X"][rows]))[:, 1]
+        covered[race_index[rows]] = True
+    return probs, covered
+
+
+def _winning_index(bet_type: str, result) -> Optional[int]:
+    """結果から的中買い目のインデックスを取得"""
+    places_needed, _ = SETTLEMENT[bet_type]
+    places = tuple(getattr(result, f"place_{i}") for i in range(1, places_needed + 1))
+    if not all(places):
+        return None
+    if bet_type in ("2連複", "3連複"):
+        places = tuple(sorted(places))
+    return _LABEL_INDEX[bet_type].get(ticket_label(bet_type, places))
+
+
+_LABEL_INDEX = {
+    bet_type: {label: i for i, label in enumerate(labels)}
+    for bet_type, labels in TICKET_LABELS.items()
+}
+
+
+def run_chunk(strategy: BacktestStrategy, start: date, end: date, n_jobs: int = -1) -> Dict[str, np.ndarray]:
+    """
+    1チャンク分のレースを再生して精算
+
+    MLエンジンはチャンク開始日より前のデータのみで学習するため、
+    各レースには当時利用可能だった情報しか使われない。n_jobs はその学習のスレッド数。
+    """
+    db = SessionLocal()
+    try:
+        races = _load_chunk(db, start, end)
+        if not races:
+            return {}
+
+        covered = np.ones(len(races), dtype=bool)
+        if strategy.engine == "ml":
+            model = _fit_ml_model(db, start, n_jobs)
+            win_probs, covered = _ml_win_probabilities(db, model, [race.id for race, _, _ in races], start, end)
+        else:
+            # 進入予測もチャンク開始日より前の結果だけで学習する
+            course_model = CourseEntryModel()
+            course_model.fit(db, before=start)
+            predictor = StatisticalPredictor(course_model)
+            win_probs = np.vstack([
+                predictor.win_probabilities(entries, strategy.weights) for _, _, entries in races
+            ])
+
+        # 特徴量を作れなかったレース（6艇揃っていないなど）は買わない
+        selected = strategy.select_tickets(win_probs) & covered[:, None]
+        _, payout_column = SETTLEMENT[strategy.bet_type]
+
+        winning = np.array([_winning_index(strategy.bet_type, result) for _, result, _ in races],
+                           dtype=float)
+        winning = np.nan_to_num(winning, nan=-1).astype(int)
+        payouts = np.array([getattr(result, payout_column) or 0 for _, result, _ in races], dtype=float)
+
+        row_idx = np.arange(len(races))
+        hit = (winning >= 0) & selected[row_idx, np.maximum(winning, 0)]
+        bet = selected.sum(axis=1) * strategy.stake
+        # 払戻金は100円あたりの金額
+        returned = np.where(hit, payouts * strategy.stake / BET_UNIT, 0.0)
+
+        return {
+            "race_date": np.array([race.race_date.toordinal() for race, _, _ in races]),
+            "race_no": np.array([race.race_no for race, _, _ in races]),
+            "venue_code": np.array([race.venue_code for race, _, _ in races]),
+            "bet": bet,
+            "returned": returned,
+            "hit": hit,
+            "missing_payout": hit & (payouts == 0),
+        }
+    finally:
+        db.close()
+
+
+def _run_chunk_args(args):
+    """ProcessPoolExecutor用のラッパー"""
+    return run_chunk(*args)
+
+
+def summarize(records: Dict[str, np.ndarray]) -> Dict:
+    """精算結果から的中率・回収率・ドローダウン・会場別成績を集計"""
+    if not records or len(records["bet"]) == 0:
+        return {"races": 0}
+
+    bet = records["bet"]
+    returned = records["returned"]
+    hit = records["hit"]
+    played = bet > 0
+
+    profit = np.cumsum(returned - bet)
+    drawdown = np.maximum.accumulate(np.maximum(profit, 0)) - profit
+
+    total_bet = float(bet.sum())
+    total_return = float(returned.sum())
+
+    by_venue = {}
+    venues, inverse = np.unique(records["venue_code"], return_inverse=True)
+    venue_bet = np.bincount(inverse, weights=bet)
+    venue_return = np.bincount(inverse, weights=returned)
+    venue_races = np.bincount(inverse, weights=played)
+    venue_hits = np.bincount(inverse, weights=hit)
+    for i, venue in enumerate(venues):
+        by_venue[str(venue)] = {
+            "races": int(venue_races[i]),
+            "hits": int(venue_hits[i]),
+            "hit_rate": venue_hits[i] / venue_races[i] if venue_races[i] > 0 else 0,
+            "total_bet": int(venue_bet[i]),
+            "total_return": int(venue_return[i]),
+            "roi": (venue_return[i] / venue_bet[i] - 1) * 100 if venue_bet[i] > 0 else 0,
+        }
+
+    return {
+        "races": int(played.sum()),
+        "hits": int(hit.sum()),
+        "hit_rate": float(hit.sum() / played.sum()) if played.any() else 0,
+        "total_bet": int(total_bet),
+        "total_return": int(total_return),
+        "profit": int(total_return - total_bet),
+        "roi": (total_return / total_bet - 1) * 100 if total_bet > 0 else 0,
+        "max_drawdown": int(drawdown.max()),
+        "missing_payouts": int(records["missing_payout"].sum()),
+        "by_venue": by_venue,
+    }
+
+
+class Backtester:
+    """
+    時系列チャンクを複数プロセスで並列に再生するバックテスター
+
+    ワーカー数 × LightGBM のスレッド数が CPUコア数を超えないよう、
+    各チャンクの学習のスレッド数は コア数 // ワーカー数 に揃える。
+    """
+
+    def __init__(self, strategy: BacktestStrategy, workers: Optional[int] = None):
+        self.strategy = strategy
+        self.workers = workers or os.cpu_count() or 1
+
+    def _thread_plan(self, n_tasks: int) -> Tuple[int, int]:
+        """(ワーカー数, 1モデルあたりのスレッド数)"""
+        cores = os.cpu_count() or 1
+        workers = max(1, min(self.workers, n_tasks))
+        return workers, max(1, cores // workers)
+
+    def run(self, start: date, end: date) -> Dict:
+        """期間全体をバックテストして集計結果を返す"""
+        chunks = _month_chunks(start, end)
+        if self.strategy.engine == "ml":
+            # 各ワーカーが同じ月を重複して再抽出しないよう事前にスナップショットを更新
+            db = SessionLocal()
+            try:
+                DatasetSnapshotStore().refresh(db, verbose=False)
+            finally:
+                db.close()
+
+        workers, threads = self._thread_plan(len(chunks))
+        tasks = [(self.strategy, chunk_start, chunk_end, threads) for chunk_start, chunk_end in chunks]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(_run_chunk_args, tasks))
+        else:
+            parts = [_run_chunk_args(task) for task in tasks]
+
+        # チャンクは時系列順なので連結すれば全体も時系列順になる
+        parts = [p for p in parts if p]
+        if not parts:
+            return summarize({})
+        records = {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+        return summarize(records)
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of prediction strategies")
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--engine", choices=["statistical", "ml"], default="statistical")
+    parser.add_argument("--bet-type", choices=list(SETTLEMENT), default="3連単")
+    parser.add_argument("--tickets", type=int, default=1, help="tickets per race")
+    parser.add_argument("--min-probability", type=float, default=0.0)
+    parser.add_argument("--stake", type=int, default=BET_UNIT)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    strategy = BacktestStrategy(
+        engine=args.engine,
+        bet_type=args.bet_type,
+        tickets_per_race=args.tickets,
+        min_probability=args.min_probability,
+        stake=args.stake,
+    )
+
+    print(f"=== Backtest: {args.engine} / {args.bet_type} x{args.tickets} ({args.start} - {args.end}) ===\n")
+    started = time.perf_counter()
+    report = Backtester(strategy, workers=args.workers).run(args.start, args.end)
+    elapsed = time.perf_counter() - started
+
+    if report["races"] == 0:
+        print("No settled races in this period.")
+        return
+
+    print(f"Races:        {report['races']}")
+    print(f"Hit rate:     {report['hit_rate']:.4f}")
+    print(f"Total bet:    {report['total_bet']:,}")
+    print(f"Total return: {report['total_return']:,}")
+    print(f"ROI:          {report['roi']:+.2f}%")
+    print(f"Max drawdown: {report['max_drawdown']:,}")
+    if report["missing_payouts"]:
+        print(f"Warning: {report['missing_payouts']} hits have no payout recorded")
+
+    print("\n=== By Venue ===")
+    for venue, stats in report["by_venue"].items():
+        print(f"  {venue}: races={stats['races']} hit_rate={stats['hit_rate']:.4f} roi={stats['roi']:+.2f}%")
+
+    print(f"\nElapsed: {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
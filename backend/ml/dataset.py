@@ -0,0 +1,137 @@
+"""学習データの一括読み込み"""
+from datetime import date
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import select, func, case
+from sqlalchemy.orm import Session
+
+from app.models import db_models
+from app.prediction.course_entry import point_in_time_course_probs
+from ml.feature_store import EQUIPMENT_KINDS, training_context
+from ml.features import RAW_COLUMNS, RANK_MAP, DEFAULT_RANK, build_feature_matrix
+
+
+def _training_filter(before: Optional[date], since: Optional[date]):
+    """対象レース（結果あり・6艇揃い・期間内）の条件"""
+    full_races = select(db_models.RaceEntry.race_id).group_by(
+        db_models.RaceEntry.race_id
+    ).having(func.count(db_models.RaceEntry.id) == 6)
+
+    conditions = [db_models.RaceEntry.race_id.in_(full_races)]
+    if before is not None:
+        conditions.append(db_models.Race.race_date < before)
+    if since is not None:
+        conditions.append(db_models.Race.race_date >= since)
+    return conditions
+
+
+def load_training_arrays(
+    db: Session,
+    before: Optional[date] = None,
+    since: Optional[date] = None,
+    chunk_size: int = 50_000,
+) -> Dict[str, np.ndarray]:
+    """
+    出走表・結果を1回の結合クエリでストリーミングし、特徴量行列を作る
+
+    行数を先に数えて配列を確保し、yield_per で chunk_size 行ずつ流し込むため
+    ORMオブジェクトを作らず、メモリ使用量は出力配列の大きさで抑えられる。
+    特徴量のコースアドバンテージは推論時と同じく進入予測の分布から計算する
+    （各レースの前日までの結果だけで学習した CourseEntryModel を使う）。
+    選手の直近成績・モーター/ボートの成績は特徴量ストアの、選手同士の対戦成績は結果の、レース前日までの集計を使う。
+
+    Args:
+        before: この日より前のレースのみ
+        since: この日以降のレースのみ
+
+    Returns:
+        X: 特徴量行列 (n_rows, n_features)
+        race_id, race_date (日付の序数), boat_no: 各行の識別情報
+        position: 着順 (1〜6、不明は0)
+    """
+    conditions = _training_filter(before, since)
+
+    rank_numeric = case(
+        *[(db_models.RaceEntry.racer_rank == rank, value) for rank, value in RANK_MAP.items()],
+        else_=DEFAULT_RANK,
+    )
+    raw_columns = [
+        rank_numeric if name == "rank_numeric" else getattr(db_models.RaceEntry, name)
+        for name in RAW_COLUMNS
+    ]
+    place_columns = [getattr(db_models.RaceResult, f"place_{i}") for i in range(1, 7)]
+    course_columns = [getattr(db_models.RaceResult, f"course_{i}") for i in range(1, 7)]
+
+    base = select(db_models.RaceEntry.race_id).join(
+        db_models.Race, db_models.Race.id == db_models.RaceEntry.race_id
+    ).join(
+        db_models.RaceResult, db_models.RaceResult.race_id == db_models.RaceEntry.race_id
+    ).where(*conditions)
+    n_rows = db.execute(select(func.count()).select_from(base.subquery())).scalar()
+
+    raw = np.empty((n_rows, len(RAW_COLUMNS)))
+    places = np.zeros((n_rows, 6), dtype=np.int8)
+    courses = np.zeros((n_rows, 6), dtype=np.int8)
+    race_id = np.empty(n_rows, dtype=np.int64)
+    race_date = np.empty(n_rows, dtype=np.int64)
+    registration_no = np.empty(n_rows, dtype=object)
+    venue_code = np.empty(n_rows, dtype=object)
+    numbers = {kind: np.empty(n_rows, dtype=object) for kind in EQUIPMENT_KINDS}
+    number_columns = [getattr(db_models.RaceEntry, name) for name, _ in EQUIPMENT_KINDS.values()]
+
+    stmt = base.add_columns(
+        db_models.Race.race_date, db_models.RaceEntry.racer_registration_no, db_models.Race.venue_code,
+        *number_columns, *raw_columns, *place_columns, *course_columns
+    ).order_by(
+        db_models.Race.race_date, db_models.RaceEntry.race_id, db_models.RaceEntry.boat_no
+    ).execution_options(yield_per=chunk_size)
+
+    offset = 0
+    n_raw = len(RAW_COLUMNS)
+    first_raw = 4 + len(number_columns)
+    for chunk in db.execute(stmt).partitions():
+        size = min(len(chunk), n_rows - offset)
+        chunk = chunk[:size]
+        race_id[offset:offset + size] = [row[0] for row in chunk]
+        race_date[offset:offset + size] = [row[1].toordinal() for row in chunk]
+        registration_no[offset:offset + size] = [row[2] for row in chunk]
+        venue_code[offset:offset + size] = [row[3] for row in chunk]
+        for k, kind in enumerate(EQUIPMENT_KINDS):
+            numbers[kind][offset:offset + size] = [row[4 + k] for row in chunk]
+        raw[offset:offset + size] = np.array([row[first_raw:first_raw + n_raw] for row in chunk], dtype=float)
+        places[offset:offset + size] = np.array(
+            [[p or 0 for p in row[first_raw + n_raw:first_raw + n_raw + 6]] for row in chunk], dtype=np.int8
+        )
+        courses[offset:offset + size] = np.array(
+            [[c or 0 for c in row[first_raw + n_raw + 6:]] for row in chunk], dtype=np.int8
+        )
+        offset += size
+
+    # 件数取得後に行が増減した場合に備えて実際の行数に合わせる
+    raw, places, courses = raw[:offset], places[:offset], courses[:offset]
+    race_id, race_date, registration_no = race_id[:offset], race_date[:offset], registration_no[:offset]
+    venue_code = venue_code[:offset]
+    numbers = {kind: values[:offset] for kind, values in numbers.items()}
+
+    columns = {name: raw[:, i] for i, name in enumerate(RAW_COLUMNS)}
+    boat_no = columns["boat_no"].astype(np.int64)
+    matches = places == boat_no[:, None]
+    position = np.where(matches.any(axis=1), matches.argmax(axis=1) + 1, 0)
+
+    # course_1..6 は進入コース順の艇番。実際の進入はその日の予測の後に進入予測の学習にだけ使う
+    in_course = courses == boat_no[:, None]
+    course = np.where(in_course.any(axis=1), in_course.argmax(axis=1) + 1, 0)
+    course_probs = point_in_time_course_probs(
+        db, race_id, race_date, registration_no, boat_no, course, since=since
+    )
+
+    context = training_context(db, race_id, race_date, boat_no, registration_no, venue_code, numbers)
+
+    return {
+        "X": build_feature_matrix(columns, race_id, course_probs, context),
+        "race_id": race_id,
+        "race_date": race_date,
+        "boat_no": boat_no,
+        "position": position,
+    }
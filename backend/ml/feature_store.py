@@ -0,0 +1,863 @@
+"""選手・モーター・ボートの直近成績の特徴量ストア
+
+使い方:
+    cd backend
+    python -m ml.feature_store --rebuild
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, delete, insert, update, func, and_
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import db_models
+from app.prediction.betting import BOAT_COUNT
+from ml.matchup import matchup_matrix, point_in_time_field_score
+
+
+FORM_WINDOW = 10  # 直近成績・STを集計するレース数
+COURSE_WINDOW = 30  # 進入コース別成績を集計するレース数
+RENEWAL_DROP = 10.0  # 公式2連率がこれ以上（ポイント）下がったら交換とみなす
+
+FORM_COLUMNS = [
+    "races",
+    "avg_position",
+    "win_rate",
+    "top2_rate",
+    "top3_rate",
+    "st_mean",
+    "st_std",
+    "flying_count",
+    *[f"course_{k}_top2" for k in range(1, 7)],
+    "motor_races",
+    "motor_avg_position",
+]
+
+_INTEGER_COLUMNS = {"races", "flying_count", "motor_races"}
+
+# 予想モデルの特徴量の元データ（ml.features.CONTEXT_COLUMNS）→ FORM_COLUMNS の列
+RACER_CONTEXT = {
+    "form_avg_position": "avg_position",
+    "form_top2_rate": "top2_rate",
+    "form_st_mean": "st_mean",
+    **{f"form_course_{k}_top2": f"course_{k}_top2" for k in range(1, 7)},
+}
+
+# 種別 → (出走表の番号の列, 公式2連率の列)
+EQUIPMENT_KINDS = {
+    "motor": ("motor_no", "motor_rate_2"),
+    "boat": ("boat_no_actual", "boat_rate_2"),
+}
+
+EQUIPMENT_COLUMNS = [
+    "period_start",
+    "starts",
+    "avg_position",
+    "top2_rate",
+    "top3_rate",
+    "official_rate",
+    "recent_races",
+    "recent_avg_position",
+    "recent_top2_rate",
+    "recent_positions",
+]
+EQUIPMENT_NUMERIC_COLUMNS = [c for c in EQUIPMENT_COLUMNS if c not in ("period_start", "recent_positions")]
+
+# 予想モデルの特徴量の元データ（ml.features.CONTEXT_COLUMNS）→ (種別, EQUIPMENT_COLUMNS の列)
+EQUIPMENT_CONTEXT = {
+    "motor_top2_rate": ("motor", "top2_rate"),
+    "motor_recent_top2_rate": ("motor", "recent_top2_rate"),
+    "boat_top2_rate": ("boat", "top2_rate"),
+}
+
+
+def _group_starts(codes: np.ndarray) -> np.ndarray:
+    """連続して並んだ同一グループについて、各行が属するグループの先頭行の位置"""
+    n = len(codes)
+    is_start = np.r_[True, codes[1:] != codes[:-1]] if n else np.zeros(0, dtype=bool)
+    return np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+
+def _rolling_sum(values: np.ndarray, starts: np.ndarray, window: int) -> np.ndarray:
+    """グループ内で各行までの直近 window 行の合計"""
+    cumulative = np.r_[0.0, np.cumsum(values, dtype=float)]
+    rows = np.arange(len(values))
+    lower = np.maximum(rows + 1 - window, starts)
+    return cumulative[rows + 1] - cumulative[lower]
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def _positions(places: np.ndarray, boat_no: np.ndarray) -> np.ndarray:
+    """着順の列 place_1..6 (n, 6) から各艇の着順（不明はNaN）"""
+    matches = places == boat_no[:, None]
+    return np.where(matches.any(axis=1), matches.argmax(axis=1) + 1, np.nan)
+
+
+def load_history(db: Session, registration_nos: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    結果のある出走を1行ずつ取得（選手・開催日・レース番号順）
+
+    Returns:
+        registration_no, race_date, race_id, venue_code, motor_no と、
+        position（着順、不明はNaN）, st（スタートタイミング）, course（進入コース）
+    """
+    place_columns = [getattr(db_models.RaceResult, f"place_{i}") for i in range(1, 7)]
+    st_columns = [getattr(db_models.RaceResult, f"st_{i}") for i in range(1, 7)]
+    course_columns = [getattr(db_models.RaceResult, f"course_{i}") for i in range(1, 7)]
+
+    stmt = select(
+        db_models.RaceEntry.racer_registration_no,
+        db_models.Race.race_date,
+        db_models.Race.race_no,
+        db_models.RaceEntry.race_id,
+        db_models.Race.venue_code,
+        db_models.RaceEntry.motor_no,
+        db_models.RaceEntry.boat_no,
+        *place_columns,
+        *st_columns,
+        *course_columns,
+    ).join(
+        db_models.Race, db_models.Race.id == db_models.RaceEntry.race_id
+    ).join(
+        db_models.RaceResult, db_models.RaceResult.race_id == db_models.RaceEntry.race_id
+    ).where(
+        db_models.RaceEntry.racer_registration_no.isnot(None),
+        db_models.RaceEntry.boat_no.between(1, 6),
+    )
+    if registration_nos is not None:
+        stmt = stmt.where(db_models.RaceEntry.racer_registration_no.in_(list(registration_nos)))
+    rows = db.execute(stmt).all()
+
+    columns = ["registration_no", "race_date", "race_no", "race_id", "venue_code", "motor_no", "boat_no"]
+    frame = pd.DataFrame([row[:7] for row in rows], columns=columns)
+    n = len(rows)
+    values = np.array([row[7:] for row in rows], dtype=float).reshape(n, 18)
+    places, st, courses = values[:, :6], values[:, 6:12], values[:, 12:]
+    boat_no = frame["boat_no"].to_numpy(dtype=int)
+
+    # 着順・進入コースは艇番が入っている列の位置、STは艇番の列
+    in_course = courses == boat_no[:, None]
+    frame["position"] = _positions(places, boat_no)
+    frame["st"] = st[np.arange(n), boat_no - 1]
+    frame["course"] = np.where(in_course.any(axis=1), in_course.argmax(axis=1) + 1, np.nan)
+
+    return frame.sort_values(
+        ["registration_no", "race_date", "race_no", "race_id"], kind="stable"
+    ).reset_index(drop=True)
+
+
+def compute_form(history: pd.DataFrame, window: int = FORM_WINDOW,
+                 course_window: int = COURSE_WINDOW) -> pd.DataFrame:
+    """
+    出走履歴から各選手・各開催日終了時点の直近成績を計算
+
+    Args:
+        history: load_history の出力（選手・開催日順に並んでいること）
+
+    Returns:
+        registration_no, as_of_date と FORM_COLUMNS の各列（選手×出走日ごとに1行）
+    """
+    if history.empty:
+        return pd.DataFrame(columns=["registration_no", "as_of_date", *FORM_COLUMNS])
+
+    codes, _ = pd.factorize(history["registration_no"])
+    starts = _group_starts(codes)
+    position = history["position"].to_numpy(dtype=float)
+    st = history["st"].to_numpy(dtype=float)
+    course = history["course"].to_numpy(dtype=float)
+    finished = ~np.isnan(position)
+    has_st = ~np.isnan(st)
+
+    def recent(values, size=window):
+        return _rolling_sum(np.asarray(values, dtype=float), starts, size)
+
+    races = recent(np.ones(len(history)))
+    finishes = recent(finished)
+    position_sum = recent(np.nan_to_num(position))
+    st_count = recent(has_st)
+    st_sum = recent(np.nan_to_num(st))
+    st_square = recent(np.nan_to_num(st) ** 2)
+    st_mean = _ratio(st_sum, st_count)
+    st_var = _ratio(st_square, st_count) - st_mean ** 2
+
+    form = {
+        "races": races,
+        "avg_position": _ratio(position_sum, finishes),
+        "win_rate": recent(position == 1) / races,
+        "top2_rate": recent(position <= 2) / races,
+        "top3_rate": recent(position <= 3) / races,
+        "st_mean": st_mean,
+        "st_std": np.where(st_count >= 2, np.sqrt(np.maximum(st_var, 0.0)), np.nan),
+        "flying_count": recent(has_st & (np.nan_to_num(st) < 0)),
+    }
+    for k in range(1, 7):
+        in_course = course == k
+        form[f"course_{k}_top2"] = _ratio(
+            recent(in_course & (position <= 2), course_window), recent(in_course, course_window)
+        )
+
+    # 同じ選手・会場・モーターの出走だけを並べ直して集計し、元の順序に戻す
+    has_motor = history["motor_no"].notna().to_numpy()
+    motor_codes, _ = pd.factorize(
+        pd.MultiIndex.from_arrays([codes, history["venue_code"], history["motor_no"]])
+    )
+    order = np.lexsort((np.arange(len(history)), motor_codes))
+    motor_starts = _group_starts(motor_codes[order])
+    motor_races = np.empty(len(history))
+    motor_finishes = np.empty(len(history))
+    motor_position_sum = np.empty(len(history))
+    motor_races[order] = _rolling_sum(np.ones(len(history)), motor_starts, window)
+    motor_finishes[order] = _rolling_sum(finished[order], motor_starts, window)
+    motor_position_sum[order] = _rolling_sum(np.nan_to_num(position)[order], motor_starts, window)
+    form["motor_races"] = np.where(has_motor, motor_races, 0)
+    form["motor_avg_position"] = np.where(has_motor, _ratio(motor_position_sum, motor_finishes), np.nan)
+
+    # 各選手のその日最後の出走の時点の値を残す
+    race_date = history["race_date"].to_numpy()
+    last_of_day = np.r_[(codes[1:] != codes[:-1]) | (race_date[1:] != race_date[:-1]), True]
+    result = pd.DataFrame({name: values[last_of_day] for name, values in form.items()})
+    result.insert(0, "as_of_date", race_date[last_of_day])
+    result.insert(0, "registration_no", history["registration_no"].to_numpy()[last_of_day])
+    for name in _INTEGER_COLUMNS:
+        result[name] = result[name].astype(int)
+    return result
+
+
+def load_equipment_history(db: Session, kind: str, venue_code: Optional[str] = None,
+                           numbers: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    モーターまたはボートの結果のある出走を1行ずつ取得（会場・番号・開催日・レース番号順）
+
+    Returns:
+        venue_code, number, race_date, race_id, official_rate（出走表の公式2連率）, position
+    """
+    number_name, rate_name = EQUIPMENT_KINDS[kind]
+    number_column = getattr(db_models.RaceEntry, number_name)
+    place_columns = [getattr(db_models.RaceResult, f"place_{i}") for i in range(1, 7)]
+
+    stmt = select(
+        db_models.Race.venue_code,
+        number_column,
+        db_models.Race.race_date,
+        db_models.Race.race_no,
+        db_models.RaceEntry.race_id,
+        getattr(db_models.RaceEntry, rate_name),
+        db_models.RaceEntry.boat_no,
+        *place_columns,
+    ).join(
+        db_models.Race, db_models.Race.id == db_models.RaceEntry.race_id
+    ).join(
+        db_models.RaceResult, db_models.RaceResult.race_id == db_models.RaceEntry.race_id
+    ).where(
+        number_column.isnot(None),
+        number_column != "",
+        db_models.Race.venue_code.isnot(None),
+    )
+    if venue_code is not None:
+        stmt = stmt.where(db_models.Race.venue_code == venue_code)
+    if numbers is not None:
+        stmt = stmt.where(number_column.in_(list(numbers)))
+    rows = db.execute(stmt).all()
+
+    frame = pd.DataFrame(
+        [row[:5] for row in rows], columns=["venue_code", "number", "race_date", "race_no", "race_id"]
+    )
+    values = np.array([row[5:] for row in rows], dtype=float).reshape(len(rows), 8)
+    # 公式2連率の0は未取得とみなす
+    frame["official_rate"] = np.where(values[:, 0] > 0, values[:, 0], np.nan)
+    frame["position"] = _positions(values[:, 2:], values[:, 1])
+
+    return frame.sort_values(
+        ["venue_code", "number", "race_date", "race_no", "race_id"], kind="stable"
+    ).reset_index(drop=True)
+
+
+def compute_equipment_form(history: pd.DataFrame, window: int = FORM_WINDOW,
+                           renewal_drop: float = RENEWAL_DROP) -> pd.DataFrame:
+    """
+    出走履歴から各モーター（ボート）・各開催日終了時点の成績を計算
+
+    公式2連率が前回の出走から renewal_drop 以上下がった出走を交換とみなし、
+    交換以降の出走だけを集計する。
+
+    Args:
+        history: load_equipment_history の出力
+
+    Returns:
+        venue_code, number, as_of_date と EQUIPMENT_COLUMNS の各列
+    """
+    if history.empty:
+        return pd.DataFrame(columns=["venue_code", "number", "as_of_date", *EQUIPMENT_COLUMNS])
+
+    codes, _ = pd.factorize(pd.MultiIndex.from_arrays([history["venue_code"], history["number"]]))
+    n = len(history)
+    rate = history["official_rate"].to_numpy(dtype=float)
+    position = history["position"].to_numpy(dtype=float)
+    finished = ~np.isnan(position)
+
+    # 同じモーターの前回出走から公式2連率が大きく下がった出走で期間を区切る
+    same_unit = np.r_[False, codes[1:] == codes[:-1]]
+    with np.errstate(invalid="ignore"):
+        renewed = same_unit & (np.r_[np.nan, rate[:-1]] - rate >= renewal_drop)
+    period = np.cumsum(~same_unit | renewed)
+    starts = _group_starts(period)
+
+    def since_start(values):
+        return _rolling_sum(np.asarray(values, dtype=float), starts, n)
+
+    def recent(values):
+        return _rolling_sum(np.asarray(values, dtype=float), starts, window)
+
+    total = np.arange(n) - starts + 1.0
+    recent_races = recent(np.ones(n))
+    race_date = history["race_date"].to_numpy()
+    form = {
+        "period_start": race_date[starts],
+        "starts": total,
+        "avg_position": _ratio(since_start(np.nan_to_num(position)), since_start(finished)),
+        "top2_rate": since_start(position <= 2) / total,
+        "top3_rate": since_start(position <= 3) / total,
+        "official_rate": rate,
+        "recent_races": recent_races,
+        "recent_avg_position": _ratio(recent(np.nan_to_num(position)), recent(finished)),
+        "recent_top2_rate": recent(position <= 2) / recent_races,
+    }
+
+    last_of_day = np.r_[(codes[1:] != codes[:-1]) | (race_date[1:] != race_date[:-1]), True]
+    rows = np.flatnonzero(last_of_day)
+    symbols = np.where(finished, np.nan_to_num(position).astype(int).astype(str), "-")
+    lower = np.maximum(rows + 1 - window, starts[rows])
+    recent_positions = ["".join(symbols[lo:row + 1]) for lo, row in zip(lower, rows)]
+
+    result = pd.DataFrame({name: values[rows] for name, values in form.items()})
+    result["recent_positions"] = recent_positions
+    result.insert(0, "as_of_date", race_date[rows])
+    result.insert(0, "number", history["number"].to_numpy()[rows])
+    result.insert(0, "venue_code", history["venue_code"].to_numpy()[rows])
+    for name in ("starts", "recent_races"):
+        result[name] = result[name].astype(int)
+    return result
+
+
+# 世代のテーブルを確認済みの接続先
+_generation_tables: Set = set()
+
+
+def _ensure_generation_table(db: Session):
+    """世代のテーブルがなければ作る（APIを起動する前の既存DBでコマンドラインから更新する場合）"""
+    bind = db.get_bind()
+    if bind not in _generation_tables:
+        db_models.FeatureStoreGeneration.__table__.create(bind=bind, checkfirst=True)
+        _generation_tables.add(bind)
+
+
+def _bump_generation(db: Session, name: str):
+    """ストアの世代を1つ進める（呼び出し側の commit で書き換えと一緒に確定する）"""
+    _ensure_generation_table(db)
+    generation = db_models.FeatureStoreGeneration
+    updated = db.execute(
+        update(generation).where(generation.name == name).values(generation=generation.generation + 1)
+    ).rowcount
+    if not updated:
+        db.add(generation(name=name, generation=1))
+
+
+def store_generations(db: Session) -> Dict[str, int]:
+    """ストア名 → 世代（一度も書き換えていなければ 0）"""
+    _ensure_generation_table(db)
+    rows = dict(db.query(db_models.FeatureStoreGeneration.name, db_models.FeatureStoreGeneration.generation).all())
+    return {name: rows.get(name, 0) for name in ("racer_features", "equipment_features")}
+
+
+def _records(form: pd.DataFrame) -> List[Dict]:
+    """DataFrame → 一括INSERT用の辞書（NaN は NULL）"""
+    return [
+        {key: (None if isinstance(value, float) and np.isnan(value) else value) for key, value in row.items()}
+        for row in form.to_dict("records")
+    ]
+
+
+class RacerFeatureStore:
+    """
+    選手 × 集計日ごとの直近成績（racer_features テーブル）
+
+    各行は as_of_date 当日までのレース結果で集計した値で、as_of_date より後の
+    レースには使える（point-in-time）。結果が保存されるたびに、そのレースの
+    6選手の分だけ再計算する。
+    """
+
+    def __init__(self, window: int = FORM_WINDOW, course_window: int = COURSE_WINDOW):
+        self.window = window
+        self.course_window = course_window
+
+    def rebuild(self, db: Session) -> int:
+        """全選手の履歴から作り直す（作成した行数を返す）"""
+        form = compute_form(load_history(db), self.window, self.course_window)
+        db.execute(delete(db_models.RacerFeature))
+        if len(form):
+            db.execute(insert(db_models.RacerFeature), _records(form))
+        _bump_generation(db, "racer_features")
+        db.commit()
+        return len(form)
+
+    def update_race(self, db: Session, race_id: int) -> int:
+        """
+        レース結果の保存後に、出走した選手の直近成績を更新
+
+        過去のレースの結果が後から入った場合に備え、そのレースの開催日以降の行を
+        まとめて計算し直す。
+
+        Returns:
+            更新した行数
+        """
+        race = db.get(db_models.Race, race_id)
+        if race is None or race.race_date is None:
+            return 0
+        registration_nos = sorted({
+            entry.racer_registration_no for entry in race.entries if entry.racer_registration_no
+        })
+        if not registration_nos:
+            return 0
+
+        form = compute_form(load_history(db, registration_nos), self.window, self.course_window)
+        form = form[form["as_of_date"] >= race.race_date]
+
+        db.execute(delete(db_models.RacerFeature).where(
+            db_models.RacerFeature.registration_no.in_(registration_nos),
+            db_models.RacerFeature.as_of_date >= race.race_date,
+        ))
+        if len(form):
+            db.execute(insert(db_models.RacerFeature), _records(form))
+        _bump_generation(db, "racer_features")
+        db.commit()
+        return len(form)
+
+    def lookup(self, db: Session, registration_nos: Sequence[str], race_date: date) -> Dict[str, Dict]:
+        """
+        race_date のレースで使える各選手の最新の直近成績（前日までの集計）を1クエリで取得
+
+        Returns:
+            登録番号 → {FORM_COLUMNS の値, "as_of_date"}（履歴のない選手は含まない）
+        """
+        feature = db_models.RacerFeature
+        latest = select(
+            feature.registration_no, func.max(feature.as_of_date).label("as_of_date")
+        ).where(
+            feature.registration_no.in_(list(registration_nos)),
+            feature.as_of_date < race_date,
+        ).group_by(feature.registration_no).subquery()
+
+        rows = db.execute(
+            select(feature).join(latest, and_(
+                feature.registration_no == latest.c.registration_no,
+                feature.as_of_date == latest.c.as_of_date,
+            ))
+        ).scalars().all()
+        return {
+            row.registration_no: {
+                "as_of_date": row.as_of_date,
+                **{name: getattr(row, name) for name in FORM_COLUMNS},
+            }
+            for row in rows
+        }
+
+    def race_card(self, db: Session, race_id: int) -> Dict[int, Dict]:
+        """出走表の全艇の直近成績（艇番 → 値、履歴のない艇は含まない）"""
+        race = db.get(db_models.Race, race_id)
+        if race is None:
+            return {}
+        boats = {entry.racer_registration_no: entry.boat_no for entry in race.entries
+                 if entry.racer_registration_no}
+        features = self.lookup(db, list(boats), race.race_date)
+        return {boats[reg]: values for reg, values in features.items()}
+
+    def point_in_time(self, db: Session, registration_no: Sequence[str],
+                      race_date: np.ndarray) -> np.ndarray:
+        """
+        学習データの各行に、そのレースの前日までの直近成績を付ける
+
+        Args:
+            registration_no: 各行の選手登録番号 (n_rows,)
+            race_date: 各行の開催日の序数 (n_rows,)
+
+        Returns:
+            FORM_COLUMNS の行列 (n_rows, len(FORM_COLUMNS))。履歴がなければNaN
+        """
+        rows = pd.DataFrame({
+            "registration_no": np.asarray(registration_no, dtype=object),
+            "date": np.asarray(race_date, dtype=np.int64),
+            "row": np.arange(len(race_date)),
+        })
+        stored = pd.read_sql(
+            select(db_models.RacerFeature.registration_no, db_models.RacerFeature.as_of_date,
+                   *[getattr(db_models.RacerFeature, name) for name in FORM_COLUMNS]).where(
+                db_models.RacerFeature.registration_no.in_(rows["registration_no"].dropna().unique().tolist())
+            ),
+            db.connection(),
+        )
+        stored["date"] = np.array([d.toordinal() for d in pd.to_datetime(stored["as_of_date"]).dt.date],
+                                  dtype=np.int64)
+
+        # 同日の集計を含めないよう、開催日より前の最新の行を結合する
+        merged = pd.merge_asof(
+            rows.sort_values("date"), stored.drop(columns="as_of_date").sort_values("date"),
+            on="date", by="registration_no", allow_exact_matches=False,
+        ).sort_values("row")
+        return merged[FORM_COLUMNS].to_numpy(dtype=float)
+
+
+class EquipmentFeatureStore:
+    """
+    会場 × モーター（ボート）番号 × 集計日ごとの成績（equipment_features テーブル）
+
+    出走表の公式2連率は累積値で交換直後の実力を反映しにくいため、結果から
+    交換以降の成績と直近の着順を集計しておく。API・予想からは集計済みの行を
+    参照するだけで、出走履歴を走査しない。
+    """
+
+    def __init__(self, window: int = FORM_WINDOW, renewal_drop: float = RENEWAL_DROP):
+        self.window = window
+        self.renewal_drop = renewal_drop
+
+    def _compute(self, db: Session, kind: str, venue_code: Optional[str] = None,
+                 numbers: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        history = load_equipment_history(db, kind, venue_code, numbers)
+        form = compute_equipment_form(history, self.window, self.renewal_drop)
+        form.insert(0, "kind", kind)
+        return form
+
+    def rebuild(self, db: Session) -> int:
+        """全会場の履歴から作り直す（作成した行数を返す）"""
+        db.execute(delete(db_models.EquipmentFeature))
+        count = 0
+        for kind in EQUIPMENT_KINDS:
+            form = self._compute(db, kind)
+            if len(form):
+                db.execute(insert(db_models.EquipmentFeature), _records(form))
+            count += len(form)
+        _bump_generation(db, "equipment_features")
+        db.commit()
+        return count
+
+    def update_race(self, db: Session, race_id: int) -> int:
+        """
+        レース結果の保存後に、使われたモーター・ボートの成績を更新
+
+        交換の検出に前回出走の公式2連率を使うので、対象のモーター・ボートの
+        履歴全体から計算し、そのレースの開催日以降の行を置き換える。
+
+        Returns:
+            更新した行数
+        """
+        race = db.get(db_models.Race, race_id)
+        if race is None or race.race_date is None or race.venue_code is None:
+            return 0
+
+        count = 0
+        for kind, (number_name, _) in EQUIPMENT_KINDS.items():
+            numbers = sorted({getattr(e, number_name) for e in race.entries if getattr(e, number_name)})
+            if not numbers:
+                continue
+            form = self._compute(db, kind, race.venue_code, numbers)
+            form = form[form["as_of_date"] >= race.race_date]
+            db.execute(delete(db_models.EquipmentFeature).where(
+                db_models.EquipmentFeature.kind == kind,
+                db_models.EquipmentFeature.venue_code == race.venue_code,
+                db_models.EquipmentFeature.number.in_(numbers),
+                db_models.EquipmentFeature.as_of_date >= race.race_date,
+            ))
+            if len(form):
+                db.execute(insert(db_models.EquipmentFeature), _records(form))
+            count += len(form)
+        _bump_generation(db, "equipment_features")
+        db.commit()
+        return count
+
+    def lookup(self, db: Session, kind: str, venue_code: str, numbers: Sequence[str],
+               race_date: date) -> Dict[str, Dict]:
+        """
+        race_date のレースで使える各番号の最新の成績（前日までの集計）を1クエリで取得
+
+        Returns:
+            番号 → {EQUIPMENT_COLUMNS の値, "as_of_date"}（履歴のない番号は含まない）
+        """
+        feature = db_models.EquipmentFeature
+        latest = select(
+            feature.number, func.max(feature.as_of_date).label("as_of_date")
+        ).where(
+            feature.kind == kind,
+            feature.venue_code == venue_code,
+            feature.number.in_(list(numbers)),
+            feature.as_of_date < race_date,
+        ).group_by(feature.number).subquery()
+
+        rows = db.execute(
+            select(feature).join(latest, and_(
+                feature.number == latest.c.number,
+                feature.as_of_date == latest.c.as_of_date,
+            )).where(feature.kind == kind, feature.venue_code == venue_code)
+        ).scalars().all()
+        return {
+            row.number: {
+                "as_of_date": row.as_of_date,
+                **{name: getattr(row, name) for name in EQUIPMENT_COLUMNS},
+            }
+            for row in rows
+        }
+
+    def point_in_time(self, db: Session, kind: str, venue_code: Sequence[str], number: Sequence[str],
+                      race_date: np.ndarray) -> np.ndarray:
+        """
+        学習データの各行に、そのレースの前日までのモーター（ボート）成績を付ける
+
+        Args:
+            venue_code, number: 各行の会場コード・番号 (n_rows,)
+            race_date: 各行の開催日の序数 (n_rows,)
+
+        Returns:
+            EQUIPMENT_NUMERIC_COLUMNS の行列 (n_rows, len(EQUIPMENT_NUMERIC_COLUMNS))。履歴がなければNaN
+        """
+        rows = pd.DataFrame({
+            "venue_code": np.asarray(venue_code, dtype=object),
+            "number": np.asarray(number, dtype=object),
+            "date": np.asarray(race_date, dtype=np.int64),
+            "row": np.arange(len(race_date)),
+        })
+        feature = db_models.EquipmentFeature
+        stored = pd.read_sql(
+            select(feature.venue_code, feature.number, feature.as_of_date,
+                   *[getattr(feature, name) for name in EQUIPMENT_NUMERIC_COLUMNS]).where(
+                feature.kind == kind,
+                feature.venue_code.in_(rows["venue_code"].dropna().unique().tolist()),
+            ),
+            db.connection(),
+        )
+        stored["date"] = np.array([d.toordinal() for d in pd.to_datetime(stored["as_of_date"]).dt.date],
+                                  dtype=np.int64)
+        for key in ("venue_code", "number"):
+            rows[key] = rows[key].astype(object)
+            stored[key] = stored[key].astype(object)
+
+        # 同日の集計を含めないよう、開催日より前の最新の行を結合する
+        merged = pd.merge_asof(
+            rows.sort_values("date"), stored.drop(columns="as_of_date").sort_values("date"),
+            on="date", by=["venue_code", "number"], allow_exact_matches=False,
+        ).sort_values("row")
+        return merged[EQUIPMENT_NUMERIC_COLUMNS].to_numpy(dtype=float)
+
+    def race_card(self, db: Session, race_id: int) -> Dict[int, Dict[str, Dict]]:
+        """出走表の全艇のモーター・ボート成績（艇番 → {"motor": 値, "boat": 値}）"""
+        race = db.get(db_models.Race, race_id)
+        if race is None:
+            return {}
+        card: Dict[int, Dict[str, Dict]] = {entry.boat_no: {} for entry in race.entries}
+        for kind, (number_name, _) in EQUIPMENT_KINDS.items():
+            numbers = {getattr(e, number_name): e.boat_no for e in race.entries if getattr(e, number_name)}
+            features = self.lookup(db, kind, race.venue_code, list(numbers), race.race_date)
+            for number, values in features.items():
+                card[numbers[number]][kind] = values
+        return card
+
+    def history(self, db: Session, kind: str, venue_code: str, number: str,
+                limit: int = 100) -> List[db_models.EquipmentFeature]:
+        """集計日ごとの成績（新しい順）"""
+        feature = db_models.EquipmentFeature
+        return db.query(feature).filter(
+            feature.kind == kind,
+            feature.venue_code == venue_code,
+            feature.number == number,
+        ).order_by(feature.as_of_date.desc()).limit(limit).all()
+
+
+racer_feature_store = RacerFeatureStore()
+equipment_feature_store = EquipmentFeatureStore()
+
+
+def training_context(db: Session, race_id: np.ndarray, race_date: np.ndarray, boat_no: np.ndarray,
+                     registration_no: Sequence[str], venue_code: Sequence[str],
+                     numbers: Dict[str, Sequence[str]]) -> Dict[str, np.ndarray]:
+    """
+    学習データの各行の特徴量の元データ（ml.features.CONTEXT_COLUMNS）をレース前日までの集計から作る
+
+    Args:
+        race_id, boat_no: 各行のレースID・艇番 (n_rows,)
+        race_date: 各行の開催日の序数 (n_rows,)
+        registration_no, venue_code: 各行の選手登録番号・会場コード (n_rows,)
+        numbers: 種別（EQUIPMENT_KINDS）→ 各行のモーター・ボート番号 (n_rows,)
+    """
+    form = racer_feature_store.point_in_time(db, registration_no, race_date)
+    context = {name: form[:, FORM_COLUMNS.index(column)] for name, column in RACER_CONTEXT.items()}
+    for kind in EQUIPMENT_KINDS:
+        equipment = equipment_feature_store.point_in_time(db, kind, venue_code, numbers[kind], race_date)
+        for name, (context_kind, column) in EQUIPMENT_CONTEXT.items():
+            if context_kind == kind:
+                context[name] = equipment[:, EQUIPMENT_NUMERIC_COLUMNS.index(column)]
+    context["field_score"] = point_in_time_field_score(db, race_id, race_date, registration_no, boat_no)
+    return context
+
+
+def card_context(db: Session, entries_by_race: List[List]) -> Dict[str, np.ndarray]:
+    """
+    出走表の各行の特徴量の元データ（ml.features.CONTEXT_COLUMNS）を特徴量ストアの最新の集計から作る
+
+    行の並びは entries_by_race を平らにした順。開催日×会場ごとに選手・モーター・ボートを1クエリずつ引き、
+    対戦成績（field_score）は全レース分を疎行列から一括で引く
+    """
+    entries = [entry for race_entries in entries_by_race for entry in race_entries]
+    context = {name: np.full(len(entries), np.nan) for name in [*RACER_CONTEXT, *EQUIPMENT_CONTEXT]}
+    context["field_score"] = _card_field_score(db, entries_by_race)
+    race_ids = sorted({entry.race_id for entry in entries})
+    races = {
+        race_id: (race_date, venue_code)
+        for race_id, race_date, venue_code in db.query(
+            db_models.Race.id, db_models.Race.race_date, db_models.Race.venue_code
+        ).filter(db_models.Race.id.in_(race_ids)).all()
+    } if race_ids else {}
+
+    def fill(row: int, values: Dict, columns: Dict[str, str]):
+        for name, column in columns.items():
+            if values[column] is not None:
+                context[name][row] = values[column]
+
+    rows_by_race_day: Dict[tuple, List[int]] = {}
+    for row, entry in enumerate(entries):
+        race_date, venue_code = races.get(entry.race_id, (None, None))
+        if race_date is not None:
+            rows_by_race_day.setdefault((race_date, venue_code), []).append(row)
+
+    for (race_date, venue_code), rows in rows_by_race_day.items():
+        registration_nos = {entries[r].racer_registration_no for r in rows} - {None}
+        features = racer_feature_store.lookup(db, registration_nos, race_date) if registration_nos else {}
+        for row in rows:
+            values = features.get(entries[row].racer_registration_no)
+            if values is not None:
+                fill(row, values, RACER_CONTEXT)
+
+        if venue_code is None:
+            continue
+        for kind, (number_name, _) in EQUIPMENT_KINDS.items():
+            columns = {name: column for name, (k, column) in EQUIPMENT_CONTEXT.items() if k == kind}
+            numbers = {getattr(entries[r], number_name, None) for r in rows} - {None, ""}
+            if not columns or not numbers:
+                continue
+            features = equipment_feature_store.lookup(db, kind, venue_code, numbers, race_date)
+            for row in rows:
+                values = features.get(getattr(entries[row], number_name, None))
+                if values is not None:
+                    fill(row, values, columns)
+    return context
+
+
+def _card_field_score(db: Session, entries_by_race: List[List]) -> np.ndarray:
+    """出走表の各行の他の5艇に対する先着率の平均（開催日より前の対戦成績、艇番が範囲外の行は NaN）"""
+    registration_nos = np.full((len(entries_by_race), BOAT_COUNT), None, dtype=object)
+    race_index, boat_index = [], []
+    for race, entries in enumerate(entries_by_race):
+        for entry in entries:
+            boat = entry.boat_no - 1 if 1 <= entry.boat_no <= BOAT_COUNT else -1
+            if boat >= 0:
+                registration_nos[race, boat] = entry.racer_registration_no
+            race_index.append(race)
+            boat_index.append(boat)
+    if not race_index:
+        return np.zeros(0)
+    # 学習データと同じく開催日より前の結果だけで数える（DBにないレースは反映済みの全結果）
+    race_ids = [entries[0].race_id if entries else None for entries in entries_by_race]
+    dates = dict(db.query(db_models.Race.id, db_models.Race.race_date).filter(
+        db_models.Race.id.in_({r for r in race_ids if r is not None})
+    ).all())
+    race_dates = np.array([
+        dates[r].toordinal() if dates.get(r) is not None else date.max.toordinal() for r in race_ids
+    ], dtype=np.int64)
+    matchup_matrix.ensure_loaded(db)
+    field_score = matchup_matrix.race_features_before(db, registration_nos, race_dates)["field_score"]
+    boat_index = np.array(boat_index, dtype=int)
+    return np.where(boat_index >= 0, field_score[race_index, boat_index], np.nan)
+
+
+def load_feature_context(entries_by_race: List[List]) -> Dict[str, np.ndarray]:
+    """予想時の特徴量の元データを取得（失敗した場合は空 = 全て欠損として予想を続ける）"""
+    db = SessionLocal()
+    try:
+        return card_context(db, entries_by_race)
+    except Exception as e:
+        print(f"Feature context loading failed: {e}")
+        return {}
+    finally:
+        db.close()
+
+
+def feature_context_version() -> str:
+    """
+    予想時の特徴量の元データの世代（予想キャッシュのキーに含める）
+
+    特徴量ストアの世代と、対戦成績の疎行列に反映済みの結果で変わる
+    """
+    db = SessionLocal()
+    try:
+        generations = store_generations(db)
+        matchup_matrix.ensure_loaded(db)
+    finally:
+        db.close()
+    return f"fs{generations['racer_features']}.{generations['equipment_features']}-{matchup_matrix.state_token}"
+
+
+def update_race(db: Session, race_id: int):
+    """レース結果の保存後に、出走した選手・モーター・ボートの特徴量を更新"""
+    racer_feature_store.update_race(db, race_id)
+    equipment_feature_store.update_race(db, race_id)
+
+
+def ensure_built(db: Session) -> bool:
+    """
+    選手・モーター/ボートの特徴量ストアのどちらかが空なら全履歴から作り直す（作り直したら True）
+
+    空のストアで学習すると直近成績の特徴量がすべて欠損のモデルになるため、学習の前に呼ぶ
+    """
+    if (db.query(db_models.RacerFeature.id).first() is not None
+            and db.query(db_models.EquipmentFeature.id).first() is not None):
+        return False
+    racer_rows = racer_feature_store.rebuild(db)
+    equipment_rows = equipment_feature_store.rebuild(db)
+    print(f"Feature store was empty; rebuilt {racer_rows} racer and {equipment_rows} motor/boat feature rows")
+    return True
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Racer / motor / boat feature store")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the store from the full race history")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        racer_rows = racer_feature_store.rebuild(db)
+        equipment_rows = equipment_feature_store.rebuild(db)
+        print(f"Rebuilt {racer_rows} racer and {equipment_rows} motor/boat feature rows "
+              f"in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,93 +1,197 @@
-"""特徴量エンジニアリング"""
+"""特徴量エンジニアリング
+
+学習（ml/train.py）と推論（app/prediction/ml_model.py）は必ずこのモジュールの
+build_feature_matrix を通して特徴量を作る。特徴量の定義を変えた場合は
+FEATURE_VERSION を上げること（保存済みモデルとの不整合を検出するため）。
+"""
 import pandas as pd
 import numpy as np
-from typing import List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+FEATURE_VERSION = 6
+
+FEATURE_NAMES = [
+    "boat_no",
+    "win_rate_all",
+    "place_rate_2_all",
+    "win_rate_local",
+    "place_rate_2_local",
+    "motor_rate_2",
+    "boat_rate_2",
+    "avg_start_timing",
+    "rank_numeric",
+    "weight",
+    "course_advantage",
+    "relative_win_rate",
+    "motor_boat_combined",
+    "form_avg_position",
+    "form_top2_rate",
+    "form_st_mean",
+    "form_course_top2",
+    "motor_top2_rate",
+    "motor_recent_top2_rate",
+    "boat_top2_rate",
+    "field_score",
+]
+
+# 特徴量の元になる出走表の列（級別は数値化済み）
+RAW_COLUMNS = [
+    "boat_no",
+    "win_rate_all",
+    "place_rate_2_all",
+    "win_rate_local",
+    "place_rate_2_local",
+    "motor_rate_2",
+    "boat_rate_2",
+    "avg_start_timing",
+    "rank_numeric",
+    "weight",
+]
+
+# 出走表以外から取得する特徴量の元データ（列名 → (n_rows,)、欠損はNaN）。
+# 学習時はレース前日までの集計（point-in-time）、推論時は特徴量ストアの最新の集計を渡す
+CONTEXT_COLUMNS = [
+    "form_avg_position",
+    "form_top2_rate",
+    "form_st_mean",
+    *[f"form_course_{k}_top2" for k in range(1, 7)],
+    "motor_top2_rate",
+    "motor_recent_top2_rate",
+    "boat_top2_rate",
+    "field_score",
+]
+
+RANK_MAP = {"A1": 4, "A2": 3, "B1": 2, "B2": 1}
+DEFAULT_RANK = 2
+DEFAULT_ST = 0.15
+DEFAULT_WEIGHT = 52.0
+
+# 進入コース → コースアドバンテージ（1コースが最も有利、範囲外は0.2）
+_COURSE_ADVANTAGE = np.array([0.2, 1.0, 0.4, 0.35, 0.3, 0.2, 0.1, 0.2])
+
+
+def rank_to_numeric(ranks: Sequence) -> np.ndarray:
+    """級別を数値に変換"""
+    return np.array([RANK_MAP.get(r, DEFAULT_RANK) for r in ranks], dtype=float)
+
+
+def entries_to_columns(entries: Sequence) -> Dict[str, np.ndarray]:
+    """出走表（ORMオブジェクトまたはdict）を列ごとの配列に変換"""
+    def get(entry, name):
+        return entry.get(name) if isinstance(entry, dict) else getattr(entry, name, None)
+
+    columns = {
+        name: np.array([get(e, name) for e in entries], dtype=float)
+        for name in RAW_COLUMNS if name != "rank_numeric"
+    }
+    columns["rank_numeric"] = rank_to_numeric([get(e, "racer_rank") for e in entries])
+    return columns
+
+
+def build_feature_matrix(columns: Dict[str, np.ndarray], race_index: np.ndarray,
+                         course_probs: Optional[np.ndarray] = None,
+                         context: Optional[Dict[str, np.ndarray]] = None) -> np.ndarray:
+    """
+    任意数のレースの特徴量行列を一括で生成
+
+    Args:
+        columns: RAW_COLUMNS の各列 (n_rows,)。欠損はNaN
+        race_index: 各行が属するレースの識別子 (n_rows,)。レース内の相対値の計算に使う
+        course_probs: 各行の進入コース1〜6の確率 (n_rows, 6)。学習・推論とも進入予測の
+            分布を渡す（学習時はレース前日までの結果で学習したもの）。省略時は艇番どおりの進入とみなす
+        context: CONTEXT_COLUMNS の各列 (n_rows,)。ない列・履歴のない選手は欠損（NaN）のまま
+            特徴量にする（LightGBM は欠損を分岐で扱う）
+
+    Returns:
+        特徴量行列 (n_rows, len(FEATURE_NAMES))
+    """
+    def filled(name, default=0.0, zero_is_missing=False):
+        values = np.asarray(columns[name], dtype=float)
+        missing = np.isnan(values)
+        if zero_is_missing:
+            missing |= values == 0
+        return np.where(missing, default, values)
+
+    boat_no = filled("boat_no", 1.0)
+    win_rate_all = filled("win_rate_all")
+    motor_rate_2 = filled("motor_rate_2")
+    boat_rate_2 = filled("boat_rate_2")
+
+    # レース内平均との差
+    _, group = np.unique(race_index, return_inverse=True)
+    race_mean = np.bincount(group, weights=win_rate_all) / np.bincount(group)
+    relative_win_rate = win_rate_all - race_mean[group]
+
+    if course_probs is None:
+        course_idx = np.clip(boat_no.astype(int), 0, len(_COURSE_ADVANTAGE) - 1)
+        course_advantage = _COURSE_ADVANTAGE[course_idx]
+        course_probs = np.eye(6)[np.clip(boat_no.astype(int), 1, 6) - 1]
+    else:
+        course_probs = np.asarray(course_probs, dtype=float)
+        course_advantage = course_probs @ _COURSE_ADVANTAGE[1:7]
+
+    n_rows = len(boat_no)
+    context = context or {}
+
+    def from_context(name):
+        values = context.get(name)
+        return np.full(n_rows, np.nan) if values is None else np.asarray(values, dtype=float)
+
+    # 進入コース別の2連対率を予測した進入の分布で平均（成績のないコースは除いて重みを正規化）
+    course_top2 = np.column_stack([from_context(f"form_course_{k}_top2") for k in range(1, 7)])
+    known = ~np.isnan(course_top2)
+    course_weight = (course_probs * known).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        form_course_top2 = np.where(
+            course_weight > 0, (course_probs * np.nan_to_num(course_top2)).sum(axis=1) / course_weight, np.nan
+        )
+
+    return np.column_stack([
+        boat_no,
+        win_rate_all,
+        filled("place_rate_2_all"),
+        filled("win_rate_local"),
+        filled("place_rate_2_local"),
+        motor_rate_2,
+        boat_rate_2,
+        filled("avg_start_timing", DEFAULT_ST, zero_is_missing=True),
+        filled("rank_numeric", DEFAULT_RANK),
+        filled("weight", DEFAULT_WEIGHT, zero_is_missing=True),
+        course_advantage,
+        relative_win_rate,
+        (motor_rate_2 + boat_rate_2) / 2,
+        from_context("form_avg_position"),
+        from_context("form_top2_rate"),
+        from_context("form_st_mean"),
+        form_course_top2,
+        from_context("motor_top2_rate"),
+        from_context("motor_recent_top2_rate"),
+        from_context("boat_top2_rate"),
+        from_context("field_score"),
+    ])
+
+
+def race_feature_matrix(entries: Sequence) -> np.ndarray:
+    """1レース分の出走表から特徴量行列を生成"""
+    return build_feature_matrix(entries_to_columns(entries), np.zeros(len(entries)))
 
 
 class FeatureEngineer:
     """機械学習用の特徴量を生成"""
-    
+
     def __init__(self):
-        self.feature_names = [
-            "boat_no",
-            "win_rate_all",
-            "place_rate_2_all",
-            "win_rate_local",
-            "place_rate_2_local",
-            "motor_rate_2",
-            "boat_rate_2",
-            "avg_start_timing",
-            "rank_numeric",
-            "weight",
-            "course_advantage",
-            "relative_win_rate",
-            "motor_boat_combined",
-        ]
-    
+        self.feature_names = FEATURE_NAMES
+        self.feature_version = FEATURE_VERSION
+
     def create_features(self, race_entries: List[dict]) -> pd.DataFrame:
         """レースエントリーから特徴量を生成"""
-        features = []
-        
-        # 全体の統計を計算
-        all_win_rates = [e.get("win_rate_all", 0) or 0 for e in race_entries]
-        avg_win_rate = np.mean(all_win_rates) if all_win_rates else 5.0
-        
-        for entry in race_entries:
-            feat = self._create_single_features(entry, avg_win_rate)
-            features.append(feat)
-        
-        return pd.DataFrame(features, columns=self.feature_names)
-    
-    def _create_single_features(self, entry: dict, avg_win_rate: float) -> List[float]:
-        """1艇分の特徴量を生成"""
-        boat_no = entry.get("boat_no", 1)
-        win_rate_all = entry.get("win_rate_all", 0) or 0
-        place_rate_2_all = entry.get("place_rate_2_all", 0) or 0
-        win_rate_local = entry.get("win_rate_local", 0) or 0
-        place_rate_2_local = entry.get("place_rate_2_local", 0) or 0
-        motor_rate_2 = entry.get("motor_rate_2", 0) or 0
-        boat_rate_2 = entry.get("boat_rate_2", 0) or 0
-        avg_st = entry.get("avg_start_timing", 0.15) or 0.15
-        rank = entry.get("racer_rank", "B1")
-        weight = entry.get("weight", 52) or 52
-        
-        # 派生特徴量
-        rank_numeric = self._rank_to_numeric(rank)
-        course_advantage = self._get_course_advantage(boat_no)
-        relative_win_rate = win_rate_all - avg_win_rate
-        motor_boat_combined = (motor_rate_2 + boat_rate_2) / 2
-        
-        return [
-            float(boat_no),
-            float(win_rate_all),
-            float(place_rate_2_all),
-            float(win_rate_local),
-            float(place_rate_2_local),
-            float(motor_rate_2),
-            float(boat_rate_2),
-            float(avg_st),
-            float(rank_numeric),
-            float(weight),
-            float(course_advantage),
-            float(relative_win_rate),
-            float(motor_boat_combined),
-        ]
-    
-    def _rank_to_numeric(self, rank: str) -> int:
-        """級別を数値に変換"""
-        rank_map = {"A1": 4, "A2": 3, "B1": 2, "B2": 1}
-        return rank_map.get(rank, 2)
-    
-    def _get_course_advantage(self, boat_no: int) -> float:
-        """コースアドバンテージを取得"""
-        # 1コースが最も有利
-        advantages = {1: 1.0, 2: 0.4, 3: 0.35, 4: 0.3, 5: 0.2, 6: 0.1}
-        return advantages.get(boat_no, 0.2)
-    
+        return pd.DataFrame(race_feature_matrix(race_entries), columns=self.feature_names)
+
     def create_labels(self, race_results: List[dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         レース結果からラベルを生成
-        
+
         Returns:
             labels_1st: 1着フラグ (6要素)
             labels_2nd: 2着フラグ (6要素)
@@ -96,17 +200,17 @@ class FeatureEngineer:
         labels_1st = []
         labels_2nd = []
         labels_3rd = []
-        
+
         for result in race_results:
             place_1 = result.get("place_1", 0)
             place_2 = result.get("place_2", 0)
             place_3 = result.get("place_3", 0)
-            
+
             for boat_no in range(1, 7):
                 labels_1st.append(1 if boat_no == place_1 else 0)
                 labels_2nd.append(1 if boat_no == place_2 else 0)
                 labels_3rd.append(1 if boat_no == place_3 else 0)
-        
+
         return (
             np.array(labels_1st),
             np.array(labels_2nd),
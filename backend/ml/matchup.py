@@ -0,0 +1,523 @@
+"""選手同士の対戦成績（先着数・同走数）の疎行列
+
+使い方:
+    cd backend
+    python -m ml.matchup --rebuild
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import db_models
+from app.prediction.betting import BOAT_COUNT
+
+
+MATCHUP_PRIOR = 2  # 先着率を 0.5 に寄せる際の事前同走数
+COMPACT_PAIRS = 100_000  # 差分がこのペア数を超えたら本体に統合して保存する
+_UNKNOWN_POSITION = BOAT_COUNT + 1  # 着順不明（失格・欠場など）は完走した艇より後ろとみなす
+
+
+def load_race_positions(db: Session, after_result_id: int = 0, before: Optional[date] = None,
+                        since: Optional[date] = None, through_result_id: Optional[int] = None) -> Dict:
+    """
+    結果ID が after_result_id より大きいレースの選手と着順をレース単位で取得
+
+    before / since を指定するとその日より前 / その日以降のレースだけ、through_result_id を指定すると
+    結果IDがそれ以下のレースだけを読む
+
+    Returns:
+        registration_nos: 艇番順の選手登録番号 (races, 6)。空き枠は None
+        positions: 艇番順の着順 (races, 6)。不明は 7
+        race_dates: 開催日の序数 (races,)
+        max_result_id: 読み込んだ結果IDの最大値（なければ after_result_id）
+    """
+    place_columns = [getattr(db_models.RaceResult, f"place_{i}") for i in range(1, BOAT_COUNT + 1)]
+    conditions = [
+        db_models.RaceResult.id > after_result_id,
+        db_models.RaceEntry.racer_registration_no.isnot(None),
+        db_models.RaceEntry.boat_no.between(1, BOAT_COUNT),
+    ]
+    if before is not None:
+        conditions.append(db_models.Race.race_date < before)
+    if since is not None:
+        conditions.append(db_models.Race.race_date >= since)
+    if through_result_id is not None:
+        conditions.append(db_models.RaceResult.id <= through_result_id)
+    rows = db.execute(
+        select(
+            db_models.RaceResult.id,
+            db_models.RaceEntry.racer_registration_no,
+            db_models.RaceEntry.boat_no,
+            db_models.Race.race_date,
+            *place_columns,
+        ).join(
+            db_models.RaceEntry, db_models.RaceEntry.race_id == db_models.RaceResult.race_id
+        ).join(
+            db_models.Race, db_models.Race.id == db_models.RaceResult.race_id
+        ).where(*conditions)
+    ).all()
+
+    result_ids, first, race = np.unique(
+        np.array([row[0] for row in rows], dtype=np.int64), return_index=True, return_inverse=True
+    )
+    boat_idx = np.array([row[2] for row in rows], dtype=int) - 1
+    places = np.array([[p or 0 for p in row[4:]] for row in rows], dtype=int).reshape(len(rows), BOAT_COUNT)
+    matches = places == (boat_idx + 1)[:, None]
+
+    registration_nos = np.full((len(result_ids), BOAT_COUNT), None, dtype=object)
+    registration_nos[race, boat_idx] = [row[1] for row in rows]
+    positions = np.full((len(result_ids), BOAT_COUNT), _UNKNOWN_POSITION)
+    positions[race, boat_idx] = np.where(matches.any(axis=1), matches.argmax(axis=1) + 1, _UNKNOWN_POSITION)
+    return {
+        "registration_nos": registration_nos,
+        "positions": positions,
+        "race_dates": np.array([rows[k][3].toordinal() for k in first], dtype=np.int64),
+        "max_result_id": int(result_ids.max()) if len(result_ids) else after_result_id,
+    }
+
+
+def race_pairs(racer_ids: np.ndarray, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    レースごとの同走ペアと先着の有無
+
+    Args:
+        racer_ids: 艇番順の選手の通し番号 (races, 6)。空き枠は -1
+        positions: 艇番順の着順 (races, 6)
+
+    Returns:
+        (選手i, 選手j, i が j に先着したか) の各 (n_pairs,)。i, j の両方向を含む
+    """
+    a, b = np.nonzero(~np.eye(BOAT_COUNT, dtype=bool))
+    i, j = racer_ids[:, a].ravel(), racer_ids[:, b].ravel()
+    ahead = (positions[:, a] < positions[:, b]).ravel()
+    both = (i >= 0) & (j >= 0)
+    return i[both], j[both], ahead[both]
+
+
+def _dated_pair_counts(racer_ids: np.ndarray, positions: np.ndarray, race_dates: np.ndarray,
+                       i: np.ndarray, j: np.ndarray, start: np.ndarray, stop: np.ndarray
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    履歴のレースのうち開催日が [start, stop) のものでの、選手ペア (i, j) の先着数・同走数
+
+    同走ペアを (ペア, 開催日) の昇順に並べて先着数の累積和を取り、各ペアの期間を二分探索で数える。
+
+    Args:
+        racer_ids, positions: 履歴のレースの艇番順の選手の通し番号（空き枠は -1）・着順 (races, 6)
+        race_dates: 履歴のレースの開催日の序数 (races,)
+        i, j: 数えるペアの選手の通し番号（-1 は 0件）。start, stop は開催日の序数で、いずれも同じ形
+
+    Returns:
+        (先着数, 同走数) それぞれ i と同じ形
+    """
+    a, b = np.nonzero(~np.eye(BOAT_COUNT, dtype=bool))
+    pi, pj = racer_ids[:, a], racer_ids[:, b]
+    both = (pi >= 0) & (pj >= 0)
+    n_racers = int(max(racer_ids.max(initial=-1), i.max(initial=-1), j.max(initial=-1))) + 1
+    pair_dates = np.broadcast_to(race_dates[:, None], pi.shape)[both]
+    first_date = pair_dates.min() if len(pair_dates) else 0
+    span = (pair_dates.max() - first_date if len(pair_dates) else 0) + 2
+    keys = (pi[both] * n_racers + pj[both]) * span + (pair_dates - first_date)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    ahead_total = np.r_[0, np.cumsum((positions[:, a] < positions[:, b])[both][order])]
+
+    # 期間の端を履歴の日付の範囲に丸めて、ペアごとの区間 [pair * span, (pair + 1) * span) に収める
+    valid = (i >= 0) & (j >= 0)
+    pair_start = (i * n_racers + j) * span
+    lo = np.searchsorted(keys, pair_start + np.clip(start - first_date, 0, span - 1))
+    hi = np.maximum(np.searchsorted(keys, pair_start + np.clip(stop - first_date, 0, span - 1)), lo)
+    return np.where(valid, ahead_total[hi] - ahead_total[lo], 0), np.where(valid, hi - lo, 0)
+
+
+def point_in_time_field_score(db: Session, race_id: np.ndarray, race_date: np.ndarray,
+                              registration_no: Sequence[str], boat_no: np.ndarray) -> np.ndarray:
+    """
+    学習データの各行の field_score（他の5艇に対する先着率の平均）をレース前日までの対戦成績で計算
+
+    MatchupMatrix.race_features_before と同じく、開催日より前の結果だけを数える。
+    履歴は最も新しい行の開催日より前の分だけを1回読む。
+
+    Args:
+        race_id: 各行のレースID (n_rows,)
+        race_date: 各行の開催日の序数 (n_rows,)
+        registration_no: 各行の選手登録番号 (n_rows,)。不明は None
+        boat_no: 各行の艇番 (n_rows,)
+
+    Returns:
+        field_score (n_rows,)
+    """
+    race_date = np.asarray(race_date, dtype=np.int64)
+    if len(race_date) == 0:
+        return np.zeros(0)
+    history = load_race_positions(db, before=date.fromordinal(int(race_date.max())))
+    index = {
+        reg: k for k, reg in enumerate(dict.fromkeys(r for r in history["registration_nos"].ravel() if r is not None))
+    }
+    racer_ids = np.array(
+        [index.get(reg, -1) for reg in history["registration_nos"].ravel()], dtype=np.int64
+    ).reshape(history["registration_nos"].shape)
+
+    # 各行 × 同じレースの6艇（自艇は後で除く）
+    _, race = np.unique(race_id, return_inverse=True)
+    boat_idx = np.asarray(boat_no, dtype=np.int64) - 1
+    row_ids = np.array([index.get(reg, -1) for reg in registration_no], dtype=np.int64)
+    grid = np.full((race.max() + 1, BOAT_COUNT), -1, dtype=np.int64)
+    in_range = (boat_idx >= 0) & (boat_idx < BOAT_COUNT)
+    grid[race[in_range], boat_idx[in_range]] = row_ids[in_range]
+    opponents = grid[race]
+    own = np.broadcast_to(row_ids[:, None], opponents.shape)
+    ahead, meetings = _dated_pair_counts(
+        racer_ids, history["positions"], history["race_dates"], own, opponents,
+        np.zeros(opponents.shape, dtype=np.int64), np.broadcast_to(race_date[:, None], opponents.shape),
+    )
+
+    ahead_rate = (ahead + MATCHUP_PRIOR / 2) / (meetings + MATCHUP_PRIOR)
+    rows = np.nonzero(in_range)[0]
+    ahead_rate[rows, boat_idx[rows]] = np.nan
+    return np.nanmean(ahead_rate, axis=1)
+
+
+class MatchupMatrix:
+    """
+    選手 × 選手の同走数・先着数を CSR 形式の疎行列で保持する
+
+    本体は行ポインタ・列番号・件数の .npy を世代ごとのディレクトリに保存し、
+    起動時に memory-map で開く。新しい結果は結果IDのウォーターマーク以降だけを
+    読み込んでメモリ上の差分（ペア → 件数）に加え、参照時は本体と差分を合算する。
+    差分が COMPACT_PAIRS を超えたとき・保存時に本体へ統合して新しい世代を書き出す。
+    """
+
+    MATCHUP_DIR = "ml/data/matchups"
+
+    def __init__(self, base_dir: Optional[str] = None):
+        self.root = base_dir or self.MATCHUP_DIR
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+        self._racers: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._counts = np.zeros((0, 2), dtype=np.int32)  # [先着数, 同走数]
+        self._delta: Dict[Tuple[int, int], List[int]] = {}
+        self.generation: Optional[str] = None
+        self.max_result_id = 0
+        self.loaded = False
+        self._lock = threading.RLock()
+
+    # ---------- 保存・読み込み ----------
+
+    def _read_manifest(self) -> Optional[Dict]:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        return None
+
+    def load(self) -> bool:
+        """保存済みの本体を memory-map で開く（なければ False）"""
+        manifest = self._read_manifest()
+        if manifest is None:
+            return False
+        generation_dir = os.path.join(self.root, manifest["generation"])
+        arrays = {
+            name: np.load(os.path.join(generation_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ("indptr", "indices", "counts")
+        }
+        racers = [str(r) for r in np.load(os.path.join(generation_dir, "racers.npy"))]
+        with self._lock:
+            self._racers = racers
+            self._index = {reg: k for k, reg in enumerate(racers)}
+            self._indptr, self._indices, self._counts = arrays["indptr"], arrays["indices"], arrays["counts"]
+            self._delta = {}
+            self.generation = manifest["generation"]
+            self.max_result_id = manifest["max_result_id"]
+            self.loaded = True
+        return True
+
+    def _write(self, indptr: np.ndarray, indices: np.ndarray, counts: np.ndarray,
+               racers: List[str], max_result_id: int):
+        """新しい世代を一時ディレクトリに書いてから置き換え、マニフェストを更新"""
+        previous = self._read_manifest()
+        generation = f"g{max_result_id}-{int(time.time() * 1000)}"
+        final_dir = os.path.join(self.root, generation)
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, "indptr.npy"), indptr)
+        np.save(os.path.join(tmp_dir, "indices.npy"), indices)
+        np.save(os.path.join(tmp_dir, "counts.npy"), counts)
+        np.save(os.path.join(tmp_dir, "racers.npy"), np.array(racers, dtype=str))
+        os.replace(tmp_dir, final_dir)
+
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "generation": generation,
+                "max_result_id": max_result_id,
+                "racers": len(racers),
+                "pairs": int(len(indices)),
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+        # 旧世代は memory-map 中で消せない環境もあるので失敗しても次回に回す
+        if previous is not None and previous["generation"] != generation:
+            shutil.rmtree(os.path.join(self.root, previous["generation"]), ignore_errors=True)
+
+    def _build(self, rows: np.ndarray, cols: np.ndarray, counts: np.ndarray, n_racers: int):
+        """(行, 列, 件数) の組から CSR を作る（同じペアは合算）"""
+        keys, inverse = np.unique(rows.astype(np.int64) * n_racers + cols, return_inverse=True)
+        summed = np.zeros((len(keys), 2), dtype=np.int64)
+        np.add.at(summed, inverse, counts)
+        indptr = np.searchsorted(keys // max(n_racers, 1), np.arange(n_racers + 1)).astype(np.int64)
+        return indptr, (keys % max(n_racers, 1)).astype(np.int32), summed.astype(np.int32)
+
+    def rebuild(self, db: Session) -> int:
+        """全結果から作り直して保存し、memory-map で開き直す（ペア数を返す）"""
+        races = load_race_positions(db)
+        racers = list(dict.fromkeys(r for r in races["registration_nos"].ravel() if r is not None))
+        index = {reg: k for k, reg in enumerate(racers)}
+        racer_ids = self._racer_ids(races["registration_nos"], index)
+        i, j, ahead = race_pairs(racer_ids, races["positions"])
+        indptr, indices, counts = self._build(
+            i, j, np.column_stack([ahead, np.ones(len(i))]).astype(np.int64), len(racers)
+        )
+        self._write(indptr, indices, counts, racers, races["max_result_id"])
+        self.load()
+        return len(indices)
+
+    def compact(self):
+        """差分を本体に統合して新しい世代として保存する（差分がなければ何もしない）"""
+        with self._lock:
+            if not self.loaded or not self._delta:
+                return
+            n_racers = len(self._racers)
+            n_rows = len(self._indptr) - 1
+            rows = np.repeat(np.arange(n_rows), np.diff(self._indptr))
+            if self._delta:
+                delta_pairs = np.array(list(self._delta.keys()), dtype=np.int64)
+                delta_counts = np.array(list(self._delta.values()), dtype=np.int64)
+            else:
+                delta_pairs = np.zeros((0, 2), dtype=np.int64)
+                delta_counts = np.zeros((0, 2), dtype=np.int64)
+            indptr, indices, counts = self._build(
+                np.r_[rows, delta_pairs[:, 0]],
+                np.r_[np.asarray(self._indices, dtype=np.int64), delta_pairs[:, 1]],
+                np.r_[np.asarray(self._counts, dtype=np.int64), delta_counts],
+                n_racers,
+            )
+            self._write(indptr, indices, counts, list(self._racers), self.max_result_id)
+            self.load()
+
+    def ensure_loaded(self, db: Session):
+        """保存済みの本体を開き（なければ作成し）、その後の結果を反映する"""
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            if not self.load():
+                self.rebuild(db)
+            self.refresh(db)
+
+    @property
+    def state_token(self) -> str:
+        """予想キャッシュのキーに含める状態（読み込んだ本体の世代と、差分に反映済みの最大結果ID）"""
+        with self._lock:
+            if not self.loaded:
+                return "matchup-none"
+            return f"{self.generation}+{self.max_result_id}"
+
+    # ---------- 更新 ----------
+
+    def _racer_ids(self, registration_nos: np.ndarray, index: Dict[str, int]) -> np.ndarray:
+        return np.array(
+            [index.get(reg, -1) for reg in registration_nos.ravel()], dtype=np.int64
+        ).reshape(registration_nos.shape)
+
+    def refresh(self, db: Session) -> int:
+        """前回以降に追加された結果を差分に加える（加えたレース数を返す）"""
+        if not self.loaded:
+            self.ensure_loaded(db)
+            return 0
+        with self._lock:
+            races = load_race_positions(db, self.max_result_id)
+            for reg in races["registration_nos"].ravel():
+                if reg is not None and reg not in self._index:
+                    self._index[reg] = len(self._racers)
+                    self._racers.append(reg)
+            racer_ids = self._racer_ids(races["registration_nos"], self._index)
+            for i, j, ahead in zip(*race_pairs(racer_ids, races["positions"])):
+                counts = self._delta.setdefault((int(i), int(j)), [0, 0])
+                counts[0] += int(ahead)
+                counts[1] += 1
+            self.max_result_id = races["max_result_id"]
+            if len(self._delta) > COMPACT_PAIRS:
+                self.compact()
+        return len(races["positions"])
+
+    # ---------- 参照 ----------
+
+    def _lookup(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        """選手ペア (i, j) の [先着数, 同走数] (n, 2)。未登録の選手は -1"""
+        with self._lock:
+            indptr, indices, counts, delta = self._indptr, self._indices, self._counts, self._delta
+            n_rows = len(indptr) - 1
+            valid = (i >= 0) & (j >= 0) & (i < n_rows)
+            row = np.where(valid, i, 0)
+            lo, hi = indptr[row].copy(), indptr[row + 1].copy()
+            hi[~valid] = lo[~valid]
+            # 行内の列番号は昇順なので全ペアを同時に二分探索する
+            while True:
+                active = lo < hi
+                if not active.any():
+                    break
+                mid = (lo + hi) // 2
+                less = np.zeros(len(mid), dtype=bool)
+                less[active] = indices[mid[active]] < j[active]
+                lo = np.where(active & less, mid + 1, lo)
+                hi = np.where(active & ~less, mid, hi)
+            found = valid & (lo < indptr[row + 1]) & (lo < len(indices))
+            found[found] = indices[lo[found]] == j[found]
+            result = np.zeros((len(i), 2), dtype=np.int64)
+            result[found] = counts[lo[found]]
+            if delta:
+                for k, pair in enumerate(zip(i.tolist(), j.tolist())):
+                    extra = delta.get(pair)
+                    if extra is not None:
+                        result[k] += extra
+        return result
+
+    def pair(self, registration_no: str, opponent_no: str) -> Dict:
+        """2選手の対戦成績（registration_no から見た先着数・先着率）"""
+        ids = np.array([self._index.get(registration_no, -1), self._index.get(opponent_no, -1)])
+        counts = self._lookup(ids[[0, 1]], ids[[1, 0]])
+        meetings = int(counts[0, 1])
+        return {
+            "registration_no": registration_no,
+            "opponent_no": opponent_no,
+            "meetings": meetings,
+            "ahead": int(counts[0, 0]),
+            "behind": int(counts[1, 0]),
+            "ahead_rate": float((counts[0, 0] + MATCHUP_PRIOR / 2) / (meetings + MATCHUP_PRIOR)),
+        }
+
+    def race_features(self, registration_nos: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        複数レースの出走選手同士の対戦成績を一括で取得
+
+        Args:
+            registration_nos: 艇番順の選手登録番号 (races, 6)。空き枠は None
+
+        Returns:
+            ahead, meetings: 艇 i の艇 j に対する先着数・同走数 (races, 6, 6)
+            ahead_rate: 同走数に応じて 0.5 に寄せた先着率 (races, 6, 6)。対角は NaN
+            field_score: 他の5艇に対する先着率の平均 (races, 6)
+        """
+        races = registration_nos.shape[0]
+        with self._lock:
+            ids = self._racer_ids(np.asarray(registration_nos, dtype=object), self._index)
+        a, b = np.nonzero(~np.eye(BOAT_COUNT, dtype=bool))
+        counts = self._lookup(ids[:, a].ravel(), ids[:, b].ravel()).reshape(races, len(a), 2)
+
+        ahead = np.zeros((races, BOAT_COUNT, BOAT_COUNT), dtype=np.int64)
+        meetings = np.zeros((races, BOAT_COUNT, BOAT_COUNT), dtype=np.int64)
+        ahead[:, a, b] = counts[:, :, 0]
+        meetings[:, a, b] = counts[:, :, 1]
+        ahead_rate = (ahead + MATCHUP_PRIOR / 2) / (meetings + MATCHUP_PRIOR)
+        ahead_rate[:, np.arange(BOAT_COUNT), np.arange(BOAT_COUNT)] = np.nan
+        return {
+            "ahead": ahead,
+            "meetings": meetings,
+            "ahead_rate": ahead_rate,
+            "field_score": np.nanmean(ahead_rate, axis=2),
+        }
+
+    def race_features_before(self, db: Session, registration_nos: np.ndarray,
+                             race_dates: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        race_features と同じ値を、各レースの開催日より前の結果だけで計算する（予想用）
+
+        疎行列は当日に確定した結果（予想するレース自身の結果を含む）まで数えているので、
+        反映済みの結果のうち開催日がそのレースの開催日以降のものを差し引き、
+        学習データ（point_in_time_field_score）と同じ時点の対戦成績にそろえる。
+
+        Args:
+            registration_nos: 艇番順の選手登録番号 (races, 6)。空き枠は None
+            race_dates: 各レースの開催日の序数 (races,)
+        """
+        race_dates = np.asarray(race_dates, dtype=np.int64)
+        # 差し引く結果が疎行列に反映済みの範囲と食い違わないよう、refresh と排他にする
+        with self._lock:
+            features = self.race_features(registration_nos)
+            if len(race_dates) == 0:
+                return features
+            recent = load_race_positions(
+                db, since=date.fromordinal(int(race_dates.min())), through_result_id=self.max_result_id
+            )
+            if len(recent["positions"]) == 0:
+                return features
+            ids = self._racer_ids(np.asarray(registration_nos, dtype=object), self._index)
+            recent_ids = self._racer_ids(recent["registration_nos"], self._index)
+
+        races = len(race_dates)
+        a, b = np.nonzero(~np.eye(BOAT_COUNT, dtype=bool))
+        start = np.broadcast_to(race_dates[:, None], (races, len(a)))
+        ahead, meetings = _dated_pair_counts(
+            recent_ids, recent["positions"], recent["race_dates"], ids[:, a], ids[:, b],
+            start, np.full(start.shape, np.iinfo(np.int64).max // 2),
+        )
+        features["ahead"][:, a, b] -= ahead
+        features["meetings"][:, a, b] -= meetings
+        ahead_rate = (features["ahead"] + MATCHUP_PRIOR / 2) / (features["meetings"] + MATCHUP_PRIOR)
+        ahead_rate[:, np.arange(BOAT_COUNT), np.arange(BOAT_COUNT)] = np.nan
+        features["ahead_rate"] = ahead_rate
+        features["field_score"] = np.nanmean(ahead_rate, axis=2)
+        return features
+
+    def race_card(self, entries: Sequence) -> Dict[str, np.ndarray]:
+        """1レース分の出走表から race_features を計算"""
+        registration_nos = np.full((1, BOAT_COUNT), None, dtype=object)
+        for entry in entries:
+            if 1 <= entry.boat_no <= BOAT_COUNT:
+                registration_nos[0, entry.boat_no - 1] = entry.racer_registration_no
+        return {name: values[0] for name, values in self.race_features(registration_nos).items()}
+
+
+matchup_matrix = MatchupMatrix()
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Racer head-to-head matchup matrix")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute the matrix from the full result history")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        pairs = matchup_matrix.rebuild(db)
+        print(f"Rebuilt {pairs} racer pairs ({len(matchup_matrix._racers)} racers) "
+              f"in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
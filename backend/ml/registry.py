@@ -0,0 +1,138 @@
+"""学習済みモデルのレジストリ（バージョン管理）"""
+import os
+import json
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import joblib
+
+
+class ModelRegistry:
+    """
+    学習済みモデルをバージョンごとのディレクトリとマニフェストで管理する
+
+    <base_dir>/<version>/model.joblib に統合モデルを置き、manifest.json に
+    各バージョンのメタデータ・評価指標と、昇格済み (active)・固定 (pinned) の
+    バージョンを記録する。推論で使うのは pinned があればそれ、なければ active。
+    """
+
+    REGISTRY_DIR = "ml/models/registry"
+    MODEL_FILE = "model.joblib"
+
+    def __init__(self, base_dir: Optional[str] = None):
+        self.base_dir = base_dir or self.REGISTRY_DIR
+        self.manifest_path = os.path.join(self.base_dir, "manifest.json")
+        self._lock = threading.Lock()
+
+    def read_manifest(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"active": None, "pinned": None, "versions": {}}
+
+    def _write_manifest(self, manifest: Dict):
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_path = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def manifest_mtime(self) -> Optional[float]:
+        """マニフェストの更新時刻（変更検知用）"""
+        return os.path.getmtime(self.manifest_path) if os.path.exists(self.manifest_path) else None
+
+    def _new_version(self, manifest: Dict) -> str:
+        version = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = 1
+        candidate = version
+        while candidate in manifest["versions"] or os.path.exists(os.path.join(self.base_dir, candidate)):
+            suffix += 1
+            candidate = f"{version}_{suffix}"
+        return candidate
+
+    def register(self, bundle: Dict, metrics: Optional[Dict[str, float]] = None,
+                 promote: bool = True, note: Optional[str] = None) -> str:
+        """
+        統合モデルを新しいバージョンとして登録
+
+        Args:
+            bundle: ml.train の統合モデル
+            metrics: 評価指標（win_logloss など）
+            promote: 登録と同時に active にするか
+
+        Returns:
+            登録したバージョン
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            version = self._new_version(manifest)
+
+            # モデルファイルを書き終えてからマニフェストに載せる
+            version_dir = os.path.join(self.base_dir, version)
+            tmp_dir = f"{version_dir}.tmp-{os.getpid()}"
+            os.makedirs(tmp_dir, exist_ok=True)
+            joblib.dump(bundle, os.path.join(tmp_dir, self.MODEL_FILE))
+            os.replace(tmp_dir, version_dir)
+
+            manifest["versions"][version] = {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "model_type": bundle.get("model_type", "binary"),
+                "feature_version": bundle.get("feature_version"),
+                "trained_at": bundle.get("trained_at"),
+                "trained_through": bundle.get("trained_through"),
+                "incremental_updates": bundle.get("incremental_updates", 0),
+                "params": bundle.get("params"),
+                "metrics": metrics or {},
+                "note": note,
+            }
+            if promote:
+                manifest["active"] = version
+            self._write_manifest(manifest)
+        return version
+
+    def list_versions(self) -> List[Dict]:
+        """登録済みバージョンの一覧（新しい順）"""
+        manifest = self.read_manifest()
+        return [
+            {"version": version, **meta}
+            for version, meta in sorted(manifest["versions"].items(), reverse=True)
+        ]
+
+    def current_version(self) -> Optional[str]:
+        """推論に使うバージョン（pinned があればそれ、なければ active）"""
+        manifest = self.read_manifest()
+        return manifest.get("pinned") or manifest.get("active")
+
+    def active_version(self) -> Optional[str]:
+        return self.read_manifest().get("active")
+
+    def model_path(self, version: str) -> str:
+        return os.path.join(self.base_dir, version, self.MODEL_FILE)
+
+    def load(self, version: str) -> Dict:
+        """指定バージョンの統合モデルを読み込む"""
+        if version not in self.read_manifest()["versions"]:
+            raise KeyError(f"Unknown model version: {version}")
+        return joblib.load(self.model_path(version))
+
+    def _update(self, **changes):
+        with self._lock:
+            manifest = self.read_manifest()
+            for key, version in changes.items():
+                if version is not None and version not in manifest["versions"]:
+                    raise KeyError(f"Unknown model version: {version}")
+                manifest[key] = version
+            self._write_manifest(manifest)
+
+    def pin(self, version: str):
+        """指定バージョンに固定（以後の昇格より優先）"""
+        self._update(pinned=version)
+
+    def unpin(self):
+        """固定を解除して active に戻す"""
+        self._update(pinned=None)
+
+    def promote(self, version: str):
+        """指定バージョンを active にする"""
+        self._update(active=version)
@@ -0,0 +1,357 @@
+"""過去の出走表から似たレースを探す近傍探索インデックス
+
+使い方:
+    cd backend
+    python -m ml.similar_races --rebuild
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import db_models
+from app.prediction.betting import BOAT_COUNT
+
+
+# 艇ごとの特徴（艇番順に並べる）とレース条件
+BOAT_FEATURES = ["win_rate_all", "motor_rate_2", "boat_rate_2", "avg_start_timing"]
+CONDITION_FEATURES = ["wind_speed", "wave_height", "water_temp"]
+VENUE_COUNT = 24
+VENUE_WEIGHT = 2.0  # 会場が違うレースとの距離（標準化した特徴量の単位）
+BRUTE_FORCE_ROWS = 20_000  # これより少なければリストに分けず総当たりする
+KMEANS_SAMPLE_ROWS = 100_000  # リストの中心を決める k-means の学習に使う行数
+N_PROBE = 8  # 検索時に調べるリストの数
+MERGE_MIN_ROWS = 10_000  # 追加分がこの件数と本体の1割の大きい方を超えたらリストへ振り分ける
+REFIT_GROWTH = 2.0  # 振り分け時に、前回の作成からこの倍率以上に増えていれば作り直す
+
+
+def load_race_vectors(db: Session, race_ids: Optional[Sequence[int]] = None,
+                      after_result_id: int = 0) -> Dict:
+    """
+    レースの特徴量（標準化前）を取得
+
+    race_ids を指定した場合は結果の有無によらずそのレースを、省略した場合は
+    結果ID が after_result_id より大きい結果のあるレースを読み込む。
+
+    Returns:
+        race_ids: (n,)
+        raw: 艇ごとの特徴 (6艇 × BOAT_FEATURES) とレース条件の行列 (n, d)。欠損は NaN
+        venue: 会場コードの番号 1-24（不明は0） (n,)
+        max_result_id: 読み込んだ結果IDの最大値（なければ after_result_id）
+    """
+    stmt = select(
+        db_models.Race.id,
+        db_models.Race.venue_code,
+        *[getattr(db_models.Race, name) for name in CONDITION_FEATURES],
+        db_models.RaceEntry.boat_no,
+        *[getattr(db_models.RaceEntry, name) for name in BOAT_FEATURES],
+        db_models.RaceResult.id,
+    ).join(
+        db_models.RaceEntry, db_models.RaceEntry.race_id == db_models.Race.id
+    ).where(
+        db_models.RaceEntry.boat_no.between(1, BOAT_COUNT)
+    )
+    if race_ids is not None:
+        stmt = stmt.outerjoin(
+            db_models.RaceResult, db_models.RaceResult.race_id == db_models.Race.id
+        ).where(db_models.Race.id.in_(list(race_ids)))
+    else:
+        stmt = stmt.join(
+            db_models.RaceResult, db_models.RaceResult.race_id == db_models.Race.id
+        ).where(db_models.RaceResult.id > after_result_id)
+    rows = db.execute(stmt).all()
+
+    n_conditions, n_boat = len(CONDITION_FEATURES), len(BOAT_FEATURES)
+    ids, race = np.unique(np.array([row[0] for row in rows], dtype=np.int64), return_inverse=True)
+    values = np.array(
+        [row[2:3 + n_conditions + n_boat] for row in rows], dtype=float
+    ).reshape(len(rows), 1 + n_conditions + n_boat)
+    boat_idx = values[:, n_conditions].astype(int) - 1
+
+    raw = np.full((len(ids), BOAT_COUNT * n_boat + n_conditions), np.nan)
+    boat_values = values[:, n_conditions + 1:]
+    st = BOAT_FEATURES.index("avg_start_timing")
+    boat_values[~(boat_values[:, st] > 0), st] = np.nan  # 平均STの0は未取得
+    for f in range(n_boat):
+        raw[race, boat_idx * n_boat + f] = boat_values[:, f]
+    raw[race, BOAT_COUNT * n_boat:] = values[:, :n_conditions]
+
+    venue = np.zeros(len(ids), dtype=int)
+    for row, r in zip(rows, race):
+        code = row[1]
+        venue[r] = int(code) if code and code.isdigit() and 1 <= int(code) <= VENUE_COUNT else 0
+    result_ids = [row[-1] for row in rows if row[-1] is not None]
+    return {
+        "race_ids": ids,
+        "raw": raw,
+        "venue": venue,
+        "max_result_id": max(result_ids, default=after_result_id),
+    }
+
+
+class SimilarRaceIndex:
+    """
+    結果のあるレースを特徴量ベクトルにして近傍探索する（転置リスト方式）
+
+    艇番順の勝率・モーター/ボート2連率・平均STとレース条件を全レースの平均・
+    標準偏差で標準化し（欠損は平均扱い）、会場の one-hot を VENUE_WEIGHT 倍して
+    連結したベクトルのユークリッド距離で比べる。
+
+    ベクトルを k-means のクラスタ（リスト）ごとに並べて保存し、検索時はクエリに
+    近い n_probe 個のリストの中だけを総当たりする（近似検索。リストが1つなら厳密）。
+    新しい結果は結果IDのウォーターマーク以降だけを読み込んで追加分の配列に積み、
+    検索時は追加分も総当たりする。追加分が大きくなったらリストへ振り分けて保存する。
+    振り分けの際、総当たりの件数 BRUTE_FORCE_ROWS を超えたか前回の作成から REFIT_GROWTH 倍に
+    増えていれば、標準化の統計量とリストの中心を決め直すため全レースから作り直す。
+    """
+
+    INDEX_PATH = "ml/data/similar_races.joblib"
+
+    def __init__(self, path: Optional[str] = None, n_probe: int = N_PROBE):
+        self.path = path or self.INDEX_PATH
+        self.n_probe = n_probe
+        self._centroids = np.zeros((0, self.dimension))
+        self._offsets = np.zeros(1, dtype=np.int64)  # リスト l の行は offsets[l]:offsets[l+1]
+        self._vectors = np.zeros((0, self.dimension))
+        self._race_ids = np.zeros(0, dtype=np.int64)
+        self._extra_vectors = np.zeros((0, self.dimension))
+        self._extra_ids = np.zeros(0, dtype=np.int64)
+        self._mean = np.zeros(BOAT_COUNT * len(BOAT_FEATURES) + len(CONDITION_FEATURES))
+        self._std = np.ones_like(self._mean)
+        self.max_result_id = 0
+        self.fitted_rows = 0  # 標準化の統計量とリストの中心を決めたときのレース数
+        self.loaded = False
+        self._lock = threading.RLock()
+
+    @property
+    def dimension(self) -> int:
+        return BOAT_COUNT * len(BOAT_FEATURES) + len(CONDITION_FEATURES) + VENUE_COUNT
+
+    @property
+    def size(self) -> int:
+        return len(self._race_ids) + len(self._extra_ids)
+
+    def vectors(self, raw: np.ndarray, venue: np.ndarray) -> np.ndarray:
+        """標準化した特徴量と会場の one-hot を連結 (n, dimension)"""
+        scaled = np.nan_to_num((raw - self._mean) / self._std)
+        venues = np.zeros((len(venue), VENUE_COUNT))
+        known = venue > 0
+        venues[np.flatnonzero(known), venue[known] - 1] = VENUE_WEIGHT
+        return np.hstack([scaled, venues])
+
+    # ---------- 作成・保存 ----------
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """各ベクトルに最も近いリストの番号"""
+        labels = np.zeros(len(vectors), dtype=np.int64)
+        squared = (centroids ** 2).sum(axis=1)
+        for start in range(0, len(vectors), 65_536):
+            chunk = vectors[start:start + 65_536]
+            labels[start:start + len(chunk)] = (squared - 2 * chunk @ centroids.T).argmin(axis=1)
+        return labels
+
+    def _set_lists(self, vectors: np.ndarray, race_ids: np.ndarray, centroids: np.ndarray):
+        """ベクトルをリスト順に並べ替えて本体にする（追加分は空にする）"""
+        labels = self._assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        self._centroids = centroids
+        self._offsets = np.searchsorted(labels[order], np.arange(len(centroids) + 1)).astype(np.int64)
+        self._vectors = vectors[order]
+        self._race_ids = race_ids[order]
+        self._extra_vectors = np.zeros((0, self.dimension))
+        self._extra_ids = np.zeros(0, dtype=np.int64)
+
+    def _fit_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        """k-means でリストの中心を決める（少なければリスト1つ = 総当たり）"""
+        if len(vectors) < BRUTE_FORCE_ROWS:
+            return vectors.mean(axis=0, keepdims=True) if len(vectors) else np.zeros((1, self.dimension))
+        n_lists = int(np.sqrt(len(vectors)))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE_ROWS), replace=False)]
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=4096, n_init=1, random_state=0)
+        return kmeans.fit(sample).cluster_centers_
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            joblib.dump({
+                "centroids": self._centroids,
+                "offsets": self._offsets,
+                "vectors": self._vectors,
+                "race_ids": self._race_ids,
+                "mean": self._mean,
+                "std": self._std,
+                "max_result_id": self.max_result_id,
+                "fitted_rows": self.fitted_rows,
+            }, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> bool:
+        """保存済みのインデックスを memory-map で開く（なければ False）"""
+        if not os.path.exists(self.path):
+            return False
+        state = joblib.load(self.path, mmap_mode="r")
+        with self._lock:
+            self._mean, self._std = np.asarray(state["mean"]), np.asarray(state["std"])
+            self._centroids = np.asarray(state["centroids"])
+            self._offsets = np.asarray(state["offsets"])
+            self._vectors, self._race_ids = state["vectors"], state["race_ids"]
+            self._extra_vectors = np.zeros((0, self.dimension))
+            self._extra_ids = np.zeros(0, dtype=np.int64)
+            self.max_result_id = state["max_result_id"]
+            self.fitted_rows = state.get("fitted_rows", len(self._race_ids))
+            self.loaded = True
+        return True
+
+    def rebuild(self, db: Session) -> int:
+        """結果のある全レースから作り直して保存（登録したレース数を返す）"""
+        races = load_race_vectors(db)
+        with self._lock:
+            if len(races["race_ids"]):
+                # 全レースで欠損の列は平均0・標準偏差1のまま
+                known = ~np.isnan(races["raw"])
+                count = np.maximum(known.sum(axis=0), 1)
+                values = np.where(known, races["raw"], 0.0)
+                self._mean = values.sum(axis=0) / count
+                var = (np.where(known, races["raw"] - self._mean, 0.0) ** 2).sum(axis=0) / count
+                self._std = np.where(var > 0, np.sqrt(var), 1.0)
+            vectors = self.vectors(races["raw"], races["venue"])
+            self._set_lists(vectors, races["race_ids"], self._fit_centroids(vectors))
+            self.max_result_id = races["max_result_id"]
+            self.fitted_rows = len(races["race_ids"])
+            self.loaded = True
+            self.save()
+        return len(races["race_ids"])
+
+    def _needs_refit(self) -> bool:
+        """作成時の統計量・リストの中心が今の件数に合わなくなったか"""
+        crossed = self.fitted_rows < BRUTE_FORCE_ROWS <= self.size
+        return crossed or self.size >= REFIT_GROWTH * max(self.fitted_rows, 1)
+
+    def _merge(self, db: Session):
+        """
+        追加分をリストへ振り分けて保存
+
+        リストの中心・標準化の統計量は作成時のままにするが、件数が大きく変わっていれば作り直す
+        """
+        if self._needs_refit():
+            self.rebuild(db)
+            return
+        self._set_lists(
+            np.vstack([self._vectors, self._extra_vectors]),
+            np.r_[self._race_ids, self._extra_ids],
+            self._centroids,
+        )
+        self.save()
+
+    def ensure_loaded(self, db: Session):
+        """保存済みのインデックスを読み込み（なければ作成し）、その後の結果を反映する"""
+        if self.loaded:
+            return
+        with self._lock:
+            if self.loaded:
+                return
+            if not self.load():
+                self.rebuild(db)
+            self.refresh(db)
+
+    def refresh(self, db: Session) -> int:
+        """前回以降に結果が追加されたレースを追加分に積む（追加したレース数を返す）"""
+        if not self.loaded:
+            self.ensure_loaded(db)
+            return 0
+        with self._lock:
+            races = load_race_vectors(db, after_result_id=self.max_result_id)
+            if len(races["race_ids"]):
+                self._extra_vectors = np.vstack([self._extra_vectors, self.vectors(races["raw"], races["venue"])])
+                self._extra_ids = np.r_[self._extra_ids, races["race_ids"]]
+            self.max_result_id = races["max_result_id"]
+            if len(self._extra_ids) > max(MERGE_MIN_ROWS, len(self._race_ids) // 10):
+                self._merge(db)
+        return len(races["race_ids"])
+
+    # ---------- 検索 ----------
+
+    def query(self, vectors: np.ndarray, k: int = 10,
+              exclude: Optional[Sequence[int]] = None) -> List[List[Tuple[int, float]]]:
+        """
+        各ベクトルに近いレースを距離の近い順に k 件ずつ
+
+        Args:
+            vectors: (n, dimension)
+            exclude: 各ベクトルについて結果から除くレースID (n,)（自分自身など）
+
+        Returns:
+            [(レースID, 距離), ...] のリスト (n 件)
+        """
+        exclude = [None] * len(vectors) if exclude is None else list(exclude)
+        with self._lock:
+            centroids, offsets = self._centroids, self._offsets
+            base_vectors, base_ids = self._vectors, self._race_ids
+            extra_vectors, extra_ids = self._extra_vectors, self._extra_ids
+
+        n_probe = min(self.n_probe, len(centroids))
+        matches = []
+        for q, excluded in zip(vectors, exclude):
+            # クエリに近いリストの行と追加分が候補
+            probe = np.argpartition(((centroids - q) ** 2).sum(axis=1), n_probe - 1)[:n_probe]
+            sizes = offsets[probe + 1] - offsets[probe]
+            rows = np.repeat(offsets[probe] - np.r_[0, np.cumsum(sizes)[:-1]], sizes) + np.arange(sizes.sum())
+            candidates = np.vstack([base_vectors[rows], extra_vectors])
+            ids = np.r_[base_ids[rows], extra_ids]
+
+            dist = np.sqrt(((candidates - q) ** 2).sum(axis=1))
+            keep = ids != excluded if excluded is not None else np.ones(len(ids), dtype=bool)
+            dist, ids = dist[keep], ids[keep]
+            top = np.argpartition(dist, k)[:k] if len(dist) > k else np.arange(len(dist))
+            top = top[np.argsort(dist[top], kind="stable")]
+            matches.append([(int(ids[t]), float(dist[t])) for t in top])
+        return matches
+
+    def similar(self, db: Session, race_id: int, k: int = 10) -> Optional[List[Tuple[int, float]]]:
+        """レースに似た過去のレース (レースID, 距離) を k 件（出走表がなければ None）"""
+        self.ensure_loaded(db)
+        races = load_race_vectors(db, race_ids=[race_id])
+        if len(races["race_ids"]) == 0:
+            return None
+        return self.query(self.vectors(races["raw"], races["venue"]), k, exclude=[race_id])[0]
+
+
+similar_race_index = SimilarRaceIndex()
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Similar-race nearest-neighbour index")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="rebuild the index from all races with results")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        races = similar_race_index.rebuild(db)
+        print(f"Indexed {races} races in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""学習データセットのスナップショット（月別パーティション）"""
+import os
+import json
+import shutil
+from datetime import date
+from typing import Dict, Optional
+
+import numpy as np
+from sqlalchemy import Date, Integer, String, case, cast, func
+from sqlalchemy.orm import Session
+
+from app.models import db_models
+from ml.features import FEATURE_VERSION, FEATURE_NAMES, RAW_COLUMNS, RANK_MAP, DEFAULT_RANK
+from ml.dataset import load_training_arrays
+from ml.matchup import MATCHUP_PRIOR
+
+
+ARRAY_NAMES = ["X", "race_id", "race_date", "boat_no", "position"]
+
+
+def _row_checksum(columns):
+    """
+    列の加重和（列の番号で重み付け）
+
+    日付はユリウス日、文字列は数値として読める部分と先頭の文字コードを使う
+    """
+    values = []
+    for column in columns:
+        if isinstance(column.type, Date):
+            value = func.julianday(column)
+        elif isinstance(column.type, String):
+            value = cast(column, Integer) + func.unicode(column)
+        else:
+            value = column
+        values.append(func.coalesce(value, 0))
+    return sum((i + 1) * value for i, value in enumerate(values))
+
+
+def _cumulative(rows, months) -> Dict[str, Dict]:
+    """
+    月別の (件数, 最大値, チェックサム) を、各月の末日までの累計に直す
+
+    特徴量ストア・対戦成績はレース前日までの全履歴から引くので、月の学習データは
+    その月以前のすべての行に依存する
+    """
+    rows = sorted((m, count, latest, checksum) for m, count, latest, checksum in rows if m)
+    generations = {}
+    total, latest, checksum, i = 0, None, 0.0, 0
+    for month in sorted(months):
+        while i < len(rows) and rows[i][0] <= month:
+            _, count, row_latest, row_checksum = rows[i]
+            total += count
+            if row_latest is not None and (latest is None or row_latest > latest):
+                latest = row_latest
+            checksum += row_checksum or 0.0
+            i += 1
+        generations[month] = {
+            "rows": total,
+            "latest": latest.isoformat() if hasattr(latest, "isoformat") else latest,
+            "checksum": round(checksum, 6),
+        }
+    return generations
+
+
+def _month_range(month: str):
+    """"YYYY-MM" → [月初, 翌月初)"""
+    year, mon = map(int, month.split("-"))
+    start = date(year, mon, 1)
+    end = date(year + 1, 1, 1) if mon == 12 else date(year, mon + 1, 1)
+    return start, end
+
+
+class DatasetSnapshotStore:
+    """
+    特徴量行列とラベルを月別の .npy パーティションとして保存する
+
+    パーティションは特徴量バージョンごとのディレクトリに置き、各月の
+    ウォーターマーク（結果件数・最大結果ID・出走表と結果の列のチェックサム・レースの最終更新時刻と、
+    その月までの特徴量ストア・対戦成績の世代）が変わった月と、それより後の月を再抽出する
+    （進入予測などの特徴量は前日までの全結果から作るため）。
+    変化のない月は memory-map で読み込む。
+    """
+
+    SNAPSHOT_DIR = "ml/data/snapshots"
+
+    def __init__(self, base_dir: Optional[str] = None, feature_version: int = FEATURE_VERSION):
+        self.feature_version = feature_version
+        self.root = os.path.join(base_dir or self.SNAPSHOT_DIR, f"v{feature_version}")
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+
+    def _read_manifest(self) -> Dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"feature_version": self.feature_version, "partitions": {}}
+
+    def _write_manifest(self, manifest: Dict):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def current_watermarks(self, db: Session) -> Dict[str, Dict]:
+        """
+        DB上の月別ウォーターマーク
+
+        結果件数・最大結果IDに加えて、学習データに使う出走表・結果の列の加重和（チェックサム）と
+        レースの最終更新時刻を含めるので、件数の変わらない訂正や出走表の取り直しも検出できる
+        """
+        month = func.strftime("%Y-%m", db_models.Race.race_date)
+        entry = db_models.RaceEntry
+        entry_values = [
+            getattr(entry, name) for name in RAW_COLUMNS if name not in ("boat_no", "rank_numeric")
+        ] + [
+            case(*[(entry.racer_rank == rank, value) for rank, value in RANK_MAP.items()], else_=DEFAULT_RANK),
+            cast(entry.racer_registration_no, Integer),
+        ]
+        result_values = [getattr(db_models.RaceResult, f"place_{i}") for i in range(1, 7)] + [
+            getattr(db_models.RaceResult, f"course_{i}") for i in range(1, 7)
+        ]
+        # 列の入れ替わりも検出できるよう、列の番号と艇番で重み付けして合計する
+        entry_checksum = func.total(entry.boat_no * sum(
+            (i + 1) * func.coalesce(column, 0) for i, column in enumerate(entry_values)
+        ))
+        result_checksum = func.total(sum(
+            (i + 1) * func.coalesce(column, 0) for i, column in enumerate(result_values)
+        ))
+        rows = db.query(
+            month,
+            func.count(func.distinct(db_models.RaceResult.id)),
+            func.max(db_models.RaceResult.id),
+            func.count(entry.id),
+            entry_checksum,
+            result_checksum,
+            func.max(db_models.Race.updated_at),
+        ).join(
+            db_models.RaceResult, db_models.RaceResult.race_id == db_models.Race.id
+        ).outerjoin(
+            entry, entry.race_id == db_models.Race.id
+        ).group_by(month).all()
+        marks = {
+            m: {
+                "results": count,
+                "max_result_id": max_id,
+                "entries": entries,
+                "entry_checksum": round(entry_sum, 6),
+                "result_checksum": round(result_sum, 6),
+                "updated_at": updated_at.isoformat() if updated_at else None,
+            }
+            for m, count, max_id, entries, entry_sum, result_sum, updated_at in rows if m
+        }
+        for name, generations in self.store_generations(db, marks).items():
+            for m, generation in generations.items():
+                marks[m][name] = generation
+        return marks
+
+    def store_generations(self, db: Session, months) -> Dict[str, Dict[str, Dict]]:
+        """
+        特徴量ストア（racer_features, equipment_features）と対戦成績の、各月の末日までの世代
+
+        学習データの直近成績・モーター/ボートの成績・対戦成績はこれらから引くので、ストアの
+        作り直しや後から入った結果による更新で値が変わった月も再抽出の対象にする。
+        世代は集計日（対戦成績は開催日）がその月以前の行の件数・最大の集計日・チェックサム
+        """
+        generations = {}
+        for name, model, skip in (
+            ("racer_features", db_models.RacerFeature, ("id", "updated_at")),
+            ("equipment_features", db_models.EquipmentFeature, ("id", "updated_at")),
+        ):
+            columns = [c for c in model.__table__.columns if c.name not in skip]
+            month = func.strftime("%Y-%m", model.as_of_date)
+            rows = db.query(
+                month, func.count(model.id), func.max(model.as_of_date), func.total(_row_checksum(columns))
+            ).group_by(month).all()
+            generations[name] = _cumulative(rows, months)
+
+        # 対戦成績は6艇揃っていないレースも含む全結果の選手と着順から集計する
+        entry, result = db_models.RaceEntry, db_models.RaceResult
+        month = func.strftime("%Y-%m", db_models.Race.race_date)
+        places = [getattr(result, f"place_{i}") for i in range(1, 7)]
+        rows = db.query(
+            month,
+            func.count(entry.id),
+            func.max(result.id),
+            func.total(entry.boat_no * _row_checksum([entry.racer_registration_no, *places])),
+        ).join(
+            result, result.race_id == entry.race_id
+        ).join(
+            db_models.Race, db_models.Race.id == entry.race_id
+        ).filter(
+            entry.racer_registration_no.isnot(None), entry.boat_no.between(1, 6)
+        ).group_by(month).all()
+        generations["matchups"] = {
+            m: {**generation, "prior": MATCHUP_PRIOR} for m, generation in _cumulative(rows, months).items()
+        }
+        return generations
+
+    def _save_partition(self, month: str, data: Dict[str, np.ndarray]):
+        """パーティションを一時ディレクトリに書いてから置き換える"""
+        final_dir = os.path.join(self.root, month)
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), data[name])
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+
+    def _load_partition(self, month: str) -> Dict[str, np.ndarray]:
+        part_dir = os.path.join(self.root, month)
+        return {
+            name: np.load(os.path.join(part_dir, f"{name}.npy"), mmap_mode="r")
+            for name in ARRAY_NAMES
+        }
+
+    def refresh(self, db: Session, verbose: bool = True) -> Dict[str, int]:
+        """
+        変化のあった月だけ再抽出してスナップショットを更新
+
+        Returns:
+            rebuilt: 再抽出した月数, reused: 再利用した月数, removed: 削除した月数
+        """
+        os.makedirs(self.root, exist_ok=True)
+        manifest = self._read_manifest()
+        partitions = manifest["partitions"]
+        watermarks = self.current_watermarks(db)
+
+        changed = [
+            m for m, mark in sorted(watermarks.items())
+            if partitions.get(m, {}).get("watermark") != mark
+            or not os.path.isdir(os.path.join(self.root, m))
+        ]
+        removed = [m for m in partitions if m not in watermarks]
+        # 変わった月より後の月も、前日までの結果から作る特徴量が変わるので再抽出する
+        first_changed = min(changed + removed, default=None)
+        stale = [m for m in sorted(watermarks) if first_changed is not None and m >= first_changed]
+
+        if stale:
+            # 再抽出する月は連続しているので1回で抽出して月ごとに分ける
+            # （月ごとに抽出すると、前日までの結果の集計を月の数だけやり直すことになる）
+            data = load_training_arrays(db, since=_month_range(stale[0])[0])
+            for month in stale:
+                start, end = _month_range(month)
+                lo, hi = np.searchsorted(data["race_date"], [start.toordinal(), end.toordinal()], "left")
+                part = {name: data[name][lo:hi] for name in ARRAY_NAMES}
+                self._save_partition(month, part)
+                partitions[month] = {"watermark": watermarks[month], "rows": int(hi - lo)}
+                if verbose:
+                    print(f"  snapshot {month}: {hi - lo} rows")
+
+        for month in removed:
+            shutil.rmtree(os.path.join(self.root, month), ignore_errors=True)
+            del partitions[month]
+
+        manifest["feature_version"] = self.feature_version
+        self._write_manifest(manifest)
+        return {"rebuilt": len(stale), "reused": len(watermarks) - len(stale), "removed": len(removed)}
+
+    def load(self, db: Session, before: Optional[date] = None, refresh: bool = True,
+             since: Optional[date] = None) -> Dict[str, np.ndarray]:
+        """
+        スナップショットから学習データを読み込む
+
+        Args:
+            before: この日より前のレースのみ
+            refresh: 読み込み前に変化のあった月を再抽出するか
+            since: この日以降のレースのみ（対象外の月のパーティションは読まない）
+        """
+        if refresh:
+            self.refresh(db)
+        manifest = self._read_manifest()
+
+        months = sorted(manifest["partitions"])
+        if before is not None:
+            months = [m for m in months if _month_range(m)[0] < before]
+        if since is not None:
+            months = [m for m in months if _month_range(m)[1] > since]
+        parts = [self._load_partition(m) for m in months]
+
+        # パーティション内の行は開催日順なので、期間は各パーティションの連続した範囲になる
+        ranges = []
+        for part in parts:
+            dates = part["race_date"]
+            start = 0 if since is None else int(np.searchsorted(dates, since.toordinal(), "left"))
+            stop = len(dates) if before is None else int(np.searchsorted(dates, before.toordinal(), "left"))
+            ranges.append((start, max(start, stop)))
+
+        # 出力を1回だけ確保し、memory-map から必要な範囲だけを直接書き込む（連結の中間コピーを作らない）
+        n_rows = sum(stop - start for start, stop in ranges)
+        data = {}
+        for name in ARRAY_NAMES:
+            if parts:
+                template = parts[0][name]
+                data[name] = np.empty((n_rows,) + template.shape[1:], dtype=template.dtype)
+            else:
+                data[name] = np.empty((0, len(FEATURE_NAMES)) if name == "X" else 0)
+        offset = 0
+        for part, (start, stop) in zip(parts, ranges):
+            for name in ARRAY_NAMES:
+                data[name][offset:offset + stop - start] = part[name][start:stop]
+            offset += stop - start
+        return data
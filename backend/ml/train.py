@@ -1,183 +1,513 @@
 """機械学習モデルの学習スクリプト"""
 import os
 import sys
+import time
+import argparse
 import numpy as np
-import pandas as pd
-from datetime import datetime
-import joblib
+from datetime import datetime, date, timedelta
+from typing import Dict, Optional
 
 # パスを追加
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from lightgbm import LGBMClassifier
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.metrics import accuracy_score, classification_report
+from lightgbm import LGBMClassifier, LGBMRanker, early_stopping
 from sqlalchemy.orm import Session
 
 from app.database import SessionLocal
-from app.models import db_models
-from ml.features import FeatureEngineer
+from app.prediction.ml_model import MLPredictor, MODEL_TYPES, race_softmax
+from ml import feature_store
+from ml.features import FeatureEngineer, FEATURE_VERSION
+from ml.dataset import load_training_arrays
+from ml.snapshot import DatasetSnapshotStore
+from ml.registry import ModelRegistry
+
+
+LGBM_PARAMS = {
+    "n_estimators": 100,
+    "max_depth": 6,
+    "learning_rate": 0.1,
+    "num_leaves": 31,
+    "random_state": 42,
+    "verbose": -1,
+}
+
+# ランキングモデルの温度の探索範囲
+TEMPERATURE_GRID = np.logspace(-1, 2, 61)
+
+
+def race_groups(race_id: np.ndarray) -> np.ndarray:
+    """連続して並んだ同一レースの行数（LGBMRanker の group）"""
+    starts = np.flatnonzero(np.r_[True, race_id[1:] != race_id[:-1]])
+    return np.diff(np.r_[starts, len(race_id)])
+
+
+def relevance_labels(position: np.ndarray) -> np.ndarray:
+    """着順をランキングの関連度に変換（1着=6 … 6着=1、着順不明=0）"""
+    return np.where(position > 0, 7 - position, 0)
+
+
+def win_metrics(win_probs: np.ndarray, position: np.ndarray, race_index: np.ndarray,
+                boat_index: np.ndarray) -> Dict[str, float]:
+    """1着確率 (races, 6) を実際の1着艇で評価（対数損失・本命的中率）"""
+    winners = np.full(win_probs.shape[0], -1)
+    first = position == 1
+    winners[race_index[first]] = boat_index[first]
+    valid = winners >= 0
+    p_winner = win_probs[valid, winners[valid]]
+    return {
+        "races": int(valid.sum()),
+        "win_logloss": float(-np.mean(np.log(np.maximum(p_winner, 1e-12)))),
+        "win_accuracy": float(np.mean(win_probs[valid].argmax(axis=1) == winners[valid])),
+    }
+
+
+def subset(data: Dict[str, np.ndarray], idx: np.ndarray) -> Dict[str, np.ndarray]:
+    """学習データの各配列から同じ行を取り出す"""
+    return {name: values[idx] for name, values in data.items()}
+
+
+def time_holdout(race_date: np.ndarray, test_fraction: float = 0.2):
+    """
+    開催日の新しい側 test_fraction を評価用にする分割（未来のレースを学習に使わない）
+
+    日付単位で分けるので同一レースの6艇は必ず同じ側に入る。
+    開催日が1日しかない場合は分けられないので、全行を学習用にして評価用は空にする。
+
+    Returns:
+        (学習用の行インデックス, 評価用の行インデックス)
+    """
+    dates = np.unique(race_date)
+    if len(dates) < 2:
+        return np.arange(len(race_date)), np.zeros(0, dtype=np.int64)
+    n_test = min(max(1, int(round(len(dates) * test_fraction))), len(dates) - 1)
+    cutoff = dates[len(dates) - n_test]
+    return np.flatnonzero(race_date < cutoff), np.flatnonzero(race_date >= cutoff)
 
 
 class BoatRaceModelTrainer:
     """ボートレース予測モデルの学習"""
     
-    MODEL_DIR = "ml/models"
-    
-    def __init__(self):
+    def __init__(self, mode: str = "binary", params: Optional[Dict] = None, verbose: bool = True):
+        """
+        Args:
+            mode: "binary"（1〜3着の2値分類モデル3本）または
+                  "ranking"（レース単位のランキングモデル1本）
+            params: LGBM_PARAMS を上書きするハイパーパラメータ
+        """
+        if mode not in MODEL_TYPES:
+            raise ValueError(f"Unsupported training mode: {mode}")
+        self.mode = mode
+        self.params = {**LGBM_PARAMS, **(params or {})}
+        self.verbose = verbose
         self.feature_engineer = FeatureEngineer()
         self.model_1st = None
         self.model_2nd = None
         self.model_3rd = None
+        self.model = None
+        self.temperature = 1.0
+        self.train_seconds = None
+        self.trained_through = None
+        self.incremental_updates = 0
+        self.metrics = None
     
-    def load_training_data(self, db: Session) -> pd.DataFrame:
-        """学習データを読み込み"""
-        # レース結果があるレースのみ取得
-        races_with_results = db.query(db_models.Race).join(
-            db_models.RaceResult
-        ).all()
-        
-        all_features = []
-        all_labels_1st = []
-        all_labels_2nd = []
-        all_labels_3rd = []
-        
-        for race in races_with_results:
-            entries = db.query(db_models.RaceEntry).filter(
-                db_models.RaceEntry.race_id == race.id
-            ).order_by(db_models.RaceEntry.boat_no).all()
-            
-            if len(entries) != 6:
-                continue
-            
-            result = race.result
-            if not result:
-                continue
-            
-            # 特徴量を生成
-            entry_dicts = [
-                {
-                    "boat_no": e.boat_no,
-                    "win_rate_all": e.win_rate_all,
-                    "place_rate_2_all": e.place_rate_2_all,
-                    "win_rate_local": e.win_rate_local,
-                    "place_rate_2_local": e.place_rate_2_local,
-                    "motor_rate_2": e.motor_rate_2,
-                    "boat_rate_2": e.boat_rate_2,
-                    "avg_start_timing": e.avg_start_timing,
-                    "racer_rank": e.racer_rank,
-                    "weight": e.weight,
-                }
-                for e in entries
-            ]
-            
-            features_df = self.feature_engineer.create_features(entry_dicts)
-            
-            # ラベルを生成
-            for i, entry in enumerate(entries):
-                all_features.append(features_df.iloc[i].values)
-                all_labels_1st.append(1 if entry.boat_no == result.place_1 else 0)
-                all_labels_2nd.append(1 if entry.boat_no == result.place_2 else 0)
-                all_labels_3rd.append(1 if entry.boat_no == result.place_3 else 0)
-        
-        return (
-            np.array(all_features),
-            np.array(all_labels_1st),
-            np.array(all_labels_2nd),
-            np.array(all_labels_3rd)
-        )
-    
-    def train(self, X, y_1st, y_2nd, y_3rd):
-        """モデルを学習"""
-        print(f"Training data size: {len(X)}")
-        
-        # データを分割
-        X_train, X_test, y1_train, y1_test = train_test_split(
-            X, y_1st, test_size=0.2, random_state=42
-        )
-        _, _, y2_train, y2_test = train_test_split(
-            X, y_2nd, test_size=0.2, random_state=42
-        )
-        _, _, y3_train, y3_test = train_test_split(
-            X, y_3rd, test_size=0.2, random_state=42
-        )
-        
-        # LightGBMモデルを学習
-        params = {
-            "n_estimators": 100,
-            "max_depth": 6,
-            "learning_rate": 0.1,
-            "num_leaves": 31,
-            "random_state": 42,
-            "verbose": -1,
-        }
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
+    
+    def load_training_data(self, db: Session, before: Optional[date] = None,
+                           use_snapshot: bool = True) -> Dict[str, np.ndarray]:
+        """
+        学習データを読み込み（before指定時はその日より前のレースのみ）
         
-        print("Training 1st place model...")
-        self.model_1st = LGBMClassifier(**params)
-        self.model_1st.fit(X_train, y1_train)
+        use_snapshot=True の場合は月別スナップショットを更新して読み込む
+        （変化のない月は再抽出しない）
         
-        print("Training 2nd place model...")
-        self.model_2nd = LGBMClassifier(**params)
-        self.model_2nd.fit(X_train, y2_train)
+        Returns:
+            X, race_id, race_date, boat_no, position（ml.dataset.load_training_arrays と同じ）
+        """
+        if use_snapshot:
+            return DatasetSnapshotStore().load(db, before=before)
+        return load_training_arrays(db, before=before)
+    
+    def train(self, data: Dict[str, np.ndarray], test_fraction: float = 0.2) -> Dict[str, float]:
+        """直近 test_fraction の開催日を除いて学習し、除いたレースで1着確率を評価"""
+        self._log(f"Training data size: {len(data['X'])}")
         
-        print("Training 3rd place model...")
-        self.model_3rd = LGBMClassifier(**params)
-        self.model_3rd.fit(X_train, y3_train)
+        train_idx, test_idx = time_holdout(data["race_date"], test_fraction)
+        self.fit(subset(data, train_idx))
+        self._log(f"Training time: {self.train_seconds:.2f}s")
         
         # 評価
-        print("\n=== Model Evaluation ===")
-        
-        y1_pred = self.model_1st.predict(X_test)
-        print(f"1st Place Accuracy: {accuracy_score(y1_test, y1_pred):.4f}")
-        
-        y2_pred = self.model_2nd.predict(X_test)
-        print(f"2nd Place Accuracy: {accuracy_score(y2_test, y2_pred):.4f}")
-        
-        y3_pred = self.model_3rd.predict(X_test)
-        print(f"3rd Place Accuracy: {accuracy_score(y3_test, y3_pred):.4f}")
+        self._log("\n=== Model Evaluation ===")
+        if len(test_idx) == 0:
+            metrics = {}
+            self._log("Skipped: all races are on one date, so every race was used for training")
+        else:
+            metrics = self.evaluate(subset(data, test_idx))
+            self._log(f"Test races: {metrics['races']}")
+            self._log(f"1st Place Log Loss: {metrics['win_logloss']:.4f}")
+            self._log(f"1st Place Accuracy: {metrics['win_accuracy']:.4f}")
+        self.metrics = metrics
         
         # 特徴量の重要度
-        print("\n=== Feature Importance (1st Place) ===")
+        label = "Ranking" if self.mode == "ranking" else "1st Place"
+        self._log(f"\n=== Feature Importance ({label}) ===")
         feature_names = self.feature_engineer.feature_names
-        importance = self.model_1st.feature_importances_
+        importance = (self.model if self.mode == "ranking" else self.model_1st).feature_importances_
         for name, imp in sorted(zip(feature_names, importance), key=lambda x: -x[1]):
-            print(f"  {name}: {imp:.4f}")
+            self._log(f"  {name}: {imp:.4f}")
+        
+        return metrics
+    
+    def fit(self, train: Dict[str, np.ndarray], valid: Optional[Dict[str, np.ndarray]] = None,
+            early_stopping_rounds: int = 20):
+        """
+        モデルを学習（valid を渡すとそのレースで early stopping する）
+        
+        Returns:
+            早期終了時の最良イテレーション数（binary は3モデルの平均）
+        """
+        started = time.perf_counter()
+        callbacks = [early_stopping(early_stopping_rounds, verbose=False)] if valid is not None else None
+        if self.mode == "ranking":
+            best = self._fit_ranking(train, valid, callbacks)
+        else:
+            best = self._fit_binary(train, valid, callbacks)
+        self.train_seconds = time.perf_counter() - started
+        self.trained_through = date.fromordinal(int(train["race_date"].max()))
+        self.incremental_updates = 0
+        return best
+    
+    @classmethod
+    def from_bundle(cls, bundle: Dict, verbose: bool = True) -> "BoatRaceModelTrainer":
+        """保存済みの統合モデルからトレーナーを復元"""
+        trainer = cls(bundle.get("model_type", "binary"), params=bundle.get("params"), verbose=verbose)
+        if trainer.mode == "ranking":
+            trainer.model = bundle["model"]
+            trainer.temperature = bundle.get("temperature", 1.0)
+        else:
+            trainer.model_1st = bundle["model_1st"]
+            trainer.model_2nd = bundle["model_2nd"]
+            trainer.model_3rd = bundle["model_3rd"]
+        if bundle.get("trained_through"):
+            trainer.trained_through = date.fromisoformat(bundle["trained_through"])
+        trainer.incremental_updates = bundle.get("incremental_updates", 0)
+        return trainer
+    
+    def continue_training(self, train: Dict[str, np.ndarray], rounds: int = 20) -> "BoatRaceModelTrainer":
+        """
+        現在のモデルを初期値として train のレースで rounds 本の木を追加学習する
+        
+        元のトレーナーは変更せず、更新後のモデルを持つ新しいトレーナーを返す。
+        ranking の温度は元のモデルの値を引き継ぐ。
+        """
+        updated = BoatRaceModelTrainer(self.mode, params={**self.params, "n_estimators": rounds},
+                                       verbose=self.verbose)
+        started = time.perf_counter()
+        if self.mode == "ranking":
+            updated.model = LGBMRanker(objective="lambdarank", **updated.params)
+            updated.model.fit(train["X"], relevance_labels(train["position"]),
+                              group=race_groups(train["race_id"]), init_model=self.model.booster_)
+            updated.temperature = self.temperature
+        else:
+            for place, attr in ((1, "model_1st"), (2, "model_2nd"), (3, "model_3rd")):
+                model = LGBMClassifier(**updated.params)
+                model.fit(train["X"], (train["position"] == place).astype(int),
+                          init_model=getattr(self, attr).booster_)
+                setattr(updated, attr, model)
+        updated.train_seconds = time.perf_counter() - started
+        updated.params = self.params
+        updated.trained_through = date.fromordinal(int(train["race_date"].max()))
+        updated.incremental_updates = self.incremental_updates + 1
+        return updated
+    
+    def _fit_binary(self, train, valid, callbacks) -> int:
+        """1着・2着・3着の2値分類モデルをそれぞれ学習"""
+        best = []
+        for place, attr in ((1, "model_1st"), (2, "model_2nd"), (3, "model_3rd")):
+            self._log(f"Training {attr[6:]} place model...")
+            model = LGBMClassifier(**self.params)
+            eval_set = None
+            if valid is not None:
+                eval_set = [(valid["X"], (valid["position"] == place).astype(int))]
+            model.fit(train["X"], (train["position"] == place).astype(int),
+                      eval_set=eval_set, callbacks=callbacks)
+            setattr(self, attr, model)
+            best.append(model.best_iteration_ or model.n_estimators)
+        return int(round(np.mean(best)))
     
-    def save_models(self):
-        """モデルを保存"""
-        os.makedirs(self.MODEL_DIR, exist_ok=True)
+    def _fit_ranking(self, train, valid, callbacks) -> int:
+        """レースをグループとしたランキングモデルを学習し、確率化の温度を決める"""
+        # 温度は学習に使わない直近のレースで決める（学習レースのスコアは過学習で鋭すぎるため）
+        fit_idx, calib_idx = time_holdout(train["race_date"], 0.1)
+        fit, calib = subset(train, fit_idx), subset(train, calib_idx)
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._log("Training ranking model...")
+        self.model = LGBMRanker(objective="lambdarank", **self.params)
+        eval_kwargs = {}
+        if valid is not None:
+            eval_kwargs = {
+                "eval_set": [(valid["X"], relevance_labels(valid["position"]))],
+                "eval_group": [race_groups(valid["race_id"])],
+                "eval_at": [1],
+            }
+        self.model.fit(fit["X"], relevance_labels(fit["position"]), group=race_groups(fit["race_id"]),
+                       callbacks=callbacks, **eval_kwargs)
         
-        # 個別モデルを保存
-        joblib.dump(self.model_1st, f"{self.MODEL_DIR}/model_1st_{timestamp}.joblib")
-        joblib.dump(self.model_2nd, f"{self.MODEL_DIR}/model_2nd_{timestamp}.joblib")
-        joblib.dump(self.model_3rd, f"{self.MODEL_DIR}/model_3rd_{timestamp}.joblib")
+        if len(calib_idx) == 0:
+            # 開催日が1日だけで温度を決めるレースが残らない
+            self.temperature = 1.0
+            self._log("Softmax temperature: 1.000 (no calibration races)")
+            return int(self.model.best_iteration_ or self.model.n_estimators)
         
-        # 統合モデルも保存（予測時に使用）
-        combined_model = {
+        # スコアのソフトマックスが1着確率として最もよく当たる温度を選ぶ
+        _, race_index = np.unique(calib["race_id"], return_inverse=True)
+        boat_index = calib["boat_no"].astype(int) - 1
+        scores = self.model.predict(calib["X"])
+        losses = [
+            win_metrics(
+                race_softmax(scores, race_index, boat_index, t), calib["position"], race_index, boat_index
+            )["win_logloss"]
+            for t in TEMPERATURE_GRID
+        ]
+        self.temperature = float(TEMPERATURE_GRID[int(np.argmin(losses))])
+        self._log(f"Softmax temperature: {self.temperature:.3f}")
+        return int(self.model.best_iteration_ or self.model.n_estimators)
+    
+    def bundle(self, trained_at: Optional[str] = None) -> Dict:
+        """予測時に読み込む統合モデル"""
+        common = {
+            "model_type": self.mode,
+            "feature_names": self.feature_engineer.feature_names,
+            "feature_version": FEATURE_VERSION,
+            "trained_at": trained_at or datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "trained_through": self.trained_through.isoformat() if self.trained_through else None,
+            "incremental_updates": self.incremental_updates,
+            "params": self.params,
+        }
+        if self.mode == "ranking":
+            return {"model": self.model, "temperature": self.temperature, **common}
+        return {
             "model_1st": self.model_1st,
             "model_2nd": self.model_2nd,
             "model_3rd": self.model_3rd,
-            "feature_names": self.feature_engineer.feature_names,
-            "trained_at": timestamp,
+            **common,
         }
-        joblib.dump(combined_model, f"{self.MODEL_DIR}/boatrace_model.joblib")
+    
+    def evaluate(self, data: Dict[str, np.ndarray]) -> Dict[str, float]:
+        """予測時と同じ経路（MLPredictor）で1着確率を計算して評価"""
+        predictor = MLPredictor(bundle=self.bundle())
+        _, race_index = np.unique(data["race_id"], return_inverse=True)
+        boat_index = data["boat_no"].astype(int) - 1
+        places = predictor._predict_place_probabilities(data["X"], race_index, boat_index)
+        win_probs = np.zeros((race_index.max() + 1, 6))
+        win_probs[race_index, boat_index] = places[:, 0]
+        return win_metrics(win_probs, data["position"], race_index, boat_index)
+    
+    def save_models(self, metrics: Optional[Dict[str, float]] = None, promote: bool = True,
+                    note: Optional[str] = None) -> str:
+        """
+        モデルをレジストリに新しいバージョンとして登録
+        
+        promote=True の場合は active に昇格し、稼働中のAPIはバックグラウンドで読み込んで切り替える
         
-        print(f"\nModels saved to {self.MODEL_DIR}/")
+        Returns:
+            登録したバージョン
+        """
+        registry = ModelRegistry()
+        version = registry.register(self.bundle(), metrics or self.metrics, promote=promote, note=note)
+        
+        print(f"\nModel registered as version {version} in {registry.base_dir}/"
+              + (" (active)" if promote else ""))
+        return version
+
+
+def measure_inference_latency(bundle: Dict, X, race_id, boat_no,
+                              races_per_batch: int = 72, repeats: int = 50) -> Dict[str, float]:
+    """
+    予測時と同じ経路で推論レイテンシを計測（中央値, ミリ秒）
+    
+    race: 1レース（6艇）, day: races_per_batch レース分（1日の全場相当）
+    """
+    predictor = MLPredictor(bundle=bundle)
+    starts = np.flatnonzero(np.r_[True, race_id[1:] != race_id[:-1]])
+    ends = np.r_[starts[1:], len(race_id)]
+    
+    def timed(stop):
+        rows = slice(0, stop)
+        _, race_index = np.unique(race_id[rows], return_inverse=True)
+        boat_index = boat_no[rows].astype(int) - 1
+        elapsed = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            predictor._predict_place_probabilities(X[rows], race_index, boat_index)
+            elapsed.append(time.perf_counter() - started)
+        return float(np.median(elapsed) * 1000)
+    
+    return {
+        "race_ms": timed(ends[0]),
+        "day_ms": timed(ends[min(races_per_batch, len(ends)) - 1]),
+    }
+
+
+def compare_modes(data: Dict[str, np.ndarray]) -> Dict[str, Dict]:
+    """2値分類3本とランキング1本を同じ分割で学習し、学習時間・推論レイテンシ・精度を比較"""
+    if len(np.unique(data["race_date"])) < 2:
+        raise ValueError("Comparing modes needs races on at least two dates to hold out a test set")
+    report = {}
+    trainers = {}
+    for mode in MODEL_TYPES:
+        print(f"\n##### mode: {mode} #####")
+        trainer = BoatRaceModelTrainer(mode)
+        metrics = trainer.train(data)
+        test = subset(data, time_holdout(data["race_date"])[1])
+        latency = measure_inference_latency(trainer.bundle(), test["X"], test["race_id"], test["boat_no"])
+        report[mode] = {"train_seconds": trainer.train_seconds, **latency, **metrics}
+        trainers[mode] = trainer
+    
+    print("\n=== Mode Comparison ===")
+    print(f"{'mode':<10}{'train[s]':>10}{'race[ms]':>10}{'day[ms]':>10}{'logloss':>10}{'accuracy':>10}")
+    for mode, r in report.items():
+        print(f"{mode:<10}{r['train_seconds']:>10.2f}{r['race_ms']:>10.2f}{r['day_ms']:>10.2f}"
+              f"{r['win_logloss']:>10.4f}{r['win_accuracy']:>10.4f}")
+    return {"report": report, "trainers": trainers}
+
+
+def tune_params(data: Dict[str, np.ndarray], mode: str, n_candidates: Optional[int] = 12,
+                n_splits: int = 4, n_jobs: int = -1) -> Dict:
+    """
+    直近の評価用レースを除いたデータで walk-forward 交差検証のハイパーパラメータ探索を行い、最良のパラメータを返す
+
+    探索の詳細（ml.tuning.HyperparameterSearch）は python -m ml.tuning でも確認できる
+    """
+    # ml.tuning は ml.train を読み込むので、ここで読み込む
+    from ml.tuning import HyperparameterSearch, WalkForwardSplit, print_summary
+
+    search_idx, _ = time_holdout(data["race_date"])
+    search = HyperparameterSearch(
+        mode=mode, n_candidates=n_candidates, splitter=WalkForwardSplit(n_splits), n_jobs=n_jobs,
+    ).run(subset(data, search_idx))
+    print_summary(search)
+    return search["best_params"]
+
+
+# 追加学習で許容する指標の悪化幅
+REGRESSION_TOLERANCE = {"win_logloss": 0.002, "win_accuracy": 0.01}
+
+
+def incremental_update(db: Session, holdout_days: int = 7, rounds: int = 20,
+                       tolerance: Optional[Dict[str, float]] = None,
+                       use_snapshot: bool = True) -> Dict:
+    """
+    active のモデルを、学習済み期間より後に追加されたレースだけで追加学習する
+    
+    追加分のうち直近 holdout_days 開催日を検証用に残し、残りで木を rounds 本追加する。
+    検証レースで現行モデルより指標が悪化しなければ昇格（保存）する。検証用のレースは
+    trained_through に含めないので、次回の更新で学習に使われる。
+    
+    Returns:
+        status: "promoted" / "rejected" / "skipped", 理由・新旧の指標・所要時間
+    """
+    started = time.perf_counter()
+    tolerance = {**REGRESSION_TOLERANCE, **(tolerance or {})}
+    
+    registry = ModelRegistry()
+    version = registry.active_version()
+    if version is None:
+        return {"status": "skipped", "reason": "no active model; run a full training first"}
+    bundle = registry.load(version)
+    if MLPredictor(bundle=bundle).model is None or not bundle.get("trained_through"):
+        return {"status": "skipped", "reason": "current model cannot be updated incrementally; run a full training"}
+    current = BoatRaceModelTrainer.from_bundle(bundle)
+    
+    since = current.trained_through + timedelta(days=1)
+    if use_snapshot:
+        data = DatasetSnapshotStore().load(db, since=since)
+    else:
+        data = load_training_arrays(db, since=since)
+    dates = np.unique(data["race_date"])
+    if len(dates) <= holdout_days:
+        return {"status": "skipped",
+                "reason": f"{len(dates)} new race days; need more than {holdout_days} (holdout)"}
+    
+    cutoff = dates[len(dates) - holdout_days]
+    update = subset(data, np.flatnonzero(data["race_date"] < cutoff))
+    holdout = subset(data, np.flatnonzero(data["race_date"] >= cutoff))
+    print(f"Incremental update: {len(np.unique(update['race_id']))} new races, "
+          f"{len(np.unique(holdout['race_id']))} holdout races")
+    
+    candidate = current.continue_training(update, rounds)
+    before, after = current.evaluate(holdout), candidate.evaluate(holdout)
+    regressions = [
+        name for name, allowed in tolerance.items()
+        if (after[name] - before[name] if name == "win_logloss" else before[name] - after[name]) > allowed
+    ]
+    
+    print(f"{'':<10}{'logloss':>10}{'accuracy':>10}")
+    print(f"{'current':<10}{before['win_logloss']:>10.4f}{before['win_accuracy']:>10.4f}")
+    print(f"{'candidate':<10}{after['win_logloss']:>10.4f}{after['win_accuracy']:>10.4f}")
+    
+    result = {
+        "current": before,
+        "candidate": after,
+        "train_seconds": candidate.train_seconds,
+        "trained_through": candidate.trained_through.isoformat(),
+    }
+    if regressions:
+        print(f"Candidate rejected (regressed: {', '.join(regressions)})")
+        result.update(status="rejected", reason=f"regressed: {', '.join(regressions)}")
+    else:
+        candidate.metrics = after
+        result.update(status="promoted", version=candidate.save_models(note=f"incremental update of {version}"))
+    result["elapsed_seconds"] = time.perf_counter() - started
+    return result
 
 
 def main():
     """メイン処理"""
+    parser = argparse.ArgumentParser(description="Train boat race prediction models")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="extract features directly from the DB instead of the cached snapshot")
+    parser.add_argument("--mode", choices=MODEL_TYPES, default="binary",
+                        help="binary: three 1st/2nd/3rd classifiers, ranking: one race-grouped ranker")
+    parser.add_argument("--compare", action="store_true",
+                        help="train both modes and report training time, inference latency and accuracy "
+                             "(the --mode model is saved)")
+    parser.add_argument("--tune", action="store_true",
+                        help="search hyperparameters with walk-forward cross-validation before training "
+                             "and train the --mode model with the best ones")
+    parser.add_argument("--n-candidates", type=int, default=12,
+                        help="number of sampled candidates in --tune mode (0 = full grid)")
+    parser.add_argument("--n-jobs", type=int, default=-1,
+                        help="parallel workers for --tune")
+    parser.add_argument("--incremental", action="store_true",
+                        help="continue boosting the current model on races added since it was trained "
+                             "and promote it only if the holdout metrics do not regress")
+    parser.add_argument("--holdout-days", type=int, default=7,
+                        help="latest race days kept for validation in --incremental mode")
+    parser.add_argument("--rounds", type=int, default=20,
+                        help="boosting rounds added in --incremental mode")
+    args = parser.parse_args()
+    if args.tune and (args.compare or args.incremental):
+        parser.error("--tune cannot be combined with --compare or --incremental")
+    
     print("=== Boat Race Prediction Model Training ===\n")
     
     db = SessionLocal()
-    trainer = BoatRaceModelTrainer()
+    trainer = BoatRaceModelTrainer(args.mode)
     
     try:
+        # 特徴量ストアが空なら先に作る（空のまま学習すると直近成績の特徴量が欠損になる）
+        feature_store.ensure_built(db)
+        if args.incremental:
+            result = incremental_update(db, args.holdout_days, args.rounds, use_snapshot=not args.no_snapshot)
+            print(f"{result['status']}: {result.get('reason', '')} ({result.get('elapsed_seconds', 0):.1f}s)")
+            return
+        
         # データ読み込み
         print("Loading training data...")
-        X, y_1st, y_2nd, y_3rd = trainer.load_training_data(db)
+        data = trainer.load_training_data(db, use_snapshot=not args.no_snapshot)
+        X = data["X"]
         
         if len(X) < 100:
             print(f"Warning: Training data is small ({len(X)} samples)")
@@ -188,7 +518,16 @@ def main():
                 return
         
         # 学習
-        trainer.train(X, y_1st, y_2nd, y_3rd)
+        if args.tune:
+            print("\n=== Hyperparameter Search ===")
+            params = tune_params(data, args.mode, args.n_candidates or None, n_jobs=args.n_jobs)
+            trainer = BoatRaceModelTrainer(args.mode, params=params)
+            print("\n=== Training with best parameters ===")
+            trainer.train(data)
+        elif args.compare:
+            trainer = compare_modes(data)["trainers"][args.mode]
+        else:
+            trainer.train(data)
         
         # 保存
         trainer.save_models()
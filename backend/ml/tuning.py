@@ -0,0 +1,246 @@
+"""時系列交差検証とハイパーパラメータ探索
+
+使い方:
+    cd backend
+    python -m ml.tuning --mode binary --n-candidates 12 --n-jobs -1 --save
+"""
+import os
+import sys
+import time
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal
+from app.prediction.ml_model import MODEL_TYPES
+from ml import feature_store
+from ml.train import BoatRaceModelTrainer, subset, time_holdout
+
+
+# 探索するハイパーパラメータの候補
+DEFAULT_PARAM_GRID = {
+    "num_leaves": [15, 31, 63],
+    "max_depth": [4, 6, -1],
+    "learning_rate": [0.03, 0.1],
+    "min_child_samples": [20, 50, 100],
+    "colsample_bytree": [0.7, 1.0],
+    "reg_lambda": [0.0, 1.0],
+}
+
+
+class WalkForwardSplit:
+    """
+    開催日順の前進型（walk-forward）交差検証
+
+    開催日を n_splits + 1 個の連続した区間に分け、k 番目の分割では
+    区間 0..k で学習して区間 k+1 で検証する。日付単位で分けるので
+    同一レースの行は必ず同じ側に入り、検証より未来のレースは学習に入らない。
+    """
+
+    def __init__(self, n_splits: int = 4, gap_days: int = 0):
+        """
+        Args:
+            gap_days: 学習区間の末尾から除く日数（検証直前の開催を学習に使わない）
+        """
+        if n_splits < 1:
+            raise ValueError("n_splits must be at least 1")
+        self.n_splits = n_splits
+        self.gap_days = gap_days
+
+    def split(self, race_date: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Args:
+            race_date: 各行の開催日の序数 (n_rows,)
+
+        Yields:
+            (学習用の行インデックス, 検証用の行インデックス)
+        """
+        dates = np.unique(race_date)
+        if len(dates) < self.n_splits + 1:
+            raise ValueError(f"Need at least {self.n_splits + 1} race days, got {len(dates)}")
+
+        bounds = np.linspace(0, len(dates), self.n_splits + 2).astype(int)
+        for k in range(1, self.n_splits + 1):
+            valid_start, valid_end = dates[bounds[k]], dates[bounds[k + 1] - 1]
+            train_idx = np.flatnonzero(race_date < valid_start - self.gap_days)
+            valid_idx = np.flatnonzero((race_date >= valid_start) & (race_date <= valid_end))
+            if len(train_idx) and len(valid_idx):
+                yield train_idx, valid_idx
+
+
+def _evaluate_fold(mode: str, params: Dict, data: Dict[str, np.ndarray],
+                   train_idx: np.ndarray, valid_idx: np.ndarray,
+                   early_stopping_rounds: int) -> Dict:
+    """1候補×1分割を学習・評価（ワーカープロセスで実行）"""
+    trainer = BoatRaceModelTrainer(mode, params=params, verbose=False)
+    valid = subset(data, valid_idx)
+    best_iteration = trainer.fit(subset(data, train_idx), valid, early_stopping_rounds)
+    return {
+        **trainer.evaluate(valid),
+        "best_iteration": best_iteration,
+        "seconds": trainer.train_seconds,
+    }
+
+
+class HyperparameterSearch:
+    """
+    ハイパーパラメータ候補を walk-forward 交差検証で評価する
+
+    候補×分割の学習をプロセス並列で実行する。ワーカー数 × LightGBM のスレッド数が
+    CPUコア数を超えないよう、各モデルのスレッド数は コア数 // ワーカー数 に揃える。
+    各学習は検証区間で early stopping し、n_estimators は上限として扱う。
+    """
+
+    def __init__(
+        self,
+        mode: str = "binary",
+        param_grid: Optional[Dict[str, List]] = None,
+        n_candidates: Optional[int] = 12,
+        splitter: Optional[WalkForwardSplit] = None,
+        n_jobs: int = -1,
+        max_estimators: int = 1000,
+        early_stopping_rounds: int = 20,
+        random_state: int = 42,
+    ):
+        """
+        Args:
+            n_candidates: ランダムに選ぶ候補数（None でグリッド全探索）
+            n_jobs: 並列ワーカー数（-1 で全コア）
+        """
+        if mode not in MODEL_TYPES:
+            raise ValueError(f"Unsupported training mode: {mode}")
+        self.mode = mode
+        self.param_grid = param_grid or DEFAULT_PARAM_GRID
+        self.n_candidates = n_candidates
+        self.splitter = splitter or WalkForwardSplit()
+        self.n_jobs = n_jobs
+        self.max_estimators = max_estimators
+        self.early_stopping_rounds = early_stopping_rounds
+        self.random_state = random_state
+
+    def candidates(self) -> List[Dict]:
+        """評価するパラメータ候補の一覧"""
+        grid = ParameterGrid(self.param_grid)
+        if self.n_candidates is None or self.n_candidates >= len(grid):
+            return list(grid)
+        return list(ParameterSampler(self.param_grid, self.n_candidates, random_state=self.random_state))
+
+    def _thread_plan(self, n_tasks: int) -> Tuple[int, int]:
+        """(ワーカー数, 1モデルあたりのスレッド数)"""
+        cores = os.cpu_count() or 1
+        workers = max(1, min(effective_n_jobs(self.n_jobs), n_tasks, cores))
+        return workers, max(1, cores // workers)
+
+    def run(self, data: Dict[str, np.ndarray], verbose: bool = True) -> Dict:
+        """
+        全候補を交差検証で評価
+
+        Returns:
+            results: 候補ごとの集計（1着対数損失の平均が小さい順）
+            best_params: 最良候補のパラメータ（n_estimators は分割の最良イテレーションの平均）
+            workers, threads_per_model, elapsed_seconds: 実行条件と全体の所要時間
+        """
+        candidates = self.candidates()
+        folds = list(self.splitter.split(data["race_date"]))
+        tasks = [(c, f) for c in range(len(candidates)) for f in range(len(folds))]
+        workers, threads = self._thread_plan(len(tasks))
+        if verbose:
+            print(f"Search: {len(candidates)} candidates x {len(folds)} folds "
+                  f"on {workers} workers x {threads} threads")
+
+        started = time.perf_counter()
+        # 大きな配列は joblib がワーカーへメモリマップで渡す
+        outputs = Parallel(n_jobs=workers)(
+            delayed(_evaluate_fold)(
+                self.mode,
+                {**candidates[c], "n_estimators": self.max_estimators, "n_jobs": threads},
+                data, folds[f][0], folds[f][1], self.early_stopping_rounds,
+            )
+            for c, f in tasks
+        )
+        elapsed = time.perf_counter() - started
+
+        results = []
+        for c, params in enumerate(candidates):
+            scores = [out for (tc, _), out in zip(tasks, outputs) if tc == c]
+            logloss = np.array([s["win_logloss"] for s in scores])
+            results.append({
+                "params": params,
+                "win_logloss": float(logloss.mean()),
+                "win_logloss_std": float(logloss.std()),
+                "win_accuracy": float(np.mean([s["win_accuracy"] for s in scores])),
+                "best_iteration": int(round(np.mean([s["best_iteration"] for s in scores]))),
+                "fit_seconds": float(sum(s["seconds"] for s in scores)),
+            })
+        results.sort(key=lambda r: r["win_logloss"])
+
+        best = results[0]
+        return {
+            "results": results,
+            "best_params": {**best["params"], "n_estimators": best["best_iteration"]},
+            "workers": workers,
+            "threads_per_model": threads,
+            "elapsed_seconds": elapsed,
+        }
+
+
+def print_summary(search: Dict):
+    """候補ごとのスコアと学習時間の一覧を表示"""
+    print(f"\n=== Search Summary ({search['elapsed_seconds']:.1f}s wall, "
+          f"{search['workers']} workers x {search['threads_per_model']} threads) ===")
+    print(f"{'#':>3}{'logloss':>10}{'std':>8}{'accuracy':>10}{'iters':>7}{'fit[s]':>9}  params")
+    for i, r in enumerate(search["results"], 1):
+        print(f"{i:>3}{r['win_logloss']:>10.4f}{r['win_logloss_std']:>8.4f}{r['win_accuracy']:>10.4f}"
+              f"{r['best_iteration']:>7}{r['fit_seconds']:>9.2f}  {r['params']}")
+    print(f"\nBest params: {search['best_params']}")
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="Walk-forward hyperparameter search")
+    parser.add_argument("--mode", choices=MODEL_TYPES, default="binary")
+    parser.add_argument("--n-candidates", type=int, default=12,
+                        help="number of sampled candidates (0 = full grid)")
+    parser.add_argument("--n-splits", type=int, default=4)
+    parser.add_argument("--gap-days", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--no-snapshot", action="store_true")
+    parser.add_argument("--save", action="store_true",
+                        help="retrain with the best parameters, evaluate on the latest races and save the model")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    trainer = BoatRaceModelTrainer(args.mode)
+    try:
+        feature_store.ensure_built(db)
+        data = trainer.load_training_data(db, use_snapshot=not args.no_snapshot)
+    finally:
+        db.close()
+    if len(data["X"]) == 0:
+        print("No training data available. Exiting.")
+        return
+
+    # 最終評価用の直近レースは探索に使わない
+    search_idx, _ = time_holdout(data["race_date"])
+    search = HyperparameterSearch(
+        mode=args.mode,
+        n_candidates=args.n_candidates or None,
+        splitter=WalkForwardSplit(args.n_splits, args.gap_days),
+        n_jobs=args.n_jobs,
+    ).run(subset(data, search_idx))
+    print_summary(search)
+
+    if args.save:
+        print("\n=== Retraining with best parameters ===")
+        trainer = BoatRaceModelTrainer(args.mode, params=search["best_params"])
+        trainer.train(data)
+        trainer.save_models()
+
+
+if __name__ == "__main__":
+    main()
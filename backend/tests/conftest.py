@@ -0,0 +1,71 @@
+import os
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import db_models
+
+RANKS = ["A1", "A2", "B1", "B2"]
+
+
+def add_races(db, start: date, n_days: int, races_per_day: int = 2, venues=("01", "02"),
+              seed: int = 0, with_results: bool = True):
+    """12人の選手から6人ずつ出走するレース（出走表・結果・払戻金つき）を追加し、追加したレースを返す"""
+    rng = np.random.default_rng(seed)
+    first_id = (db.query(db_models.Race.id).order_by(db_models.Race.id.desc()).first() or (0,))[0] + 1
+    races = []
+    for day in range(n_days):
+        for k in range(races_per_day):
+            race = db_models.Race(
+                id=first_id + len(races), venue_code=venues[k % len(venues)],
+                race_date=start + timedelta(days=day), race_no=k // len(venues) + 1,
+                wind_speed=float(rng.integers(0, 6)), wave_height=float(rng.integers(0, 5)),
+            )
+            db.add(race)
+            racers = rng.choice(12, 6, replace=False)
+            for boat_no, racer in enumerate(racers, 1):
+                db.add(db_models.RaceEntry(
+                    race_id=race.id, boat_no=boat_no, racer_registration_no=str(4000 + racer),
+                    racer_rank=RANKS[racer % 4], win_rate_all=8.0 - racer * 0.4,
+                    place_rate_2_all=60.0 - racer * 3, win_rate_local=float(rng.uniform(3, 8)),
+                    place_rate_2_local=float(rng.uniform(20, 60)), motor_no=str(int(rng.integers(1, 5))),
+                    motor_rate_2=float(rng.uniform(20, 50)), boat_no_actual=str(int(rng.integers(1, 5))),
+                    boat_rate_2=float(rng.uniform(20, 50)), avg_start_timing=float(rng.uniform(0.12, 0.2)),
+                    weight=52.0, current_series_results="".join(map(str, rng.integers(1, 7, 3))),
+                ))
+            if with_results:
+                order = rng.permutation(6) + 1
+                courses = order if rng.random() < 0.3 else np.arange(1, 7)
+                db.add(db_models.RaceResult(
+                    race_id=race.id,
+                    **{f"place_{i}": int(order[i - 1]) for i in range(1, 7)},
+                    **{f"course_{i}": int(courses[i - 1]) for i in range(1, 7)},
+                    **{f"st_{i}": float(rng.uniform(0.05, 0.25)) for i in range(1, 7)},
+                    win=int(order[0]), win_payout=int(rng.integers(110, 2000)),
+                    exacta=f"{order[0]}-{order[1]}", exacta_payout=int(rng.integers(200, 8000)),
+                    trifecta=f"{order[0]}-{order[1]}-{order[2]}", trifecta_payout=int(rng.integers(500, 50000)),
+                ))
+            races.append(race)
+    db.commit()
+    return races
+
+
+@pytest.fixture
+def race_db(tmp_path):
+    """30日分のレースを入れた一時ファイルの SQLite（セッションファクトリを返す）"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'boatrace.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = factory()
+    add_races(db, date(2024, 1, 15), 30)
+    db.close()
+    yield factory
+    engine.dispose()
@@ -0,0 +1,107 @@
+"""Parquetエクスポートの差分・全件書き直しと、DuckDBの集計クエリの確認"""
+import os
+
+import pyarrow.dataset as ds
+import pytest
+
+from app.analytics.export import MANIFEST_NAME, ParquetExporter
+from app.analytics.queries import AnalyticsEngine, QueryError
+from app.models import db_models
+
+
+def count_rows(export_dir: str, table: str) -> int:
+    return ds.dataset(os.path.join(export_dir, table), format="parquet", partitioning="hive").count_rows()
+
+
+def test_incremental_export_rewrites_only_changed_partitions(race_db, tmp_path):
+    exporter = ParquetExporter(str(tmp_path / "parquet"))
+    db = race_db()
+    try:
+        first = exporter.export(db)
+        assert first["skipped"] == 0 and first["rows"]["races"] == db.query(db_models.Race).count()
+        assert exporter.export(db)["exported"] == 0
+
+        result = db.query(db_models.RaceResult).first()
+        result.trifecta_payout += 100
+        db.commit()
+        second = exporter.export(db)
+    finally:
+        db.close()
+    assert second["exported"] == 1
+    assert second["skipped"] == first["exported"] - 1
+
+
+def test_full_export_removes_stale_partitions(race_db, tmp_path):
+    export_dir = str(tmp_path / "parquet")
+    exporter = ParquetExporter(export_dir)
+    db = race_db()
+    try:
+        exporter.export(db)
+        # 会場 "02" のレースを削除し、マニフェストも失われた状態で全件書き直す
+        race_ids = [r.id for r in db.query(db_models.Race.id).filter(db_models.Race.venue_code == "02")]
+        for model in (db_models.RaceResult, db_models.RaceEntry):
+            db.query(model).filter(model.race_id.in_(race_ids)).delete(synchronize_session=False)
+        db.query(db_models.Race).filter(db_models.Race.id.in_(race_ids)).delete(synchronize_session=False)
+        db.commit()
+        os.remove(exporter.manifest_path)
+
+        result = exporter.export(db, incremental=False)
+        races = db.query(db_models.Race).count()
+    finally:
+        db.close()
+
+    assert result["removed"] == 2  # 2024-01/02, 2024-02/02
+    assert exporter.stored_partitions() == set(exporter.read_manifest()["partitions"])
+    assert count_rows(export_dir, "races") == races
+    assert count_rows(export_dir, "entries") == races * 6
+
+
+def test_queries_match_database_and_cache_until_reexport(race_db, tmp_path):
+    export_dir = str(tmp_path / "parquet")
+    engine = AnalyticsEngine(export_dir)
+    with pytest.raises(FileNotFoundError):
+        engine.run("venue_summary", {})
+
+    db = race_db()
+    try:
+        ParquetExporter(export_dir).export(db)
+        results = db.query(db_models.RaceResult).join(db_models.Race).filter(db_models.Race.venue_code == "01").all()
+
+        summary = engine.run("venue_summary", {"venue_code": "01"})
+        assert not summary["cached"]
+        row, = summary["rows"]
+        assert row["races"] == len(results)
+        assert row["boat1_win_rate"] == pytest.approx(sum(r.place_1 == 1 for r in results) / len(results))
+        assert engine.run("venue_summary", {"venue_code": "01"})["cached"]
+
+        courses = engine.run("course_win_rate", {"start_date": "2024-01-15", "end_date": "2024-02-13"})
+        assert [r["course"] for r in courses["rows"]] == [1, 2, 3, 4, 5, 6]
+        # 各レースの1着はちょうど1つのコース
+        total = db.query(db_models.RaceResult).count()
+        assert sum(r["win_rate"] * r["races"] for r in courses["rows"]) == pytest.approx(total)
+
+        stats = engine.run("racer_boat_stats", {"registration_no": "4000"})
+        starts = db.query(db_models.RaceEntry).filter(db_models.RaceEntry.racer_registration_no == "4000").count()
+        assert sum(r["starts"] for r in stats["rows"]) == starts
+
+        # 再エクスポートするとキャッシュは使われない
+        for result in results:
+            db.delete(result)
+        db.commit()
+        os.utime(os.path.join(export_dir, MANIFEST_NAME), (0, 0))  # 更新時刻の分解能に依存しないように
+        ParquetExporter(export_dir).export(db)
+    finally:
+        db.close()
+    after = engine.run("venue_summary", {"venue_code": "01"})
+    assert not after["cached"] and after["rows"] == []
+
+
+@pytest.mark.parametrize("name,params", [
+    ("unknown", {}),
+    ("venue_summary", {"limit": "1"}),
+    ("venue_summary", {"start_date": "2024-13-01"}),
+    ("racer_boat_stats", {}),
+])
+def test_invalid_queries_are_rejected(tmp_path, name, params):
+    with pytest.raises(QueryError):
+        AnalyticsEngine(str(tmp_path)).run(name, params)
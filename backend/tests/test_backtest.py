@@ -0,0 +1,59 @@
+"""バックテストの月単位チャンク・精算・並列実行時のスレッド配分の確認"""
+from datetime import date
+
+import numpy as np
+import pytest
+
+from app.models import db_models
+from ml import backtest
+from ml.backtest import Backtester, BacktestStrategy, _month_chunks, summarize
+
+
+def test_month_chunks_cover_period_without_gaps():
+    chunks = _month_chunks(date(2024, 1, 20), date(2024, 4, 3))
+    assert chunks[0][0] == date(2024, 1, 20)
+    assert chunks[-1][1] == date(2024, 4, 4)
+    assert [end for _, end in chunks[:-1]] == [start for start, _ in chunks[1:]]
+    assert all(end.day == 1 for _, end in chunks[:-1])
+    assert _month_chunks(date(2024, 2, 1), date(2024, 1, 31)) == []
+
+
+def test_thread_plan_never_oversubscribes_cores(monkeypatch):
+    monkeypatch.setattr(backtest.os, "cpu_count", lambda: 8)
+    strategy = BacktestStrategy()
+    assert Backtester(strategy, workers=4)._thread_plan(12) == (4, 2)
+    assert Backtester(strategy, workers=4)._thread_plan(2) == (2, 4)
+    assert Backtester(strategy, workers=16)._thread_plan(12) == (12, 1)
+    assert Backtester(strategy, workers=1)._thread_plan(12) == (1, 8)
+
+
+def test_summarize_roi_and_drawdown():
+    records = {
+        "bet": np.array([100, 100, 100, 0]),
+        "returned": np.array([0.0, 350.0, 0.0, 0.0]),
+        "hit": np.array([False, True, False, False]),
+        "missing_payout": np.zeros(4, dtype=bool),
+        "venue_code": np.array(["01", "02", "01", "02"]),
+    }
+    report = summarize(records)
+    assert report["races"] == 3 and report["hits"] == 1
+    assert report["profit"] == 50
+    assert report["max_drawdown"] == 100
+    assert report["by_venue"]["02"]["roi"] == pytest.approx(250.0)
+    assert summarize({}) == {"races": 0}
+
+
+def test_run_settles_every_race_once_across_chunks(race_db, monkeypatch):
+    monkeypatch.setattr(backtest, "SessionLocal", race_db)
+    strategy = BacktestStrategy(engine="statistical", bet_type="3連単", tickets_per_race=3)
+    report = Backtester(strategy, workers=1).run(date(2024, 1, 1), date(2024, 3, 31))
+
+    db = race_db()
+    results = db.query(db_models.RaceResult).all()
+    db.close()
+    assert report["races"] == len(results)
+    assert report["total_bet"] == len(results) * 3 * strategy.stake
+    assert 0 <= report["hits"] <= len(results)
+    # 的中したレースの払戻金だけが戻る
+    assert report["total_return"] <= sum(r.trifecta_payout for r in results)
+    assert sum(v["races"] for v in report["by_venue"].values()) == len(results)
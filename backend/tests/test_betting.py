@@ -0,0 +1,88 @@
+"""Harvilleモデルの的中確率と、期待値・ケリー基準による買い目選択の確認"""
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+from app.prediction.betting import (
+    BET_UNIT, TICKET_COMBINATIONS, TICKET_LABELS, TicketOptimizer,
+    odds_to_array, position_probabilities, ticket_probabilities,
+)
+
+
+def sample_win_probs(races: int = 5, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).dirichlet(np.ones(6), size=races)
+
+
+@pytest.mark.parametrize("bet_type", list(TICKET_COMBINATIONS))
+def test_ticket_probabilities_sum_to_one(bet_type):
+    probs = ticket_probabilities(sample_win_probs(), bet_type)
+    assert probs.shape == (5, len(TICKET_COMBINATIONS[bet_type]))
+    assert np.all(probs >= 0)
+    np.testing.assert_allclose(probs.sum(axis=1), 1.0)
+
+
+def test_trifecta_matches_harville_formula():
+    p = sample_win_probs(races=1)[0]
+    probs = ticket_probabilities(p[None, :], "3連単")[0]
+    for t, (a, b, c) in enumerate(TICKET_COMBINATIONS["3連単"]):
+        a, b, c = a - 1, b - 1, c - 1
+        expected = p[a] * p[b] / (1 - p[a]) * p[c] / (1 - p[a] - p[b])
+        np.testing.assert_allclose(probs[t], expected)
+
+    # 3連複は順序違いの3連単の合計
+    trio = ticket_probabilities(p[None, :], "3連複")[0]
+    for t, combo in enumerate(TICKET_COMBINATIONS["3連複"]):
+        np.testing.assert_allclose(trio[t], sum(
+            probs[TICKET_COMBINATIONS["3連単"].index(order)] for order in permutations(combo)
+        ))
+
+
+def test_unnormalized_and_missing_probabilities_are_normalized():
+    raw = np.array([[2.0, 1.0, 1.0, np.nan, 0.0, -1.0], [0.0] * 6])
+    win = ticket_probabilities(raw, "単勝")
+    np.testing.assert_allclose(win[0], [0.5, 0.25, 0.25, 0, 0, 0])
+    np.testing.assert_allclose(win[1], np.full(6, 1 / 6))
+
+
+def test_position_probabilities_are_distributions():
+    positions = position_probabilities(sample_win_probs())
+    np.testing.assert_allclose(positions.sum(axis=1), 1.0)
+    np.testing.assert_allclose(positions[:, :, 0], sample_win_probs())
+    assert np.all(positions.sum(axis=2) <= 1.0 + 1e-9)
+
+
+def test_kelly_fraction_and_selection():
+    probs = np.array([[0.5, 0.2, 0.3]])
+    odds = np.array([[3.0, 4.0, np.nan]])
+    evaluated = TicketOptimizer(kelly_fraction=0.5).evaluate(probs, odds)
+
+    # EV = p * odds - 1、フル・ケリー = EV / (odds - 1)
+    np.testing.assert_allclose(evaluated["expected_value"][0, :2], [0.5, -0.2])
+    np.testing.assert_allclose(evaluated["kelly"][0], [0.5 * 0.25, 0.0, 0.0])
+    assert evaluated["expected_value"][0, 2] == -np.inf
+
+
+def test_max_tickets_keeps_highest_expected_value():
+    probs = np.array([[0.3, 0.3, 0.3]])
+    odds = np.array([[4.0, 6.0, 5.0]])
+    evaluated = TicketOptimizer(max_tickets_per_race=2).evaluate(probs, odds)
+    assert list(evaluated["kelly"][0] > 0) == [False, True, True]
+
+
+def test_allocate_respects_budget_and_bet_unit():
+    optimizer = TicketOptimizer()
+    amounts = optimizer.allocate(np.array([[0.4, 0.5], [0.3, 0.0]]), budget=10_000)
+    assert amounts.sum() <= 10_000
+    assert np.all(amounts % BET_UNIT == 0)
+
+
+def test_optimize_returns_positive_expected_value_tickets():
+    win = np.array([[0.6, 0.1, 0.1, 0.1, 0.05, 0.05]])
+    odds = {label: 3.0 for label in TICKET_LABELS["単勝"]}
+    recommendation = TicketOptimizer().optimize([7], win, [odds], "単勝", budget=10_000)[0]
+
+    assert recommendation.race_id == 7
+    assert [t.numbers for t in recommendation.tickets] == ["1"]
+    assert recommendation.total_amount == sum(t.amount for t in recommendation.tickets) > 0
+    np.testing.assert_allclose(odds_to_array("単勝", odds), 3.0)
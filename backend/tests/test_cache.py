@@ -0,0 +1,123 @@
+"""予想キャッシュのキーと、結果・特徴量ストアの更新によるキャッシュの切り替わりの確認"""
+from datetime import date
+
+import pytest
+
+from app.models import db_models
+from app.models.schemas import PredictionWeights, StatisticalPrediction
+from app.prediction.cache import PredictionCache, prediction_key
+from app.prediction.course_entry import CourseEntryModel
+from app.prediction.ml_model import MLPredictor
+from app.prediction.statistical import StatisticalPredictor
+from ml import feature_store
+from ml.dataset import load_training_arrays
+from ml.matchup import MatchupMatrix
+from ml.registry import ModelRegistry
+from ml.train import BoatRaceModelTrainer
+from conftest import add_races
+
+
+def race_card(db, race_id):
+    race = db.get(db_models.Race, race_id)
+    entries = db.query(db_models.RaceEntry).filter(db_models.RaceEntry.race_id == race_id).all()
+    return race, entries
+
+
+@pytest.fixture
+def today_db(race_db):
+    """過去30日分の結果に加えて、結果の出ていない今日のレースがあるDB（今日のレースのIDも返す）"""
+    db = race_db()
+    pending = add_races(db, date.today(), 1, with_results=False, seed=5)
+    return db, [race.id for race in pending]
+
+
+def test_persisted_prediction_is_shared_and_replaced(today_db):
+    db, (race_id, _) = today_db
+    try:
+        race, entries = race_card(db, race_id)
+        predictor = StatisticalPredictor(course_model=CourseEntryModel())
+        weights = PredictionWeights()
+        key = prediction_key("statistical", race, entries, weights.model_dump(), predictor.engine_version)
+        cache = PredictionCache()
+        assert cache.get(db, key, StatisticalPrediction) is None
+        cache.put(db, "statistical", race_id, key, predictor.predict(entries, weights))
+
+        # 別プロセス（別のキャッシュ）からはテーブルで当たる
+        other = PredictionCache()
+        assert other.get(db, key, StatisticalPrediction) is not None
+        assert (cache.misses, other.hits) == (1, 1)
+
+        # 同じレース・エンジンの新しいキーの予想は古い予想と置き換わる
+        new_key = prediction_key("statistical", race, entries, weights.model_dump(), "other-version")
+        cache.put(db, "statistical", race_id, new_key, predictor.predict(entries, weights))
+        stored = db.query(db_models.CachedPrediction.cache_key).filter(
+            db_models.CachedPrediction.race_id == race_id).all()
+        assert stored == [(new_key,)]
+
+        assert cache.invalidate(db, race_id) == 2
+        assert PredictionCache().get(db, new_key, StatisticalPrediction) is None
+    finally:
+        db.close()
+
+
+def test_new_result_changes_the_key_on_the_same_day(today_db):
+    db, (race_id, _) = today_db
+    try:
+        race, entries = race_card(db, race_id)
+        course_model = CourseEntryModel()
+        course_model.fit(db)
+        predictor = StatisticalPredictor(course_model=course_model)
+        params = PredictionWeights().model_dump()
+        key = prediction_key("statistical", race, entries, params, predictor.engine_version)
+        assert prediction_key("statistical", race, entries, params, predictor.engine_version) == key
+
+        # 同じ日のうちに結果が加わっても別のキーになる
+        add_races(db, date.today(), 1, races_per_day=1, seed=6)
+        course_model.refresh(db)
+        assert prediction_key("statistical", race, entries, params, predictor.engine_version) != key
+    finally:
+        db.close()
+
+
+def test_feature_context_version_follows_store_and_matchups(race_db, tmp_path, monkeypatch):
+    matrix = MatchupMatrix(str(tmp_path / "matchups"))
+    monkeypatch.setattr(feature_store, "SessionLocal", race_db)
+    monkeypatch.setattr(feature_store, "matchup_matrix", matrix)
+    db = race_db()
+    try:
+        first = feature_store.feature_context_version()
+        assert feature_store.feature_context_version() == first
+
+        feature_store.racer_feature_store.rebuild(db)
+        after_rebuild = feature_store.feature_context_version()
+        assert after_rebuild != first
+
+        race, = add_races(db, date(2024, 3, 1), 1, races_per_day=1, seed=7)
+        feature_store.update_race(db, race.id)
+        after_update = feature_store.feature_context_version()
+        assert after_update != after_rebuild
+
+        matrix.refresh(db)
+        assert feature_store.feature_context_version() != after_update
+    finally:
+        db.close()
+
+
+def test_ml_engine_version_includes_feature_context(race_db, tmp_path):
+    db = race_db()
+    try:
+        feature_store.ensure_built(db)
+        trainer = BoatRaceModelTrainer(params={"n_estimators": 5, "min_child_samples": 5}, verbose=False)
+        trainer.fit(load_training_arrays(db))
+    finally:
+        db.close()
+
+    generation = {"value": "g1"}
+    predictor = MLPredictor(bundle=trainer.bundle(), registry=ModelRegistry(str(tmp_path)),
+                            course_model=CourseEntryModel(), context_version=lambda: generation["value"])
+    version = predictor.engine_version
+    generation["value"] = "g2"
+    assert predictor.engine_version != version
+    # 特徴量ストアを引かない予想（合成レースのベンチマーク）のキーには含めない
+    predictor.context_loader = None
+    assert "g2" not in predictor.engine_version
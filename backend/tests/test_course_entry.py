@@ -0,0 +1,47 @@
+"""進入予測の学習データ用の分布（前日までの結果だけで学習）の確認"""
+from datetime import date
+
+import numpy as np
+
+from app.models import db_models
+from app.prediction.course_entry import point_in_time_course_probs
+from ml.dataset import load_training_arrays
+from ml.feature_store import equipment_feature_store, racer_feature_store
+from conftest import add_races
+
+
+def training_rows(db, since=None):
+    """load_training_arrays と同じ対象行（6艇揃いのレース）の識別情報と実際の進入コース"""
+    data = load_training_arrays(db, since=since)
+    results = {r.race_id: r for r in db.query(db_models.RaceResult).all()}
+    entries = {(e.race_id, e.boat_no): e.racer_registration_no for e in db.query(db_models.RaceEntry).all()}
+    course = np.array([
+        [getattr(results[race], f"course_{i}") for i in range(1, 7)].index(boat) + 1
+        for race, boat in zip(data["race_id"], data["boat_no"])
+    ])
+    registration_no = np.array([entries[key] for key in zip(data["race_id"], data["boat_no"])], dtype=object)
+    return data["race_id"], data["race_date"], registration_no, data["boat_no"], course
+
+
+def test_split_period_matches_single_pass(race_db):
+    db = race_db()
+    try:
+        # 5艇しかいないレースの結果は学習データにないので、どちらの経路でも数えない
+        short_race, = add_races(db, date(2024, 1, 20), 1, races_per_day=1, seed=3)
+        db.query(db_models.RaceEntry).filter(
+            db_models.RaceEntry.race_id == short_race.id, db_models.RaceEntry.boat_no == 6
+        ).delete()
+        db.commit()
+        racer_feature_store.rebuild(db)
+        equipment_feature_store.rebuild(db)
+
+        full = point_in_time_course_probs(db, *training_rows(db))
+        since = date(2024, 2, 1)
+        race_id, race_date, registration_no, boat_no, course = training_rows(db, since=since)
+        split = point_in_time_course_probs(db, race_id, race_date, registration_no, boat_no, course, since=since)
+        all_dates = training_rows(db)[1]
+    finally:
+        db.close()
+
+    np.testing.assert_allclose(split, full[all_dates >= since.toordinal()])
+    np.testing.assert_allclose(full.sum(axis=1), 1.0, atol=1e-4)
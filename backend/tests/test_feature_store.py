@@ -0,0 +1,88 @@
+"""特徴量ストアの直近成績の集計と、学習・推論共通の特徴量の確認"""
+import numpy as np
+import pandas as pd
+
+from ml.feature_store import FORM_COLUMNS, compute_form
+from ml.features import CONTEXT_COLUMNS, FEATURE_NAMES, build_feature_matrix
+
+
+def sample_history(n_racers: int = 3, n_days: int = 25, seed: int = 0) -> pd.DataFrame:
+    """load_history と同じ列・並びの出走履歴（1日に1〜2走、欠損値を含む）"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    race_id = 0
+    for racer in range(n_racers):
+        for day in range(n_days):
+            for race_no in range(1, int(rng.integers(1, 3)) + 1):
+                race_id += 1
+                rows.append({
+                    "registration_no": str(4000 + racer),
+                    "race_date": 738000 + day,
+                    "race_no": race_no,
+                    "race_id": race_id,
+                    "venue_code": "01",
+                    "motor_no": str(int(rng.integers(1, 3))),
+                    "boat_no": int(rng.integers(1, 7)),
+                    "position": float(rng.integers(1, 7)) if rng.random() > 0.1 else np.nan,
+                    "st": float(rng.normal(0.15, 0.05)) if rng.random() > 0.1 else np.nan,
+                    "course": float(rng.integers(1, 7)),
+                })
+    return pd.DataFrame(rows)
+
+
+def test_compute_form_matches_naive_windows():
+    history = sample_history()
+    form = compute_form(history, window=10, course_window=30)
+
+    for _, row in form.iterrows():
+        past = history[(history["registration_no"] == row["registration_no"])
+                       & (history["race_date"] <= row["as_of_date"])]
+        recent = past.tail(10)
+        position, st = recent["position"], recent["st"].dropna()
+        assert row["races"] == len(recent)
+        np.testing.assert_allclose(row["avg_position"], position.mean())
+        np.testing.assert_allclose(row["top2_rate"], (position <= 2).sum() / len(recent))
+        np.testing.assert_allclose(row["st_mean"], st.mean())
+        if len(st) >= 2:
+            np.testing.assert_allclose(row["st_std"], st.std(ddof=0), atol=1e-9)
+
+        course_recent = past.tail(30)
+        for k in range(1, 7):
+            in_course = course_recent[course_recent["course"] == k]
+            expected = (in_course["position"] <= 2).sum() / len(in_course) if len(in_course) else np.nan
+            np.testing.assert_allclose(row[f"course_{k}_top2"], expected)
+
+        motor = past[past["motor_no"] == past["motor_no"].iloc[-1]].tail(10)
+        assert row["motor_races"] == len(motor)
+        np.testing.assert_allclose(row["motor_avg_position"], motor["position"].mean())
+
+
+def test_compute_form_keeps_last_race_of_each_day():
+    history = sample_history()
+    form = compute_form(history)
+    assert list(form.columns) == ["registration_no", "as_of_date", *FORM_COLUMNS]
+    assert not form.duplicated(["registration_no", "as_of_date"]).any()
+    assert len(form) == len(history[["registration_no", "race_date"]].drop_duplicates())
+
+
+def test_context_features_use_predicted_course_distribution():
+    columns = {name: np.full(2, np.nan) for name in
+               ["boat_no", "win_rate_all", "place_rate_2_all", "win_rate_local", "place_rate_2_local",
+                "motor_rate_2", "boat_rate_2", "avg_start_timing", "rank_numeric", "weight"]}
+    columns["boat_no"] = np.array([1.0, 2.0])
+    context = {name: np.full(2, np.nan) for name in CONTEXT_COLUMNS}
+    context["form_avg_position"] = np.array([2.5, np.nan])
+    context["form_course_1_top2"] = np.array([0.8, 0.4])
+    context["form_course_2_top2"] = np.array([0.2, np.nan])
+    course_probs = np.zeros((2, 6))
+    course_probs[0, :2] = [0.75, 0.25]
+    course_probs[1, 1] = 1.0
+
+    X = build_feature_matrix(columns, np.zeros(2), course_probs, context)
+    features = dict(zip(FEATURE_NAMES, X.T))
+    np.testing.assert_allclose(features["form_avg_position"], [2.5, np.nan])
+    # 成績のないコースに入る見込みしかない艇は欠損
+    np.testing.assert_allclose(features["form_course_top2"], [0.75 * 0.8 + 0.25 * 0.2, np.nan])
+
+    missing = build_feature_matrix(columns, np.zeros(2), course_probs)
+    assert np.isnan(missing[:, FEATURE_NAMES.index("form_top2_rate")]).all()
@@ -0,0 +1,137 @@
+"""選手同士の対戦成績の疎行列と、学習用のレース前日までの field_score の確認"""
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import db_models
+from ml.matchup import MatchupMatrix, point_in_time_field_score
+
+RACERS = [str(4000 + k) for k in range(9)]
+
+
+def sample_db(n_races: int = 40, seed: int = 0):
+    """9人から6人ずつ出走するレースを1日2レース作ったメモリ上のDB（着順不明の艇を含む）"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    rng = np.random.default_rng(seed)
+    for race_id in range(1, n_races + 1):
+        db.add(db_models.Race(id=race_id, venue_code="01", race_no=race_id % 2 + 1,
+                              race_date=date(2024, 1, 1) + timedelta(days=race_id // 2)))
+        for boat_no, reg in enumerate(rng.choice(RACERS, 6, replace=False), 1):
+            db.add(db_models.RaceEntry(race_id=race_id, boat_no=boat_no, racer_registration_no=str(reg)))
+        order = rng.permutation(6) + 1
+        places = {f"place_{k}": int(boat) for k, boat in enumerate(order, 1) if k < 6 or rng.random() > 0.3}
+        db.add(db_models.RaceResult(race_id=race_id, **places))
+    db.commit()
+    return db
+
+
+def card(db, race_ids):
+    """艇番順の選手登録番号 (races, 6) と各行のレースID・開催日・艇番・選手登録番号"""
+    entries = db.query(db_models.RaceEntry, db_models.Race.race_date).join(
+        db_models.Race, db_models.Race.id == db_models.RaceEntry.race_id
+    ).filter(db_models.RaceEntry.race_id.in_(race_ids.tolist())).order_by(
+        db_models.RaceEntry.race_id, db_models.RaceEntry.boat_no
+    ).all()
+    race_id = np.array([e.race_id for e, _ in entries])
+    boat_no = np.array([e.boat_no for e, _ in entries])
+    race_date = np.array([d.toordinal() for _, d in entries])
+    registration_no = [e.racer_registration_no for e, _ in entries]
+    grid = np.full((len(race_ids), 6), None, dtype=object)
+    grid[np.searchsorted(race_ids, race_id), boat_no - 1] = registration_no
+    return grid, race_id, race_date, boat_no, registration_no
+
+
+def naive_counts(db, registration_no, opponent_no, before=None):
+    """2選手の先着数・同走数を全結果の走査で数える（着順不明は完走した艇より後ろ）"""
+    ahead = meetings = 0
+    for result, race_date in db.query(db_models.RaceResult, db_models.Race.race_date).join(
+        db_models.Race, db_models.Race.id == db_models.RaceResult.race_id
+    ):
+        if before is not None and race_date.toordinal() >= before:
+            continue
+        boats = {e.racer_registration_no: e.boat_no for e in
+                 db.query(db_models.RaceEntry).filter(db_models.RaceEntry.race_id == result.race_id)}
+        if registration_no not in boats or opponent_no not in boats:
+            continue
+        places = [getattr(result, f"place_{k}") for k in range(1, 7)]
+        position = {boat: (places.index(boat) + 1 if boat in places else 7) for boat in boats.values()}
+        meetings += 1
+        ahead += position[boats[registration_no]] < position[boats[opponent_no]]
+    return ahead, meetings
+
+
+def test_pair_matches_naive_counts_after_refresh(tmp_path):
+    db = sample_db()
+    matrix = MatchupMatrix(str(tmp_path))
+    matrix.rebuild(db)
+
+    # 差分（refresh）と本体の合算・統合後の本体のどちらでも全走査と一致する
+    extra = sample_db(n_races=50, seed=1)
+    for race_id in range(41, 51):
+        race = extra.get(db_models.Race, race_id)
+        db.add(db_models.Race(id=race_id, venue_code="01", race_no=race.race_no, race_date=race.race_date))
+        for entry in extra.query(db_models.RaceEntry).filter(db_models.RaceEntry.race_id == race_id):
+            db.add(db_models.RaceEntry(race_id=race_id, boat_no=entry.boat_no,
+                                       racer_registration_no=entry.racer_registration_no))
+        result = extra.query(db_models.RaceResult).filter(db_models.RaceResult.race_id == race_id).one()
+        db.add(db_models.RaceResult(race_id=race_id, **{
+            f"place_{k}": getattr(result, f"place_{k}") for k in range(1, 7)
+        }))
+    db.commit()
+    assert matrix.refresh(db) == 10
+
+    for compacted in (False, True):
+        if compacted:
+            matrix.compact()
+        for reg, opponent in [(RACERS[0], RACERS[1]), (RACERS[3], RACERS[8]), (RACERS[5], RACERS[2])]:
+            ahead, meetings = naive_counts(db, reg, opponent)
+            pair = matrix.pair(reg, opponent)
+            assert (pair["ahead"], pair["meetings"]) == (ahead, meetings)
+
+
+def test_point_in_time_field_score_matches_matrix_and_excludes_race_day(tmp_path):
+    db = sample_db()
+    race_ids = np.arange(1, 41)
+    grid, race_id, race_date, boat_no, registration_no = card(db, race_ids)
+
+    # 全結果より後の日付なら疎行列の race_features と一致する
+    matrix = MatchupMatrix(str(tmp_path))
+    matrix.rebuild(db)
+    expected = matrix.race_features(grid)["field_score"][np.searchsorted(race_ids, race_id), boat_no - 1]
+    after_all = np.full(len(race_id), race_date.max() + 1)
+    later = point_in_time_field_score(db, race_id, after_all, registration_no, boat_no)
+    np.testing.assert_allclose(later, expected)
+
+    # 各行の開催日より前の結果だけで数える
+    field_score = point_in_time_field_score(db, race_id, race_date, registration_no, boat_no)
+    for row in range(0, len(race_id), 7):
+        opponents = [registration_no[k] for k in np.nonzero(race_id == race_id[row])[0] if k != row]
+        rates = []
+        for opponent in opponents:
+            ahead, meetings = naive_counts(db, registration_no[row], opponent, before=race_date[row])
+            rates.append((ahead + 1) / (meetings + 2))
+        np.testing.assert_allclose(field_score[row], np.mean(rates))
+    assert np.all(field_score[race_date == race_date.min()] == 0.5)
+
+
+def test_serving_field_score_uses_the_training_cutoff(tmp_path):
+    db = sample_db()
+    race_ids = np.arange(1, 41)
+    grid, race_id, race_date, boat_no, registration_no = card(db, race_ids)
+    race_dates = np.array([race_date[race_id == r][0] for r in race_ids])
+
+    # 疎行列はすべての結果（当日・そのレース自身の結果を含む）を反映済み
+    matrix = MatchupMatrix(str(tmp_path))
+    matrix.rebuild(db)
+    serving = matrix.race_features_before(db, grid, race_dates)["field_score"]
+    training = point_in_time_field_score(db, race_id, race_date, registration_no, boat_no)
+    np.testing.assert_allclose(serving[np.searchsorted(race_ids, race_id), boat_no - 1], training)
+
+    # 結果より後の開催日なら何も差し引かない
+    later = matrix.race_features_before(db, grid, race_dates + 100)["field_score"]
+    np.testing.assert_allclose(later, matrix.race_features(grid)["field_score"])
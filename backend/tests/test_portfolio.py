@@ -0,0 +1,71 @@
+"""1日の予算配分（Frank-Wolfe法）の制約と入力検証の確認"""
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from app.models.schemas import PortfolioRequest
+from app.prediction.betting import BET_UNIT, ticket_probabilities
+from app.prediction.portfolio import PortfolioAllocator
+
+
+def sample_market(races: int = 8, seed: int = 0):
+    """1着確率から計算した単勝の的中確率と、控除率25%前後のばらついたオッズ"""
+    rng = np.random.default_rng(seed)
+    probs = ticket_probabilities(rng.dirichlet(np.ones(6), size=races), "単勝")
+    odds = 0.75 / probs * rng.uniform(0.8, 1.6, size=probs.shape)
+    odds[0, 0] = np.nan  # 購入不可の買い目
+    return probs, odds
+
+
+@pytest.mark.parametrize("per_race_limit,total_limit", [(0.1, 1.0), (0.2, 0.3), (0.05, 0.05)])
+def test_fractions_respect_limits(per_race_limit, total_limit):
+    probs, odds = sample_market()
+    fractions = PortfolioAllocator(per_race_limit, total_limit).solve(probs, odds)["fractions"]
+
+    assert np.all(fractions >= 0)
+    assert np.all(fractions.sum(axis=1) <= per_race_limit + 1e-9)
+    assert fractions.sum() <= total_limit + 1e-9
+    assert fractions[0, 0] == 0
+
+
+def test_solution_beats_no_bet_and_scaled_down_allocation():
+    probs, odds = sample_market()
+    allocator = PortfolioAllocator(per_race_limit=0.5, total_limit=1.0)
+    solution = allocator.solve(probs, odds)
+    valid = np.isfinite(odds)
+    p = np.where(valid, probs, 0)
+    p_none = 1 - p.sum(axis=1, keepdims=True)
+    o = np.where(valid, odds, 0)
+
+    assert solution["expected_log_growth"] >= allocator._objective(np.zeros_like(p), p, o, p_none) - 1e-12
+    # 配分を一律に縮めた実行可能解より悪くならない
+    perturbed = solution["fractions"] * 0.9
+    assert solution["expected_log_growth"] >= allocator._objective(perturbed, p, o, p_none) - 1e-9
+
+
+def test_allocate_amounts_stay_within_budget_limits():
+    probs, odds = sample_market()
+    result = PortfolioAllocator(per_race_limit=0.1, total_limit=0.4).allocate(
+        list(range(len(probs))), "単勝", probs, odds, budget=50_000
+    )
+    per_race = [r.total_amount for r in result["recommendations"]]
+    assert max(per_race) <= 5_000
+    assert result["total_amount"] == sum(per_race) <= 20_000
+    assert all(t.amount % BET_UNIT == 0 for r in result["recommendations"] for t in r.tickets)
+
+
+@pytest.mark.parametrize("per_race_limit,total_limit", [(0, 1.0), (-0.1, 1.0), (1.0, 1.0), (0.1, 0), (0.1, 1.5), (0.3, 0.2)])
+def test_invalid_limits_are_rejected(per_race_limit, total_limit):
+    with pytest.raises(ValueError):
+        PortfolioAllocator(per_race_limit=per_race_limit, total_limit=total_limit)
+    with pytest.raises(ValidationError):
+        PortfolioRequest(odds={}, per_race_limit=per_race_limit, total_limit=total_limit)
+
+
+@pytest.mark.parametrize("budget", [0, -100])
+def test_invalid_budget_is_rejected(budget):
+    probs, odds = sample_market()
+    with pytest.raises(ValueError):
+        PortfolioAllocator().allocate(list(range(len(probs))), "単勝", probs, odds, budget=budget)
+    with pytest.raises(ValidationError):
+        PortfolioRequest(odds={}, budget=budget)
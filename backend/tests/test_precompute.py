@@ -0,0 +1,80 @@
+"""予想の事前計算の対象レースの選び方と、バージョン変更後の積み直しの確認"""
+from datetime import date, timedelta
+
+import pytest
+
+from app import events
+from app.prediction import precompute
+from app.prediction.cache import PredictionCache
+from app.prediction.course_entry import CourseEntryModel
+from app.prediction.precompute import PredictionPrecomputer
+from app.prediction.statistical import StatisticalPredictor
+from conftest import add_races
+
+
+@pytest.fixture
+def upcoming(race_db):
+    """結果の出ていない今日のレース・結果の出た今日のレース・結果の出ていない過去のレースのID"""
+    db = race_db()
+    try:
+        added = {
+            "pending": add_races(db, date.today(), 1, with_results=False, seed=5),
+            "finished": add_races(db, date.today(), 1, races_per_day=1, seed=6),
+            "stale": add_races(db, date.today() - timedelta(days=1), 1, races_per_day=1,
+                               with_results=False, seed=7),
+        }
+        return {name: [race.id for race in races] for name, races in added.items()}
+    finally:
+        db.close()
+
+
+def make_precomputer(course_model):
+    precomputer = PredictionPrecomputer(cache=PredictionCache(persist=False), wait_seconds=30)
+    precomputer.statistical_predictor = StatisticalPredictor(course_model=course_model)
+    return precomputer
+
+
+def test_process_skips_finished_and_past_races_and_cached_ones(race_db, upcoming):
+    db = race_db()
+    try:
+        course_model = CourseEntryModel()
+        course_model.fit(db)
+        precomputer = make_precomputer(course_model)
+        all_ids = sum(upcoming.values(), [])
+
+        assert precomputer.process(db, all_ids) == {"statistical": len(upcoming["pending"]), "ml": 0}
+        # キーが変わらなければキャッシュから返るので計算しない
+        assert precomputer.process(db, all_ids)["statistical"] == 0
+
+        # 結果が増えて進入予測のバージョンが変わると計算し直す
+        add_races(db, date.today(), 1, races_per_day=1, seed=8)
+        course_model.refresh(db)
+        assert precomputer.process(db, all_ids)["statistical"] == len(upcoming["pending"])
+    finally:
+        db.close()
+
+
+def test_enqueue_upcoming_adds_only_pending_races(race_db, upcoming, monkeypatch):
+    monkeypatch.setattr(precompute, "SessionLocal", race_db)
+    precomputer = make_precomputer(CourseEntryModel())
+    assert precomputer.enqueue_upcoming() == 0  # 起動していない間は何もしない
+
+    precomputer.start(precomputer.statistical_predictor, None)
+    try:
+        assert precomputer.enqueue_upcoming() == len(upcoming["pending"])
+        # wait_seconds の間は同じ開催日のレースを待つので、まだ計算待ちに残っている
+        assert precomputer.pending() == len(upcoming["pending"])
+    finally:
+        precomputer.stop()
+
+
+def test_result_refresh_requeues_upcoming_races(race_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(events.prediction_precomputer, "enqueue_upcoming", lambda db: calls.append(db))
+    monkeypatch.setattr(events, "RESULT_MODELS", {})
+    db = race_db()
+    try:
+        events.ResultRefreshWorker().process(db, [])
+    finally:
+        db.close()
+    assert calls == [db]
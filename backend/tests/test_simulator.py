@@ -0,0 +1,76 @@
+"""モンテカルロ・シミュレーションの着順分布の確認"""
+import numpy as np
+
+from app.models import db_models
+from app.prediction.betting import TICKET_COMBINATIONS
+from app.prediction.course_entry import CourseEntryModel
+from app.prediction.simulator import RaceSimulator
+from app.prediction.start_timing import StartTimingModel
+
+
+def sample_inputs(races: int = 3, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return {
+        "st_mean": rng.uniform(0.12, 0.2, (races, 6)),
+        "st_std": np.full((races, 6), 0.03),
+        "skill": rng.standard_normal((races, 6)),
+        "motor": rng.standard_normal((races, 6)),
+    }
+
+
+def test_distributions_are_consistent():
+    result = RaceSimulator(n_simulations=20_000, seed=0).simulate(**sample_inputs())
+    positions, trifecta = result["position_probs"], result["trifecta_probs"]
+
+    # 各艇はどこかの着順、各着順はどれかの艇
+    np.testing.assert_allclose(positions.sum(axis=2), 1.0)
+    np.testing.assert_allclose(positions.sum(axis=1), 1.0)
+    np.testing.assert_allclose(trifecta.sum(axis=1), 1.0)
+    # 3連単の1着の周辺分布は1着確率と一致する
+    first = np.array([a for a, _, _ in TICKET_COMBINATIONS["3連単"]]) - 1
+    for boat in range(6):
+        np.testing.assert_allclose(trifecta[:, first == boat].sum(axis=1), positions[:, boat, 0])
+
+
+def test_batching_does_not_change_the_distribution():
+    inputs = sample_inputs()
+    whole = RaceSimulator(n_simulations=60_000, seed=1).simulate(**inputs)["position_probs"]
+    chunked = RaceSimulator(n_simulations=60_000, max_batch_samples=1_000, seed=2).simulate(**inputs)["position_probs"]
+    np.testing.assert_allclose(whole, chunked, atol=0.015)
+
+    again = RaceSimulator(n_simulations=60_000, seed=1).simulate(**inputs)["position_probs"]
+    np.testing.assert_array_equal(whole, again)
+
+
+def test_stronger_boats_and_flying_starts():
+    inputs = {
+        "st_mean": np.full((1, 6), 0.15),
+        "st_std": np.full((1, 6), 0.02),
+        "skill": np.array([[0.0, 0.0, 3.0, 0.0, 0.0, 0.0]]),
+        "motor": np.zeros((1, 6)),
+        "course": np.array([[4, 2, 3, 1, 5, 6]]),
+    }
+    positions = RaceSimulator(n_simulations=20_000, seed=0).simulate(**inputs)["position_probs"][0]
+    assert positions[2, 0] > positions[[0, 1, 4, 5], 0].max()
+    # 1コースに入る4号艇は同じ能力の艇より勝ちやすい
+    assert positions[3, 0] > positions[0, 0]
+
+    inputs["st_mean"][0, 2] = -0.5  # 確実にフライングする艇は最下位
+    positions = RaceSimulator(n_simulations=5_000, seed=0).simulate(**inputs)["position_probs"][0]
+    np.testing.assert_allclose(positions[2, 5], 1.0)
+
+
+def test_predict_from_race_card(race_db):
+    db = race_db()
+    try:
+        entries = db.query(db_models.RaceEntry).filter(db_models.RaceEntry.race_id == 1).all()
+        simulator = RaceSimulator(n_simulations=5_000, seed=0, start_timing=StartTimingModel(),
+                                  course_model=CourseEntryModel())
+        prediction = simulator.predict(db, entries)
+    finally:
+        db.close()
+
+    assert prediction.race_id == 1 and prediction.n_simulations == 5_000
+    assert sorted(p.boat_no for p in prediction.probabilities) == list(range(1, 7))
+    assert abs(sum(p.prob_1st for p in prediction.probabilities) - 1) < 1e-3
+    assert prediction.predicted_rank == prediction.trifecta_top[0].numbers
@@ -0,0 +1,83 @@
+"""学習データのスナップショットの差分更新の確認"""
+from datetime import date
+
+import numpy as np
+
+from app.models import db_models
+from ml.dataset import load_training_arrays
+from ml.feature_store import equipment_feature_store, racer_feature_store
+from ml.snapshot import ARRAY_NAMES, DatasetSnapshotStore
+from conftest import add_races
+
+
+def build_db(race_db):
+    db = race_db()
+    add_races(db, date(2024, 3, 1), 20, seed=1)
+    racer_feature_store.rebuild(db)
+    equipment_feature_store.rebuild(db)
+    return db
+
+
+def assert_same(left, right):
+    for name in ARRAY_NAMES:
+        np.testing.assert_array_equal(left[name], right[name])
+
+
+def test_refresh_rebuilds_changed_and_later_months(race_db, tmp_path):
+    db = build_db(race_db)
+    try:
+        store = DatasetSnapshotStore(str(tmp_path / "snapshots"))
+        assert store.refresh(db, verbose=False) == {"rebuilt": 3, "reused": 0, "removed": 0}
+        assert store.refresh(db, verbose=False) == {"rebuilt": 0, "reused": 3, "removed": 0}
+
+        # 3月の結果の訂正は3月だけ、2月の訂正は2月と3月を再抽出する
+        march = db.query(db_models.RaceResult).join(db_models.Race).filter(
+            db_models.Race.race_date >= date(2024, 3, 1)).first()
+        march.place_1, march.place_2 = march.place_2, march.place_1
+        db.commit()
+        assert store.refresh(db, verbose=False)["rebuilt"] == 1
+
+        february = db.query(db_models.RaceResult).join(db_models.Race).filter(
+            db_models.Race.race_date >= date(2024, 2, 1)).first()
+        february.course_1, february.course_2 = february.course_2, february.course_1
+        db.commit()
+        assert store.refresh(db, verbose=False) == {"rebuilt": 2, "reused": 1, "removed": 0}
+
+        assert_same(store.load(db, refresh=False), load_training_arrays(db))
+        fresh = DatasetSnapshotStore(str(tmp_path / "fresh"))
+        assert_same(store.load(db, refresh=False), fresh.load(db))
+    finally:
+        db.close()
+
+
+def test_load_period_matches_direct_extraction(race_db, tmp_path):
+    db = build_db(race_db)
+    try:
+        store = DatasetSnapshotStore(str(tmp_path / "snapshots"))
+        data = store.load(db, since=date(2024, 2, 10), before=date(2024, 3, 5))
+        full = load_training_arrays(db)
+    finally:
+        db.close()
+
+    period = (full["race_date"] >= date(2024, 2, 10).toordinal()) & (full["race_date"] < date(2024, 3, 5).toordinal())
+    assert period.any()
+    assert_same(data, {name: full[name][period] for name in ARRAY_NAMES})
+
+
+def test_feature_store_changes_rebuild_affected_months(race_db, tmp_path):
+    db = build_db(race_db)
+    try:
+        store = DatasetSnapshotStore(str(tmp_path / "snapshots"))
+        store.refresh(db, verbose=False)
+        # 作り直しても値が同じなら再抽出しない
+        racer_feature_store.rebuild(db)
+        assert store.refresh(db, verbose=False)["rebuilt"] == 0
+
+        row = db.query(db_models.RacerFeature).filter(
+            db_models.RacerFeature.as_of_date >= date(2024, 2, 1)).first()
+        row.win_rate = (row.win_rate or 0) + 0.5
+        db.commit()
+        assert store.refresh(db, verbose=False) == {"rebuilt": 2, "reused": 1, "removed": 0}
+        assert_same(store.load(db, refresh=False), load_training_arrays(db))
+    finally:
+        db.close()
@@ -0,0 +1,80 @@
+"""配列化した決定木アンサンブルが LightGBM と同じ予測値を返すことの確認"""
+import numpy as np
+import pytest
+from lightgbm import LGBMClassifier, LGBMRanker
+
+from app.prediction.tree_ensemble import CompiledTreeEnsemble
+
+
+N_FEATURES = 8
+PARAMS = {"n_estimators": 40, "num_leaves": 15, "max_depth": 5, "min_child_samples": 5, "verbose": -1}
+# 欠損値の扱いごとの学習設定（NaN / Zero / None）
+MISSING_PARAMS = {
+    "nan": {},
+    "zero": {"zero_as_missing": True},
+    "none": {"use_missing": False},
+}
+
+
+def sample_data(n_rows: int, seed: int):
+    """欠損値と0を含む入力と、それに応じた目的変数"""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, N_FEATURES))
+    X[rng.random(X.shape) < 0.05] = np.nan
+    X[rng.random(X.shape) < 0.05] = 0.0
+    signal = np.nan_to_num(X[:, 0] + 0.5 * X[:, 1] - 0.3 * X[:, 2]) + rng.normal(size=n_rows)
+    return X, signal
+
+
+@pytest.fixture(scope="module")
+def test_rows():
+    X, _ = sample_data(600, seed=1)
+    # 全て欠損・全て0の行も含める
+    X[0] = np.nan
+    X[1] = 0.0
+    return X
+
+
+@pytest.mark.parametrize("missing", MISSING_PARAMS)
+def test_binary_matches_lightgbm(missing, test_rows):
+    X, signal = sample_data(3000, seed=0)
+    model = LGBMClassifier(**PARAMS, **MISSING_PARAMS[missing]).fit(X, (signal > 0.5).astype(int))
+    compiled = CompiledTreeEnsemble.from_lightgbm(model)
+
+    assert compiled.n_trees == PARAMS["n_estimators"]
+    np.testing.assert_allclose(
+        compiled.predict_raw(test_rows), model.predict(test_rows, raw_score=True), rtol=1e-9, atol=1e-12
+    )
+    np.testing.assert_allclose(
+        compiled.predict(test_rows), model.predict_proba(test_rows)[:, 1], rtol=1e-9, atol=1e-12
+    )
+
+
+@pytest.mark.parametrize("missing", MISSING_PARAMS)
+def test_ranking_matches_lightgbm(missing, test_rows):
+    X, signal = sample_data(3000, seed=0)
+    labels = np.clip(signal + 2, 0, 5).astype(int)
+    model = LGBMRanker(**PARAMS, **MISSING_PARAMS[missing]).fit(X, labels, group=[6] * (len(X) // 6))
+    compiled = CompiledTreeEnsemble.from_lightgbm(model)
+
+    assert compiled.sigmoid is None
+    np.testing.assert_allclose(compiled.predict_raw(test_rows), model.predict(test_rows), rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(compiled.predict(test_rows), model.predict(test_rows), rtol=1e-9, atol=1e-12)
+
+
+def test_single_race_batch_matches_lightgbm(test_rows):
+    """推論で使う6行の入力（欠損値のない行だけの場合を含む）"""
+    X, signal = sample_data(3000, seed=0)
+    model = LGBMClassifier(**PARAMS).fit(X, (signal > 0.5).astype(int))
+    compiled = CompiledTreeEnsemble.from_lightgbm(model)
+
+    complete = np.nan_to_num(test_rows[:6], nan=0.3)
+    for rows in (test_rows[:6], complete):
+        np.testing.assert_allclose(compiled.predict(rows), model.predict_proba(rows)[:, 1], rtol=1e-9, atol=1e-12)
+
+
+def test_rejects_multiclass():
+    X, signal = sample_data(600, seed=0)
+    model = LGBMClassifier(**{**PARAMS, "n_estimators": 3}).fit(X, np.digitize(signal, [-1, 1]))
+    with pytest.raises(ValueError):
+        CompiledTreeEnsemble.from_lightgbm(model)